@@ -11,6 +11,8 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+# Async-представления (core.asgi_urls) включаются явно:
+# DJANGO_SETTINGS_MODULE=core.settings_asgi
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_asgi_application()
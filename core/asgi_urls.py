@@ -0,0 +1,11 @@
+"""
+URL configuration for ASGI deployments (see core.settings_asgi):
+the same routes as core.urls, with async views for read-only pages.
+"""
+from django.contrib import admin
+from django.urls import path, include
+
+urlpatterns = [
+    path('admin/', admin.site.urls),
+    path('', include('credits.async_urls')),
+]
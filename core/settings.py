@@ -10,8 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+import django
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -43,6 +47,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'credits.middleware.PerformanceMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -51,11 +56,13 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Async-представления под ASGI - с DJANGO_SETTINGS_MODULE=core.settings_asgi (core.asgi_urls)
 ROOT_URLCONF = 'core.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates с замером времени рендера (credits.middleware)
+        'BACKEND': 'credits.middleware.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -75,13 +82,92 @@ WSGI_APPLICATION = 'core.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+# Профиль базы выбирается переменной окружения CREDITS_DB:
+#   sqlite (по умолчанию) - файл SQLite в режиме WAL для установки на одном узле;
+#   postgresql - параметры подключения из CREDITS_DB_NAME, CREDITS_DB_USER,
+#   CREDITS_DB_PASSWORD, CREDITS_DB_HOST, CREDITS_DB_PORT.
+DATABASE_PROFILE = os.environ.get('CREDITS_DB', 'sqlite')
+
+# PRAGMA для каждого нового соединения SQLite (см. credits.signals.configure_sqlite):
+# WAL не блокирует чтение на время записи, synchronous=NORMAL в режиме WAL
+# не теряет целостность при сбое, busy_timeout - ожидание блокировки записи
+# вместо немедленной ошибки "database is locked"
+CREDITS_SQLITE_PRAGMAS = {
+    'busy_timeout': 5000,
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64000,
+    'temp_store': 'MEMORY',
 }
 
+if DATABASE_PROFILE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('CREDITS_DB_NAME', BASE_DIR / 'db.sqlite3'),
+            # PRAGMA выполняются при открытии соединения, поэтому оно переиспользуется
+            'CONN_MAX_AGE': int(os.environ.get('CREDITS_DB_CONN_MAX_AGE', 60)),
+            'PRAGMAS': CREDITS_SQLITE_PRAGMAS,
+        }
+    }
+    if django.VERSION >= (5, 1):
+        # Блокировка записи берётся в начале транзакции, и busy_timeout
+        # действует на неё, а не на повышение блокировки посреди транзакции
+        DATABASES['default']['OPTIONS'] = {'transaction_mode': 'IMMEDIATE'}
+elif DATABASE_PROFILE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('CREDITS_DB_NAME', 'credits'),
+            'USER': os.environ.get('CREDITS_DB_USER', ''),
+            'PASSWORD': os.environ.get('CREDITS_DB_PASSWORD', ''),
+            'HOST': os.environ.get('CREDITS_DB_HOST', ''),
+            'PORT': os.environ.get('CREDITS_DB_PORT', ''),
+            # Постоянные соединения: не открывать новое на каждый запрос,
+            # но проверять перед повторным использованием после простоя
+            'CONN_MAX_AGE': int(os.environ.get('CREDITS_DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    # CREDITS_DB_POOL_SIZE > 0 - встроенный пул psycopg (Django 5.1+, пакет psycopg[pool])
+    pool_size = int(os.environ.get('CREDITS_DB_POOL_SIZE', 0))
+    if pool_size:
+        if django.VERSION < (5, 1):
+            raise ImproperlyConfigured(
+                'CREDITS_DB_POOL_SIZE требует Django 5.1+; для Django 4.2 используйте '
+                'PgBouncer и CREDITS_DB_PGBOUNCER=1'
+            )
+        DATABASES['default']['OPTIONS']['pool'] = {'min_size': 2, 'max_size': pool_size, 'timeout': 10}
+        # Пул сам держит соединения, постоянные соединения Django с ним несовместимы
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+    # PgBouncer в режиме transaction не сохраняет серверные курсоры между транзакциями
+    if os.environ.get('CREDITS_DB_PGBOUNCER'):
+        DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+else:
+    raise ImproperlyConfigured(f'Неизвестный профиль базы CREDITS_DB={DATABASE_PROFILE!r}')
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# CREDITS_REDIS_URL (например redis://127.0.0.1:6379/1, пакет redis) - кэш,
+# общий для всех процессов; без неё - LocMemCache каждого процесса
+if os.environ.get('CREDITS_REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['CREDITS_REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -122,4 +208,48 @@ STATIC_URL = 'static/'
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
-DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
\ No newline at end of file
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Замеры запросов (credits.middleware.PerformanceMiddleware):
+# доля запросов с заголовком Server-Timing и записью в лог credits.performance
+# (например 0.05); по умолчанию выключены, тесты замеров включают их override_settings
+CREDITS_PERF_SAMPLE_RATE = float(os.environ.get('CREDITS_PERF_SAMPLE_RATE', 0))
+
+# Реестр кредиторов в кэше (credits.registry): None - только при общем кэше
+# (CREDITS_REDIS_URL), с LocMemCache кредиторы читаются из базы; True/False - явно
+CREDITS_CREDITOR_REGISTRY = None
+
+# Документы договоров (credits.documents): рекомендуемый размер части и
+# наибольший размер файла при загрузке частями, отдача файлов веб-сервером:
+# None - через Django (Range поддерживается), 'x-accel-redirect' (nginx,
+# internal-location по префиксу) или 'x-sendfile' (Apache mod_xsendfile, lighttpd)
+CREDITS_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+CREDITS_UPLOAD_MAX_SIZE = 512 * 1024 * 1024
+CREDITS_DOCUMENT_SENDFILE = None
+CREDITS_DOCUMENT_ACCEL_PREFIX = '/protected/'
+
+# Удаление кредиторов и договоров (credits.deletion): портфелей в одной
+# транзакции и запуск задания в потоке сразу после пометки на удаление.
+# Поток теряется при перезапуске рабочего процесса, поэтому команда
+# process_deletions обязательна и в обоих режимах запускается по расписанию
+# (cron, systemd timer); при False задания выполняет только она
+CREDITS_DELETE_BATCH_SIZE = 1000
+CREDITS_DELETION_THREAD = True
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'credits.performance': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
@@ -0,0 +1,9 @@
+"""
+Opt-in settings for ASGI deployments (DJANGO_SETTINGS_MODULE=core.settings_asgi
+with core/asgi.py): core.settings with the URLconf whose read-only pages
+are served by async views.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+ROOT_URLCONF = 'core.asgi_urls'
@@ -1,30 +1,252 @@
-from django.contrib import admin
-from .models import Agreement, Portfolio, Creditor
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Sum
+from django.forms.models import BaseInlineFormSet
+from django.http import QueryDict
+from django.utils.functional import cached_property
+from .deletion import DeletionError, schedule_deletion
+from .models import Agreement, DeletionJob, DeletionStatus, Portfolio, Creditor, rebuild_portfolio_labels
+from .search import normalize_query, search_agreements
+
+
+# Ниже этого числа строк оценке не доверяем и считаем точно
+ESTIMATE_THRESHOLD = 10_000
+
+
+def estimated_count(model, using):
+    """
+    Оценка числа строк таблицы без её чтения: статистика PostgreSQL
+    (reltuples, обновляется autovacuum/ANALYZE) или наибольший rowid SQLite.
+    None - оценки нет.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'sqlite':
+            cursor.execute(f'SELECT MAX(rowid) FROM {connection.ops.quote_name(table)}')
+        else:
+            return None
+        row = cursor.fetchone()
+    return row[0] if row and row[0] and row[0] > 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор списка в админке: для списка без фильтров и поиска число
+    строк большой таблицы берётся из оценки, а не из COUNT(*) по всей таблице.
+    base_queryset - список без фильтров (get_queryset админки).
+    """
+
+    def __init__(self, *args, base_queryset=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.base_queryset = base_queryset
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        base = self.base_queryset if self.base_queryset is not None else queryset.model._default_manager.all()
+        unfiltered = queryset.query.where == base.query.where
+        if unfiltered:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= ESTIMATE_THRESHOLD:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Без второго COUNT(*) по всей таблице ради «N из M»
+    show_full_result_count = False
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        return self.paginator(
+            queryset, per_page, orphans, allow_empty_first_page, base_queryset=self.get_queryset(request)
+        )
+
+
+class SearchAgreementsMixin:
+    """Поиск в админке по индексу поиска договоров (credits.search), а не LIKE по колонкам"""
+    agreement_lookup = None
+
+    def get_search_results(self, request, queryset, search_term):
+        query = normalize_query(search_term)
+        if not query:
+            return queryset, False
+        agreements = search_agreements(Agreement.objects.all(), query)
+        if self.agreement_lookup:
+            return queryset.filter(**{self.agreement_lookup: agreements.values('pk')}), False
+        return search_agreements(queryset, query), False
+
+
+class BackgroundDeleteMixin:
+    """
+    Удаление через фоновое задание (credits.deletion) вместо каскада в запросе.
+    Страница подтверждения не собирает все связанные строки, а показывает
+    число портфелей из агрегатов договоров.
+    """
+
+    def portfolio_total(self, objs):
+        raise NotImplementedError
+
+    def get_deleted_objects(self, objs, request):
+        objs = list(objs)
+        total = self.portfolio_total(objs)
+        opts = self.model._meta
+        deleted = [f"{opts.verbose_name}: {obj} (портфелей: {total[obj.pk]})" for obj in objs]
+        model_count = {opts.verbose_name_plural: len(objs), Portfolio._meta.verbose_name_plural: sum(total.values())}
+        perms_needed = set() if self.has_delete_permission(request) else {opts.verbose_name}
+        return deleted, model_count, perms_needed, []
+
+    def delete_model(self, request, obj):
+        try:
+            schedule_deletion(obj)
+        except DeletionError as e:
+            self.message_user(request, str(e), messages.ERROR)
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            self.delete_model(request, obj)
+
+    def log_deletion(self, request, obj, object_repr):
+        super().log_deletion(request, obj, f"{object_repr} (в фоне)")
+
+
+class PaginatedInlineFormSet(BaseInlineFormSet):
+    """
+    Формы только для одной страницы связанных строк (page_number задаёт
+    админка). Ссылки на соседние страницы сохраняют остальные параметры
+    запроса (query), например _changelist_filters.
+    """
+    per_page = 20
+    page_number = 1
+    page_param = "page"
+    query = None
+
+    def page_url(self, number):
+        query = self.query.copy() if self.query is not None else QueryDict(mutable=True)
+        query[self.page_param] = number
+        return f"?{query.urlencode()}"
+
+    @property
+    def previous_page_url(self):
+        return self.page_url(self.page.previous_page_number())
+
+    @property
+    def next_page_url(self):
+        return self.page_url(self.page.next_page_number())
+
+    def get_queryset(self):
+        if not hasattr(self, 'page'):
+            paginator = Paginator(super().get_queryset(), self.per_page)
+            self.page = paginator.get_page(self.page_number)
+            self._queryset = self.page.object_list
+        return self._queryset
+
 
 # ваш класс PortfolioInline и AgreementAdmin
 class PortfolioInline(admin.TabularInline):
     model = Portfolio
+    formset = PaginatedInlineFormSet
+    template = "admin/credits/paginated_tabular.html"
+    page_param = "portfolio_page"
+    fields = ["label", "process_type", "total_sum", "date_placement", "date_finish", "cession_date"]
+    ordering = ["date_placement", "id"]
+    show_change_link = True
     extra = 1
 
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.page_number = request.GET.get(self.page_param) or 1
+        formset.page_param = self.page_param
+        formset.query = request.GET
+        return formset
+
 
 @admin.register(Agreement)
-class AgreementAdmin(admin.ModelAdmin):
+class AgreementAdmin(SearchAgreementsMixin, BackgroundDeleteMixin, LargeTableAdmin):
     list_display = [
         "id", "agreement_code", "agreement_date", "agreement_type",
         "creditor", "creditor_first", "total_sum", "total_amount",
         "date_add", "date_update",
     ]
+    list_select_related = ["creditor", "creditor_first"]
+    # Индексы (agreement_type, id); поиск - по индексу поиска договоров
+    list_filter = ["agreement_type"]
+    search_fields = ["agreement_code", "creditor__name"]
+    autocomplete_fields = ["creditor", "creditor_first"]
     ordering = ["id"]
     inlines = [PortfolioInline]
+    actions = ["rebuild_labels"]
+
+    def portfolio_total(self, objs):
+        return {obj.pk: obj.portfolio_count for obj in objs}
+
+    @admin.action(description="Перестроить наименования портфелей")
+    def rebuild_labels(self, request, queryset):
+        updated = rebuild_portfolio_labels(Portfolio.objects.filter(agreement__in=queryset))
+        self.message_user(request, f"Обновлено наименований: {updated}", messages.SUCCESS)
+
+
+@admin.register(Portfolio)
+class PortfolioAdmin(SearchAgreementsMixin, LargeTableAdmin):
+    list_display = ["id", "label", "agreement", "process_type", "total_sum", "date_placement", "date_finish"]
+    list_select_related = ["agreement"]
+    # Индекс (process_type, id); поиск - портфели договоров, найденных по индексу
+    list_filter = ["process_type"]
+    search_fields = ["agreement__agreement_code"]
+    agreement_lookup = "agreement__in"
+    autocomplete_fields = ["agreement"]
+    ordering = ["-id"]
+
+    def get_queryset(self, request):
+        # Портфели договоров, помеченных на удаление, ждут фонового удаления (как в API)
+        return super().get_queryset(request).filter(agreement__deleted_at__isnull=True)
 
-admin.site.register(Portfolio) 
 
 @admin.register(Creditor)
-class CreditorAdmin(admin.ModelAdmin):
+class CreditorAdmin(BackgroundDeleteMixin, LargeTableAdmin):
     list_display = [
         "id", 
         "type", "name",
         "date_add", "date_update",
     ]
+    list_filter = ["type"]
+    # Поиск - по префиксу наименования через индекс name_key (get_search_results)
+    search_fields = ["name"]
     ordering = ["id"]
- 
+    actions = ["rebuild_labels"]
+
+    def get_search_results(self, request, queryset, search_term):
+        return queryset.name_prefix(search_term), False
+
+    def portfolio_total(self, objs):
+        totals = dict(
+            Agreement.all_objects.filter(creditor__in=objs)
+            .values_list("creditor").annotate(n=Sum("portfolio_count")).order_by()
+        )
+        return {obj.pk: totals.get(obj.pk) or 0 for obj in objs}
+
+    @admin.action(description="Перестроить наименования портфелей")
+    def rebuild_labels(self, request, queryset):
+        updated = rebuild_portfolio_labels(Portfolio.objects.filter(agreement__creditor__in=queryset))
+        self.message_user(request, f"Обновлено наименований: {updated}", messages.SUCCESS)
+
+
+@admin.register(DeletionJob)
+class DeletionJobAdmin(admin.ModelAdmin):
+    list_display = ["id", "label", "model", "status", "deleted", "total", "date_add", "date_update"]
+    list_filter = ["status", "model"]
+    ordering = ["-id"]
+    readonly_fields = [field.name for field in DeletionJob._meta.fields]
+    actions = ["retry"]
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description="Повторить (process_deletions)")
+    def retry(self, request, queryset):
+        requeued = queryset.filter(status=DeletionStatus.FAILED).update(status=DeletionStatus.PENDING, error="")
+        self.message_user(request, f"Возвращено в очередь: {requeued}", messages.SUCCESS)
@@ -0,0 +1,393 @@
+"""
+Версионированный JSON API только для чтения: /api/v1/<ресурс>/.
+
+Списки листаются курсором по id (?after=, ?limit=), поля выбираются
+параметром ?fields=. ETag и Last-Modified строятся по date_update строк
+ответа, поэтому повторный опрос без изменений получает 304 без тела.
+Last-Modified списка учитывает и последнее удаление (Tombstone, DeletionJob):
+удалённая строка не сдвигает date_update оставшихся.
+"""
+import hashlib
+import json
+from dataclasses import dataclass, field
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, HttpResponseNotAllowed, JsonResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+
+from .changes import ChangeCursor, read_changes
+from .models import Agreement, Creditor, DeletionJob, Portfolio, Tombstone
+from .pagination import PAGE_SIZE, decode_cursor, encode_cursor
+
+
+API_VERSION = 'v1'
+MAX_LIMIT = 500
+
+
+@dataclass(frozen=True)
+class Resource:
+    model: type
+    fields: tuple
+    # GET-параметр -> поле для фильтра по равенству
+    filters: dict = field(default_factory=dict)
+    # Условие видимости строк сверх менеджера по умолчанию
+    scope: dict = field(default_factory=dict)
+    # Поле файла -> имя URL представления, отдающего файл по id строки
+    downloads: dict = field(default_factory=dict)
+
+    def attname(self, name):
+        """Имя колонки в values(): для внешних ключей - <поле>_id"""
+        return self.model._meta.get_field(name).attname
+
+
+RESOURCES = {
+    'agreements': Resource(
+        Agreement,
+        (
+            'id', 'creditor', 'creditor_first', 'agreement_code', 'agreement_date',
+            'agreement_type', 'total_sum', 'total_amount', 'portfolio_count',
+            'portfolio_total_sum', 'portfolio_date_first', 'portfolio_date_last',
+            'agreement_doc', 'date_add', 'date_update',
+        ),
+        {'creditor': 'creditor_id'},
+        downloads={'agreement_doc': 'credits:agreement-document'},
+    ),
+    'portfolios': Resource(
+        Portfolio,
+        (
+            'id', 'agreement', 'label', 'type', 'process_type', 'total_sum',
+            'date_placement', 'date_finish', 'cession_date', 'date_add', 'date_update',
+        ),
+        {'agreement': 'agreement_id'},
+        # Портфели договоров, помеченных на удаление, ждут фонового удаления
+        {'agreement__deleted_at__isnull': True},
+    ),
+    'creditors': Resource(
+        Creditor,
+        ('id', 'type', 'name', 'date_add', 'date_update'),
+    ),
+}
+
+
+class ApiError(Exception):
+    pass
+
+
+def _resource(name):
+    try:
+        return RESOURCES[name]
+    except KeyError:
+        raise Http404
+
+
+def _selected_fields(request, resource):
+    """Поля из ?fields=; id и date_update нужны всегда - для курсора и ETag"""
+    raw = request.GET.get('fields')
+    if not raw:
+        return list(resource.fields)
+    names = [name.strip() for name in raw.split(',') if name.strip()]
+    unknown = [name for name in names if name not in resource.fields]
+    if unknown:
+        raise ApiError('Неизвестные поля: ' + ', '.join(unknown))
+    return ['id'] + [name for name in names if name != 'id']
+
+
+def _limit(request):
+    raw = request.GET.get('limit')
+    if raw is None:
+        return PAGE_SIZE
+    if not raw.isdigit() or not 1 <= int(raw) <= MAX_LIMIT:
+        raise ApiError(f'limit должен быть от 1 до {MAX_LIMIT}')
+    return int(raw)
+
+
+def _row_serializer(resource, fields, request=None):
+    """
+    (колонки для values(), функция строка -> (date_update, словарь с именами полей API)).
+    Файлы отдаются ссылкой на представление загрузки (Content-Disposition,
+    Range, sendfile), абсолютной при известном request.
+    """
+    columns = {name: resource.attname(name) for name in fields}
+    files = {name: url_name for name, url_name in resource.downloads.items() if name in columns}
+
+    def convert(row):
+        item = {name: row[column] for name, column in columns.items()}
+        for name, url_name in files.items():
+            if item[name]:
+                url = reverse(url_name, args=[row['id']])
+                item[name] = request.build_absolute_uri(url) if request is not None else url
+            else:
+                item[name] = None
+        return row['date_update'], item
+
+    return set(columns.values()) | {'date_update'}, convert
+
+
+def serialize_rows(resource, queryset, fields, request=None):
+    """Строки как словари с именами полей API; модели не создаются"""
+    values, convert = _row_serializer(resource, fields, request)
+    for row in queryset.values(*values):
+        yield convert(row)
+
+
+async def aserialize_rows(resource, queryset, fields, request=None):
+    """serialize_rows для async-представлений: строки читаются async ORM"""
+    values, convert = _row_serializer(resource, fields, request)
+    return [convert(row) async for row in queryset.values(*values)]
+
+
+def _deletion_dates(resource):
+    """
+    Запросы последних удалений, которые могут убрать строки ресурса:
+    записи об удалении модели и задания удаления (пометка кредитора или
+    договора скрывает и его договоры и портфели). Оба идут по индексу.
+    """
+    return (
+        Tombstone.objects.filter(model=resource.model._meta.model_name)
+        .order_by('-date_deleted').values_list('date_deleted', flat=True),
+        DeletionJob.objects.order_by('-id').values_list('date_add', flat=True),
+    )
+
+
+def last_deletion(resource):
+    return max(filter(None, [queryset.first() for queryset in _deletion_dates(resource)]), default=None)
+
+
+async def alast_deletion(resource):
+    return max(filter(None, [await queryset.afirst() for queryset in _deletion_dates(resource)]), default=None)
+
+
+def _conditional_json(request, payload, versions, variant, deleted=None):
+    """
+    JsonResponse с ETag/Last-Modified по (id, date_update) строк ответа
+    или 304, если у клиента актуальная версия. variant - всё остальное,
+    от чего зависит тело ответа (выбранные поля, ссылка на следующую страницу).
+    deleted - время последнего удаления: без него клиент с одним
+    If-Modified-Since получал бы 304 после удаления строк.
+    """
+    digest = hashlib.sha1(
+        json.dumps([API_VERSION, variant, versions], cls=DjangoJSONEncoder).encode()
+    ).hexdigest()
+    etag = quote_etag(digest)
+    last_modified = max([updated for _, updated in versions] + ([deleted] if deleted else []), default=None)
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = JsonResponse(payload, json_dumps_params={'ensure_ascii': False})
+    response.headers['ETag'] = etag
+    if timestamp is not None:
+        response.headers['Last-Modified'] = http_date(timestamp)
+    # Кэши обязаны перепроверять ответ на каждом опросе
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def _error(message, status=400):
+    return JsonResponse({'error': message}, status=status, json_dumps_params={'ensure_ascii': False})
+
+
+def list_query(request, resource):
+    """
+    Запрос страницы списка по GET-параметрам: (queryset на limit + 1 строк,
+    поля, limit). ApiError при некорректных параметрах.
+    """
+    fields = _selected_fields(request, resource)
+    limit = _limit(request)
+
+    queryset = resource.model.objects.filter(**resource.scope).order_by('id')
+    for param, lookup in resource.filters.items():
+        value = request.GET.get(param)
+        if value is not None:
+            if not value.isdigit():
+                raise ApiError(f'{param} должен быть числом')
+            queryset = queryset.filter(**{lookup: value})
+
+    after = request.GET.get('after')
+    if after:
+        position = decode_cursor(after, 'id')
+        if position is None:
+            raise ApiError('Некорректный курсор')
+        queryset = queryset.filter(id__gt=position[1])
+    return queryset[:limit + 1], fields, limit
+
+
+def list_response(request, rows, fields, limit, deleted=None):
+    """
+    Ответ со страницей списка по строкам serialize_rows (их на одну больше
+    limit, если есть ещё); deleted - last_deletion() ресурса.
+    """
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_url = None
+    if has_more:
+        params = request.GET.copy()
+        params['after'] = encode_cursor('id', [], rows[-1][1]['id'])
+        next_url = request.build_absolute_uri(f'{request.path}?{params.urlencode()}')
+
+    payload = {'results': [item for _, item in rows], 'next': next_url}
+    versions = [(item['id'], updated) for updated, item in rows]
+    return _conditional_json(request, payload, versions, [fields, next_url], deleted)
+
+
+def detail_response(request, rows, pk, fields):
+    if not rows:
+        return _error('Не найдено', status=404)
+    updated, item = rows[0]
+    return _conditional_json(request, item, [(pk, updated)], fields)
+
+
+@require_safe
+def list_view(request, resource_name):
+    resource = _resource(resource_name)
+    try:
+        queryset, fields, limit = list_query(request, resource)
+    except ApiError as e:
+        return _error(str(e))
+    rows = list(serialize_rows(resource, queryset, fields, request))
+    return list_response(request, rows, fields, limit, last_deletion(resource))
+
+
+@require_safe
+def detail_view(request, resource_name, pk):
+    resource = _resource(resource_name)
+    try:
+        fields = _selected_fields(request, resource)
+    except ApiError as e:
+        return _error(str(e))
+
+    rows = list(serialize_rows(resource, resource.model.objects.filter(pk=pk, **resource.scope), fields, request))
+    return detail_response(request, rows, pk, fields)
+
+
+def changes_cursor(request):
+    """Курсор ленты из ?cursor= или ?since=; без них - с самого начала. ApiError при ошибке"""
+    if request.GET.get('cursor'):
+        cursor = ChangeCursor.decode(request.GET['cursor'])
+        if cursor is None:
+            raise ApiError('Некорректный курсор')
+        return cursor
+    if request.GET.get('since'):
+        since = parse_datetime(request.GET['since'])
+        if since is None:
+            raise ApiError('since должен быть датой и временем в ISO 8601')
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        return ChangeCursor.since(since)
+    return ChangeCursor()
+
+
+def read_resource_changes(resource, cursor, limit, request=None):
+    return read_changes(
+        resource.model,
+        cursor,
+        limit,
+        lambda queryset: serialize_rows(resource, queryset, list(resource.fields), request),
+        scope=resource.scope,
+    )
+
+
+def changes_response(changes, position, limit):
+    return JsonResponse(
+        {'results': changes, 'cursor': position.encode(), 'more': len(changes) == limit},
+        json_dumps_params={'ensure_ascii': False},
+    )
+
+
+@require_safe
+def changes_view(request, resource_name):
+    """
+    Лента изменений ресурса: ?cursor= из предыдущего ответа или ?since=<ISO-время>
+    для первого запроса; без них - с самого начала.
+    """
+    resource = _resource(resource_name)
+    try:
+        limit = _limit(request)
+        cursor = changes_cursor(request)
+    except ApiError as e:
+        return _error(str(e))
+
+    changes, position = read_resource_changes(resource, cursor, limit, request)
+    return changes_response(changes, position, limit)
+
+
+def index_payload(request):
+    return {
+        'version': API_VERSION,
+        'resources': {
+            name: {
+                'url': request.build_absolute_uri(reverse('credits:api-list', args=[name])),
+                'changes': request.build_absolute_uri(reverse('credits:api-changes', args=[name])),
+                'fields': list(resource.fields),
+                'filters': list(resource.filters),
+            }
+            for name, resource in RESOURCES.items()
+        },
+    }
+
+
+@require_safe
+def index_view(request):
+    """Список ресурсов API и их полей"""
+    return JsonResponse(index_payload(request))
+
+
+# Те же представления для ASGI (credits.async_urls): строки читаются async ORM
+
+def require_safe_async(view):
+    """require_safe для async-представлений: декоратор Django 4.2 их не поддерживает"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+@require_safe_async
+async def async_list_view(request, resource_name):
+    resource = _resource(resource_name)
+    try:
+        queryset, fields, limit = list_query(request, resource)
+    except ApiError as e:
+        return _error(str(e))
+    rows = await aserialize_rows(resource, queryset, fields, request)
+    return list_response(request, rows, fields, limit, await alast_deletion(resource))
+
+
+@require_safe_async
+async def async_detail_view(request, resource_name, pk):
+    resource = _resource(resource_name)
+    try:
+        fields = _selected_fields(request, resource)
+    except ApiError as e:
+        return _error(str(e))
+
+    rows = await aserialize_rows(resource, resource.model.objects.filter(pk=pk, **resource.scope), fields, request)
+    return detail_response(request, rows, pk, fields)
+
+
+@require_safe_async
+async def async_changes_view(request, resource_name):
+    resource = _resource(resource_name)
+    try:
+        limit = _limit(request)
+        cursor = changes_cursor(request)
+    except ApiError as e:
+        return _error(str(e))
+
+    changes, position = await sync_to_async(read_resource_changes)(resource, cursor, limit, request)
+    return changes_response(changes, position, limit)
+
+
+@require_safe_async
+async def async_index_view(request):
+    return JsonResponse(index_payload(request))
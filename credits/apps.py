@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class CreditsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'credits'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .search import restore_search_index
+
+        post_migrate.connect(restore_search_index, sender=self)
@@ -0,0 +1,28 @@
+"""
+Маршруты приложения для ASGI (core.asgi_urls): дашборд, фрагмент портфелей
+и API обслуживают async-представления, выгрузка и документы отдаются
+асинхронным потоком (credits.concurrency.stream_async), остальные
+страницы - те же синхронные.
+"""
+from django.urls import path
+
+from . import api, documents, urls, views
+
+app_name = urls.app_name
+
+ASYNC_VIEWS = {
+    'dashboard': views.async_dashboard_view,
+    'agreement-portfolios': views.async_agreement_portfolios_view,
+    'export': views.async_export_view,
+    'agreement-document': documents.async_document_download_view,
+    'api-index': api.async_index_view,
+    'api-list': api.async_list_view,
+    'api-changes': api.async_changes_view,
+    'api-detail': api.async_detail_view,
+}
+
+urlpatterns = [
+    path(str(pattern.pattern), ASYNC_VIEWS[pattern.name], name=pattern.name)
+    if pattern.name in ASYNC_VIEWS else pattern
+    for pattern in urls.urlpatterns
+]
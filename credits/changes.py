@@ -0,0 +1,121 @@
+"""
+Лента изменений: созданные и изменённые строки после водяного знака
+(date_update, id) и удаления из Tombstone, в порядке времени.
+
+Ограничения:
+- date_update ставится при записи, а не при фиксации. Строки моложе
+  CHANGE_FEED_LAG не отдаются, но изменение из транзакции, которая шла
+  дольше CHANGE_FEED_LAG, может зафиксироваться позади уже выданного
+  водяного знака и в ленту не попасть. Долгие массовые операции поэтому
+  пишут пачками в отдельных транзакциях (credits.deletion, импорт),
+  а клиенту, которому нужна полная гарантия, нужна периодическая сверка
+  по списку /api/v1/<ресурс>/.
+- Записи об удалении хранятся ограниченное время (prune_tombstones):
+  клиент, не читавший ленту дольше этого срока, должен перечитать ресурс целиком.
+
+Кредиторы и договоры, помеченные на удаление (credits.deletion), отдаются
+удалением сразу: пометка сдвигает date_update. Запись Tombstone после
+фонового удаления повторяет удаление.
+"""
+import base64
+import binascii
+import json
+from datetime import timedelta
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Tombstone
+from .pagination import keyset_filter
+
+
+# Строки моложе этого не отдаются: транзакция, начатая раньше, может
+# зафиксироваться позже и принести date_update меньше уже выданного.
+# Транзакции дольше этого срока лента может пропустить (см. выше)
+CHANGE_FEED_LAG = timedelta(seconds=5)
+
+
+class ChangeCursor:
+    """Позиции в двух потоках: изменённые строки и удаления"""
+
+    def __init__(self, updated=None, updated_id=0, deleted=None, deleted_id=0):
+        self.updated, self.updated_id = updated, updated_id
+        self.deleted, self.deleted_id = deleted, deleted_id
+
+    @classmethod
+    def since(cls, moment):
+        return cls(moment, 0, moment, 0)
+
+    def encode(self):
+        raw = json.dumps([
+            self.updated and self.updated.isoformat(), self.updated_id,
+            self.deleted and self.deleted.isoformat(), self.deleted_id,
+        ])
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @classmethod
+    def decode(cls, cursor):
+        """Разбирает курсор; None, если он повреждён"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            updated, updated_id, deleted, deleted_id = json.loads(raw)
+            updated = updated and parse_datetime(updated)
+            deleted = deleted and parse_datetime(deleted)
+        except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+            return None
+        if not isinstance(updated_id, int) or not isinstance(deleted_id, int):
+            return None
+        return cls(updated or None, updated_id, deleted or None, deleted_id)
+
+
+def _after(queryset, field, moment, pk):
+    if moment is None:
+        return queryset
+    return queryset.filter(keyset_filter([field], [moment], pk, greater=True))
+
+
+def read_changes(model, cursor, limit, serialize, lag=None, scope=None):
+    """
+    До limit изменений модели после cursor, по времени, и курсор для
+    следующего вызова. Изменение - словарь с op 'upsert' (data - строка,
+    полученная serialize) или 'delete'. Каждый поток читается по своему
+    индексу: (date_update, id) модели и (model, date_deleted, id) удалений.
+    serialize(queryset) возвращает пары (date_update, строка с ключом id).
+    scope - условие видимости строк (Resource.scope): строки вне него
+    в ленту не попадают.
+    """
+    horizon = timezone.now() - (CHANGE_FEED_LAG if lag is None else lag)
+    # Помеченные на удаление строки читаются вместе с остальными
+    manager = getattr(model, 'all_objects', model.objects)
+    updated = _after(
+        manager.filter(date_update__lte=horizon, **(scope or {})), 'date_update', cursor.updated, cursor.updated_id
+    ).order_by('date_update', 'id')[:limit]
+    deleted = _after(
+        Tombstone.objects.filter(model=model._meta.model_name, date_deleted__lte=horizon),
+        'date_deleted', cursor.deleted, cursor.deleted_id,
+    ).order_by('date_deleted', 'id')[:limit]
+
+    rows = list(serialize(updated))
+    marked = set()
+    if manager is not model.objects and rows:
+        marked = set(manager.filter(
+            pk__in=[row['id'] for _, row in rows], deleted_at__isnull=False
+        ).values_list('pk', flat=True))
+
+    changes = sorted(
+        [(moment, row['id'], True,
+          {'op': 'delete', 'id': row['id'], 'date': moment} if row['id'] in marked
+          else {'op': 'upsert', 'id': row['id'], 'date': moment, 'data': row})
+         for moment, row in rows]
+        + [(moment, pk, False, {'op': 'delete', 'id': object_id, 'date': moment})
+           for pk, object_id, moment in deleted.values_list('id', 'object_id', 'date_deleted')],
+        key=lambda change: change[0],
+    )[:limit]
+
+    position = ChangeCursor(cursor.updated, cursor.updated_id, cursor.deleted, cursor.deleted_id)
+    for moment, pk, is_row, change in changes:
+        if is_row:
+            position.updated, position.updated_id = moment, pk
+        else:
+            position.deleted, position.deleted_id = moment, pk
+    return [change for _, _, _, change in changes], position
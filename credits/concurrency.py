@@ -0,0 +1,37 @@
+"""
+Async-представления под ASGI.
+
+stream_async отдаёт под ASGI потоковые ответы синхронных представлений
+частями, а не целиком.
+"""
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+
+
+# Частей потокового ответа за один переход в поток запроса
+STREAM_BATCH_SIZE = 256
+
+
+def _next_batch(iterator, size):
+    return list(islice(iterator, size))
+
+
+async def _stream_batches(iterator, size):
+    next_batch = sync_to_async(_next_batch)
+    while batch := await next_batch(iterator, size):
+        for part in batch:
+            yield part
+
+
+def stream_async(response, batch_size=STREAM_BATCH_SIZE):
+    """
+    Django 4.2 под ASGI собирает синхронное содержимое StreamingHttpResponse
+    и FileResponse в список целиком и только потом отправляет. Здесь оно
+    заменяется асинхронным итератором: части читаются пачками по batch_size
+    в потоке запроса, где живут его соединения с базой и открытый файл.
+    Остальные ответы возвращаются как есть.
+    """
+    if response.streaming and not response.is_async:
+        response.streaming_content = _stream_batches(iter(response.streaming_content), batch_size)
+    return response
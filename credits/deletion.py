@@ -0,0 +1,138 @@
+"""
+Удаление кредиторов и договоров с большим числом портфелей.
+
+Agreement.delete() с каскадом загружает все портфели договора в память и
+удаляет их в одной транзакции, занимая обработчик запроса и блокируя
+таблицу. Здесь удаление идёт в два шага:
+
+1. schedule_deletion помечает запись (и договоры кредитора) deleted_at -
+   менеджеры по умолчанию сразу перестают её возвращать, а лента изменений
+   отдаёт её удалением (date_update сдвигается тем же UPDATE), - и создаёт
+   DeletionJob. Портфели помеченных договоров скрыты в API, ленте и
+   админке условием на договор;
+2. run_deletion удаляет портфели, затем договоры и кредитора пачками по
+   CREDITS_DELETE_BATCH_SIZE, каждая пачка в своей транзакции, и
+   записывает прогресс в задание. post_delete (записи об удалении, ссылки
+   на документы) по-прежнему приходит для каждой строки.
+
+Задание запускается в потоке после фиксации транзакции
+(CREDITS_DELETION_THREAD), но поток не переживает перезапуск рабочего
+процесса, поэтому команда process_deletions должна выполняться
+периодически: она подбирает и новые, и прерванные задания.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import Agreement, Creditor, DeletionJob, DeletionStatus, Portfolio
+
+
+logger = logging.getLogger(__name__)
+
+
+class DeletionError(Exception):
+    pass
+
+
+def batch_size():
+    return getattr(settings, 'CREDITS_DELETE_BATCH_SIZE', 1000)
+
+
+def schedule_deletion(obj):
+    """
+    Помечает кредитора или договор на удаление и ставит задание в очередь.
+    DeletionError, если кредитор - первоначальный кредитор чужих договоров.
+    """
+    if isinstance(obj, Creditor):
+        protected = Agreement.all_objects.filter(creditor_first=obj).exclude(creditor=obj)
+        if protected.exists():
+            raise DeletionError(
+                f"{obj} - первоначальный кредитор договоров других кредиторов, удаление невозможно"
+            )
+    now = timezone.now()
+    with transaction.atomic():
+        type(obj).all_objects.filter(pk=obj.pk).update(deleted_at=now, date_update=now)
+        if isinstance(obj, Creditor):
+            Agreement.all_objects.filter(creditor=obj, deleted_at__isnull=True).update(
+                deleted_at=now, date_update=now
+            )
+            total = Agreement.all_objects.filter(creditor=obj).aggregate(n=Sum('portfolio_count'))['n'] or 0
+        else:
+            total = obj.portfolio_count
+        job = DeletionJob.objects.create(
+            model=obj._meta.model_name, object_id=obj.pk, label=str(obj)[:250], total=total
+        )
+        transaction.on_commit(lambda: start_deletion(job.pk))
+    obj.deleted_at = obj.date_update = now
+    return job
+
+
+def start_deletion(job_id):
+    if getattr(settings, 'CREDITS_DELETION_THREAD', True):
+        threading.Thread(target=_run_in_thread, args=(job_id,), name=f'deletion-{job_id}', daemon=True).start()
+
+
+def _run_in_thread(job_id):
+    try:
+        run_deletion(job_id)
+    finally:
+        # У потока свои соединения с базой
+        connections.close_all()
+
+
+def _delete_in_batches(queryset, job=None):
+    """Удаляет строки queryset пачками по batch_size(), каждую в своей транзакции"""
+    removed = 0
+    while True:
+        with transaction.atomic():
+            pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size()])
+            if not pks:
+                return removed
+            # Агрегаты договоров, помеченных на удаление, не пересчитываются:
+            # refresh_portfolio_aggregates обновляет договоры через менеджер по умолчанию
+            queryset.filter(pk__in=pks).delete()
+            if job is not None:
+                DeletionJob.objects.filter(pk=job.pk).update(
+                    deleted=F('deleted') + len(pks), date_update=timezone.now()
+                )
+        removed += len(pks)
+
+
+def run_deletion(job_id):
+    """
+    Выполняет задание, если оно в очереди. Возвращает задание
+    с итоговым состоянием или None, если его уже выполняет другой процесс.
+    """
+    claimed = DeletionJob.objects.filter(pk=job_id, status=DeletionStatus.PENDING).update(
+        status=DeletionStatus.RUNNING, date_update=timezone.now()
+    )
+    if not claimed:
+        return None
+    job = DeletionJob.objects.get(pk=job_id)
+    try:
+        if job.model == Creditor._meta.model_name:
+            _delete_in_batches(Portfolio.objects.filter(agreement__creditor_id=job.object_id), job)
+            _delete_in_batches(Agreement.all_objects.filter(creditor_id=job.object_id))
+            Creditor.all_objects.filter(pk=job.object_id).delete()
+        else:
+            _delete_in_batches(Portfolio.objects.filter(agreement_id=job.object_id), job)
+            Agreement.all_objects.filter(pk=job.object_id).delete()
+    except Exception as e:
+        logger.exception('Удаление %s прервано', job.label)
+        job.status, job.error = DeletionStatus.FAILED, str(e)
+    else:
+        job.status = DeletionStatus.DONE
+    job.deleted = DeletionJob.objects.values_list('deleted', flat=True).get(pk=job.pk)
+    job.save(update_fields=['status', 'error', 'deleted', 'date_update'])
+    return job
+
+
+def requeue_stale(older_than):
+    """Возвращает в очередь задания, прерванные остановкой процесса (без прогресса дольше older_than)"""
+    return DeletionJob.objects.filter(
+        status=DeletionStatus.RUNNING, date_update__lt=timezone.now() - older_than
+    ).update(status=DeletionStatus.PENDING)
@@ -0,0 +1,370 @@
+"""
+Документы договоров: загрузка частями с продолжением после обрыва и отдача
+файла с поддержкой Range.
+
+Загрузка: POST uploads/ {filename, size, sha256?} создаёт DocumentUpload;
+части отправляются PUT uploads/<id>/ с заголовком Content-Range и
+(необязательно) X-Chunk-SHA256. Каждая часть пишется в свой временный
+файл и становится видна под именем по позиции только после того, как
+запрос занял эту позицию в базе, - параллельная попытка с той же позиции
+не может испортить принятые байты. После последней части файлы частей
+склеиваются в файл загрузки с подсчётом SHA-256 всего файла; если сборка
+оборвалась, её повторяет следующий GET или PUT. GET uploads/<id>/
+возвращает принятый размер - с него клиент продолжает загрузку. Готовая загрузка привязывается к договору полем document_upload
+формы договора.
+
+Отдача: при CREDITS_DOCUMENT_SENDFILE файл отдаёт веб-сервер
+(X-Accel-Redirect для nginx, X-Sendfile для Apache/lighttpd), иначе -
+FileResponse с поддержкой одного диапазона Range.
+"""
+import glob
+import hashlib
+import json
+import os
+import re
+import uuid
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404, redirect
+from django.urls import reverse
+from django.utils.http import content_disposition_header
+from django.views.decorators.http import require_http_methods, require_POST, require_safe
+
+from .concurrency import stream_async
+from .models import Agreement, DocumentUpload
+
+
+UPLOAD_DIR = 'uploads/partial'
+READ_SIZE = 1024 * 1024
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# Часть больше MAX_CHUNK_FACTOR рекомендуемых размеров не принимается
+MAX_CHUNK_FACTOR = 4
+
+
+def chunk_size():
+    """Рекомендуемый размер части"""
+    return getattr(settings, 'CREDITS_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024)
+
+
+def max_upload_size():
+    """Наибольший размер загружаемого файла"""
+    return getattr(settings, 'CREDITS_UPLOAD_MAX_SIZE', 512 * 1024 * 1024)
+
+
+def part_path(upload):
+    """Собранный файл загрузки"""
+    return default_storage.path(f'{UPLOAD_DIR}/{upload.pk}.part')
+
+
+def chunk_path(upload, start):
+    """Принятая часть, начинающаяся с позиции start"""
+    return default_storage.path(f'{UPLOAD_DIR}/{upload.pk}.{start:015d}.chunk')
+
+
+def upload_chunks(upload):
+    """[(позиция, путь)] принятых частей по порядку"""
+    pattern = os.path.join(glob.escape(default_storage.path(UPLOAD_DIR)), f'{upload.pk}.*.chunk')
+    return sorted((int(os.path.basename(path).split('.')[1]), path) for path in glob.glob(pattern))
+
+
+def remove_upload_files(upload):
+    """Удаляет все файлы загрузки: части, недописанные части и собранный файл"""
+    pattern = os.path.join(glob.escape(default_storage.path(UPLOAD_DIR)), f'{upload.pk}.*')
+    for path in glob.glob(pattern):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def write_chunk(upload, stream, start, end, total, chunk_sha256=None):
+    """
+    Пишет байты start..end (включительно) из stream в файл части.
+    Часть принимается только с текущей позиции загрузки: повтор уже
+    принятой части или пропуск - ошибка 409 с актуальной позицией.
+    Часть пишется во временный файл, затем занимается позиция в базе
+    и только после этого файл переименовывается в принятую часть: оборванная
+    часть просто отправляется заново, а проигравшая параллельная попытка
+    удаляет только свой временный файл.
+    """
+    if upload.complete:
+        raise UploadError('Загрузка уже завершена', status=409)
+    if total != upload.size or end < start or end >= upload.size:
+        raise UploadError('Content-Range не соответствует размеру файла')
+    if start != upload.offset:
+        raise UploadError(f'Ожидается часть с позиции {upload.offset}', status=409)
+    length = end - start + 1
+    if length > chunk_size() * MAX_CHUNK_FACTOR:
+        raise UploadError(f'Часть больше {chunk_size() * MAX_CHUNK_FACTOR} байт', status=413)
+
+    path = chunk_path(upload, start)
+    temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    digest = hashlib.sha256()
+    written = 0
+    try:
+        with open(temp_path, 'wb') as f:
+            while written < length:
+                block = stream.read(min(READ_SIZE, length - written))
+                if not block:
+                    break
+                f.write(block)
+                digest.update(block)
+                written += len(block)
+        if written != length:
+            raise UploadError('Тело запроса короче диапазона Content-Range')
+        if chunk_sha256 and digest.hexdigest() != chunk_sha256.lower():
+            raise UploadError('Контрольная сумма части не совпадает')
+
+        # Параллельная попытка с той же позиции проигрывает
+        updated = DocumentUpload.objects.filter(pk=upload.pk, offset=start).update(offset=end + 1)
+        if not updated:
+            raise UploadError('Часть уже принята другим запросом', status=409)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    upload.offset = end + 1
+    if upload.offset == upload.size:
+        finish_upload(upload)
+
+
+def _restart_upload(upload):
+    DocumentUpload.objects.filter(pk=upload.pk).update(offset=0)
+    upload.offset = 0
+    remove_upload_files(upload)
+
+
+def _assemble(upload):
+    """Склеивает части в файл загрузки; (SHA-256, None) или (None, причина перезапуска)"""
+    chunks = upload_chunks(upload)
+    digest = hashlib.sha256()
+    assembled = 0
+    with open(part_path(upload), 'wb') as out:
+        for start, path in chunks:
+            if start != assembled:
+                break
+            with open(path, 'rb') as f:
+                while block := f.read(READ_SIZE):
+                    out.write(block)
+                    digest.update(block)
+                    assembled += len(block)
+    if assembled != upload.size:
+        return None, 'Принятые части не складываются в файл'
+    actual = digest.hexdigest()
+    if upload.sha256 and upload.sha256 != actual:
+        return None, 'Контрольная сумма файла не совпадает'
+    for _, path in chunks:
+        os.remove(path)
+    return actual, None
+
+
+def finish_upload(upload):
+    """
+    Склеивает принятые части в файл загрузки, считая SHA-256. Если части
+    не покрывают файл подряд или хэш не совпал с заявленным, загрузка
+    начинается заново. Строка загрузки блокируется: сборку, начатую
+    последней частью, не повторит одновременный запрос её статуса.
+    """
+    with transaction.atomic():
+        locked = DocumentUpload.objects.select_for_update().get(pk=upload.pk)
+        upload.offset, upload.complete = locked.offset, locked.complete
+        if upload.complete or upload.offset != upload.size:
+            upload.sha256 = locked.sha256
+            return
+        actual, error = _assemble(upload)
+        if error is None:
+            upload.sha256 = actual
+            upload.complete = True
+            upload.save(update_fields=['sha256', 'complete', 'date_update'])
+        else:
+            _restart_upload(upload)
+    if error is not None:
+        raise UploadError(f'{error}, загрузите файл заново', status=422)
+
+
+class AssembledFile(File):
+    """Собранный файл загрузки: хранилище переносит его на место без копирования"""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def attach_upload(agreement, upload):
+    """Переносит завершённую загрузку в документ договора (договор не сохраняется)"""
+    with open(part_path(upload), 'rb') as f:
+        document = AssembledFile(f, name=upload.filename)
+        agreement.agreement_doc.save(upload.filename, document, save=False)
+    if os.path.exists(part_path(upload)):
+        os.remove(part_path(upload))
+    upload.delete()
+
+
+def upload_status(upload):
+    return {
+        'id': str(upload.pk),
+        'filename': upload.filename,
+        'size': upload.size,
+        'offset': upload.offset,
+        'complete': upload.complete,
+        'sha256': upload.sha256 or None,
+        'chunk_size': chunk_size(),
+        'url': reverse('credits:document-upload', args=[upload.pk]),
+    }
+
+
+def _error(message, status=400):
+    return JsonResponse({'error': message}, status=status, json_dumps_params={'ensure_ascii': False})
+
+
+@require_POST
+def upload_create_view(request):
+    """Starts a chunked upload: {"filename", "size", "sha256"?} -> upload status"""
+    try:
+        data = json.loads(request.body)
+        filename = os.path.basename(str(data['filename']))[:255]
+        size = int(data['size'])
+    except (ValueError, KeyError, TypeError):
+        return _error('Ожидается JSON с filename и size')
+    sha256 = str(data.get('sha256') or '').lower()
+    if not filename or size < 1:
+        return _error('Пустое имя файла или размер')
+    if size > max_upload_size():
+        return _error(f'Файл больше {max_upload_size()} байт', status=413)
+    if sha256 and not re.fullmatch(r'[0-9a-f]{64}', sha256):
+        return _error('sha256 должен быть шестнадцатеричной строкой из 64 символов')
+
+    upload = DocumentUpload.objects.create(filename=filename, size=size, sha256=sha256)
+    return JsonResponse(upload_status(upload), status=201, json_dumps_params={'ensure_ascii': False})
+
+
+@require_http_methods(['GET', 'HEAD', 'PUT'])
+def upload_view(request, upload_id):
+    """Upload status (GET) or the next chunk (PUT with Content-Range)"""
+    upload = get_object_or_404(DocumentUpload, pk=upload_id)
+    if request.method == 'PUT':
+        match = CONTENT_RANGE_RE.match(request.headers.get('Content-Range', ''))
+        if not match:
+            return _error('Нужен заголовок Content-Range: bytes <начало>-<конец>/<размер>')
+    try:
+        if upload.offset == upload.size and not upload.complete:
+            # Все части приняты, но процесс оборвался до сборки файла:
+            # собираем его здесь, иначе загрузку нельзя было бы завершить
+            finish_upload(upload)
+        elif request.method == 'PUT':
+            start, end, total = map(int, match.groups())
+            # Тело читается потоком: request.body держал бы всю часть в памяти
+            write_chunk(upload, request, start, end, total, request.headers.get('X-Chunk-SHA256'))
+    except UploadError as e:
+        upload.refresh_from_db()
+        response = _error(str(e), status=e.status)
+        response.headers['Upload-Offset'] = upload.offset
+        return response
+    return JsonResponse(upload_status(upload), json_dumps_params={'ensure_ascii': False})
+
+
+def _parse_range(header, size):
+    """(начало, конец) включительно для одного диапазона bytes=; None - отдать файл целиком"""
+    match = RANGE_RE.match(header or '')
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # bytes=-N: последние N байт
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise ValueError
+    return start, end
+
+
+class FileRange:
+    """Часть открытого файла для FileResponse"""
+
+    def __init__(self, f, start, length):
+        self.file, self.remaining = f, length
+        self.name = f.name
+        f.seek(start)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+@require_safe
+def document_download_view(request, pk):
+    """Agreement document: through the web server (sendfile) or as a ranged FileResponse"""
+    agreement = get_object_or_404(Agreement.objects.only('id', 'agreement_doc'), pk=pk)
+    document = agreement.agreement_doc
+    if not document:
+        raise Http404
+    filename = os.path.basename(document.name)
+
+    mode = getattr(settings, 'CREDITS_DOCUMENT_SENDFILE', None)
+    if mode:
+        response = HttpResponse()
+        if mode == 'x-accel-redirect':
+            prefix = getattr(settings, 'CREDITS_DOCUMENT_ACCEL_PREFIX', '/protected/')
+            response.headers['X-Accel-Redirect'] = quote(prefix + document.storage.stored_name(document.name))
+        else:
+            response.headers['X-Sendfile'] = document.path
+        # Тип и Range обрабатывает веб-сервер
+        del response.headers['Content-Type']
+        response.headers['Content-Disposition'] = content_disposition_header(False, filename)
+        return response
+
+    try:
+        path = document.path
+    except NotImplementedError:
+        # Хранилище без локальных путей отдаёт файлы само
+        return redirect(document.url)
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        raise Http404
+    size = os.fstat(f.fileno()).st_size
+    try:
+        byte_range = _parse_range(request.headers.get('Range'), size)
+    except ValueError:
+        f.close()
+        response = HttpResponse(status=416)
+        response.headers['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if byte_range is None:
+        response = FileResponse(f, filename=filename)
+    else:
+        start, end = byte_range
+        response = FileResponse(FileRange(f, start, end - start + 1), filename=filename, status=206)
+        response.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response.headers['Content-Length'] = end - start + 1
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+
+async def async_document_download_view(request, pk):
+    """Agreement document for ASGI: the file is read in batches instead of being buffered whole"""
+    return stream_async(await sync_to_async(document_download_view)(request, pk))
@@ -1,8 +1,55 @@
+import copy
+
 from django import forms
-from .models import Agreement, Portfolio
+from django.core.paginator import Paginator
+from django.urls import reverse_lazy
+from .documents import attach_upload
+from .models import Agreement, DocumentUpload, Portfolio, PortfolioProcessTypes
+from .registry import get_creditors
+
+
+class CreditorAutocompleteWidget(forms.Select):
+    """
+    Выбор кредитора с подсказками по началу наименования
+    (credits:creditor-autocomplete). В разметку попадает только выбранный
+    кредитор, а не весь реестр: вес страницы и число запросов не растут
+    вместе с числом кредиторов.
+    """
+    template_name = 'credits/widgets/creditor_autocomplete.html'
+    url = reverse_lazy('credits:creditor-autocomplete')
+
+    def __init__(self, attrs=None, creditor_type=None):
+        super().__init__(attrs)
+        self.creditor_type = creditor_type
+
+    def optgroups(self, name, value, attrs=None):
+        options = []
+        if not self.is_required:
+            options.append(self.create_option(name, '', '---------', not any(value), 0))
+        selected = [int(v) for v in value if str(v).isdigit()]
+        # Выбранные кредиторы - из реестра в кэше, без перебора всех кредиторов
+        for creditor in get_creditors(selected).values():
+            options.append(self.create_option(name, creditor.pk, str(creditor), True, len(options)))
+        return [(None, options, 0)]
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        widget = context['widget']
+        widget['attrs']['data-autocomplete-url'] = self.url
+        if self.creditor_type is not None:
+            widget['attrs']['data-creditor-type'] = self.creditor_type
+        widget['selected_label'] = next(
+            (option['label'] for _, group, _ in widget['optgroups'] for option in group
+             if option['selected'] and option['value'] != ''),
+            '',
+        )
+        return context
 
 
 class AgreementForm(forms.ModelForm):
+    # Документ, загруженный частями (credits.documents), вместо файла в самой форме
+    document_upload = forms.UUIDField(required=False, widget=forms.HiddenInput)
+
     class Meta:
         model = Agreement
         fields = [
@@ -31,12 +78,72 @@ class AgreementForm(forms.ModelForm):
                 'class': 'form-control'
             }),
             'agreement_code': forms.TextInput(attrs={'class': 'form-control'}),
-            'creditor': forms.Select(attrs={'class': 'form-select'}),
-            'creditor_first': forms.Select(attrs={'class': 'form-select'}),
+            'creditor': CreditorAutocompleteWidget(),
+            'creditor_first': CreditorAutocompleteWidget(),
             'agreement_type': forms.Select(attrs={'class': 'form-select'}),
             'agreement_doc': forms.FileInput(attrs={'class': 'form-control'}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.data.get(self.add_prefix('document_upload')):
+            # Файл уже загружен частями - поле файла в форме может быть пустым
+            self.fields['agreement_doc'].required = False
+
+    def clean_document_upload(self):
+        upload_id = self.cleaned_data['document_upload']
+        if upload_id is None:
+            return None
+        upload = DocumentUpload.objects.filter(pk=upload_id, complete=True).first()
+        if upload is None:
+            raise forms.ValidationError("Загрузка документа не завершена, загрузите файл заново")
+        return upload
+
+    def attach_document(self, agreement):
+        """Переносит документ, загруженный частями, в договор (до его сохранения)"""
+        upload = self.cleaned_data.get('document_upload')
+        if upload is not None:
+            attach_upload(agreement, upload)
+
+    def save(self, commit=True):
+        agreement = super().save(commit=False)
+        self.attach_document(agreement)
+        if commit:
+            agreement.save()
+        return agreement
+
+
+class AgreementFilterForm(forms.Form):
+    """Фильтры списка договоров по агрегатам портфелей (GET-параметры дашборда)"""
+    portfolio_count_min = forms.IntegerField(
+        label="Портфелей от", required=False, min_value=0,
+        widget=forms.NumberInput(attrs={'min': '0', 'class': 'form-control form-control-sm'}),
+    )
+    portfolio_sum_min = forms.DecimalField(
+        label="Стоимость портфелей от", required=False, max_digits=14, decimal_places=2,
+        widget=forms.NumberInput(attrs={'step': '0.01', 'class': 'form-control form-control-sm'}),
+    )
+    portfolio_sum_max = forms.DecimalField(
+        label="до", required=False, max_digits=14, decimal_places=2,
+        widget=forms.NumberInput(attrs={'step': '0.01', 'class': 'form-control form-control-sm'}),
+    )
+
+    lookups = {
+        'portfolio_count_min': 'portfolio_count__gte',
+        'portfolio_sum_min': 'portfolio_total_sum__gte',
+        'portfolio_sum_max': 'portfolio_total_sum__lte',
+    }
+
+    def filter(self, queryset):
+        # Некорректные значения просто не применяются
+        self.is_valid()
+        conditions = {
+            self.lookups[name]: value
+            for name, value in self.cleaned_data.items()
+            if value is not None
+        }
+        return queryset.filter(**conditions)
+
 
 class PortfolioForm(forms.ModelForm):
     class Meta:
@@ -77,4 +184,104 @@ class PortfolioForm(forms.ModelForm):
         
         # Если это редактирование, используем существующий объект
         if self.instance and self.instance.pk:
-            self.agreement = self.instance.agreement
\ No newline at end of file
+            self.agreement = self.instance.agreement
+
+
+class PortfolioSelectionForm(forms.Form):
+    """Отбор портфелей договора для массовой правки (GET-параметры страницы)"""
+    process_type = forms.TypedChoiceField(
+        label="Тип работы", required=False, coerce=int, empty_value=None,
+        choices=[('', "Любой"), *PortfolioProcessTypes.choices],
+        widget=forms.Select(attrs={'class': 'form-select'}),
+    )
+    placement_from = forms.DateField(
+        label="Передан с", required=False,
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}),
+    )
+    placement_to = forms.DateField(
+        label="Передан по", required=False,
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}),
+    )
+
+    lookups = {
+        'process_type': 'process_type',
+        'placement_from': 'date_placement__gte',
+        'placement_to': 'date_placement__lte',
+    }
+
+    def filter(self, queryset):
+        # Некорректные значения просто не применяются
+        self.is_valid()
+        conditions = {
+            self.lookups[name]: value
+            for name, value in self.cleaned_data.items()
+            if value is not None
+        }
+        return queryset.filter(**conditions)
+
+
+class PortfolioBulkForm(forms.Form):
+    """
+    Массовая правка выбранных портфелей договора: заполненные поля
+    записываются во все выбранные портфели, пустые не меняются.
+    Поля и их проверки - из PortfolioForm.
+
+    Выбираются портфели из queryset (по умолчанию - все портфели договора,
+    обычно - отобранные PortfolioSelectionForm). Флажками выводится одна
+    страница по page_size портфелей, select_all выбирает все подходящие.
+    """
+    edit_fields = ['process_type', 'total_sum', 'date_placement', 'date_finish', 'cession_date']
+    page_size = 100
+
+    select_all = forms.BooleanField(
+        label="Все подходящие под отбор",
+        required=False,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+    )
+    portfolios = forms.ModelMultipleChoiceField(
+        label="Портфели",
+        required=False,
+        queryset=Portfolio.objects.none(),
+        widget=forms.CheckboxSelectMultiple(attrs={'class': 'form-check-input'}),
+    )
+
+    def __init__(self, *args, agreement, queryset=None, page=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.agreement = agreement
+        if queryset is None:
+            queryset = agreement.portfolio_set.all()
+        self.matching = queryset.filter(agreement=agreement).order_by('date_placement', 'id')
+        field = self.fields['portfolios']
+        field.queryset = self.matching
+        # Проверяются все подходящие портфели, а выводятся только портфели страницы
+        self.page = Paginator(self.matching, self.page_size).get_page(page)
+        field.widget.choices = [(portfolio.pk, field.label_from_instance(portfolio)) for portfolio in self.page]
+        for name in self.edit_fields:
+            field = self.fields[name] = copy.deepcopy(PortfolioForm.base_fields[name])
+            field.required = False
+        self.fields['process_type'].choices = [('', "Не менять"), *PortfolioProcessTypes.choices]
+
+    def changes(self):
+        return {
+            name: self.cleaned_data[name]
+            for name in self.edit_fields
+            if self.cleaned_data.get(name) not in (None, '')
+        }
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('select_all') and 'portfolios' not in self.errors \
+                and not cleaned_data.get('portfolios'):
+            self.add_error('portfolios', "Не выбран ни один портфель")
+        if not self.errors and not self.changes():
+            raise forms.ValidationError("Не заполнено ни одно поле для изменения")
+        return cleaned_data
+
+    def selected(self):
+        if self.cleaned_data.get('select_all'):
+            return self.matching
+        return self.cleaned_data['portfolios']
+
+    def save(self):
+        """Применяет изменения к выбранным портфелям; возвращает их список"""
+        return self.selected().bulk_edit(**self.changes())
@@ -0,0 +1,63 @@
+"""
+Кэш HTML строк списка договоров на дашборде.
+
+Ключ строится из версий всего, что выводится в строке: date_update договора
+(его агрегаты портфелей - тоже), кредитора и первичного кредитора. Изменение
+любого из них даёт новый ключ, поэтому явная инвалидация не нужна: старые
+записи просто истекают.
+"""
+from dataclasses import dataclass
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import SafeString, mark_safe
+
+
+# Меняется вместе с разметкой шаблонов строки
+FRAGMENT_VERSION = 2
+FRAGMENT_TIMEOUT = 24 * 60 * 60
+
+
+@dataclass
+class AgreementRow:
+    agreement: object
+    info: SafeString
+    details: SafeString
+
+
+def _version(obj):
+    return f"{obj.pk}.{obj.date_update.timestamp()}" if obj is not None else "-"
+
+
+def fragment_key(agreement):
+    """Требует загруженных creditor и creditor_first (credits.registry.attach_creditors)"""
+    return "credits:agreement-row:{}:{}:{}:{}".format(
+        FRAGMENT_VERSION,
+        _version(agreement),
+        _version(agreement.creditor),
+        _version(agreement.creditor_first),
+    )
+
+
+def render_agreement_rows(agreements):
+    """
+    Строки списка договоров: все видимые фрагменты читаются из кэша одним
+    get_many, рендерятся только отсутствующие, и они же записываются одним set_many.
+    """
+    keys = {agreement.pk: fragment_key(agreement) for agreement in agreements}
+    cached = cache.get_many(keys.values())
+    missing = {}
+    rows = []
+    for agreement in agreements:
+        key = keys[agreement.pk]
+        if key in cached:
+            info, details = cached[key]
+        else:
+            context = {'a': agreement}
+            info = render_to_string('credits/agreement_row_info.html', context)
+            details = render_to_string('credits/agreement_row_details.html', context)
+            missing[key] = (str(info), str(details))
+        rows.append(AgreementRow(agreement, mark_safe(info), mark_safe(details)))
+    if missing:
+        cache.set_many(missing, FRAGMENT_TIMEOUT)
+    return rows
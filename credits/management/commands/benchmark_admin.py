@@ -0,0 +1,104 @@
+import json
+import time
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from credits.models import Agreement, AgreementTypes, PortfolioProcessTypes
+from credits.synthetic import generate, sizes_for
+
+from .benchmark_credits import allowed_host, summarize
+
+
+DEFAULT_SIZES = "10000,100000"
+
+
+class Command(BaseCommand):
+    help = (
+        "Замер задержки страниц админки (списки договоров, портфелей и кредиторов "
+        "с фильтрами и поиском, карточка договора с портфелями, автодополнение) "
+        "на синтетических данных. Данные создаются в транзакции и откатываются."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Размеры набора в портфелях через запятую")
+        parser.add_argument("--requests", type=int, default=20, help="Запросов на сценарий")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Файл для результатов (JSON)")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options["sizes"].split(",")]
+        except ValueError:
+            raise CommandError("--sizes должен быть списком чисел через запятую")
+        if min(sizes) < 1 or options["requests"] < 1:
+            raise CommandError("Размеры и --requests должны быть положительными")
+
+        results = {}
+        with override_settings(CREDITS_PERF_SAMPLE_RATE=0):
+            for size in sizes:
+                results[str(size)] = self.run_size(size, options)
+
+        if options["output"]:
+            report = {"requests": options["requests"], "results": results}
+            Path(options["output"]).write_text(json.dumps(report, ensure_ascii=False, indent=2))
+            self.stdout.write(f"Результаты сохранены в {options['output']}")
+
+    def run_size(self, size, options):
+        creditors, agreements = sizes_for(size)
+        results = {}
+        with transaction.atomic():
+            started = time.perf_counter()
+            generate(creditors, agreements, size, seed=options["seed"])
+            self.stdout.write(f"\n{size} портфелей: данные созданы за {time.perf_counter() - started:.1f} с")
+
+            user = get_user_model().objects.create_superuser("benchmark-admin", password=None)
+            client = Client(HTTP_HOST=allowed_host())
+            client.force_login(user)
+            largest = Agreement.objects.order_by("-portfolio_count", "id").first()
+
+            scenarios = {
+                "agreements": (reverse("admin:credits_agreement_changelist"), {}),
+                "agreements filtered": (
+                    reverse("admin:credits_agreement_changelist"), {"agreement_type__exact": AgreementTypes.OUTS}
+                ),
+                "agreements search": (
+                    reverse("admin:credits_agreement_changelist"), {"q": largest.agreement_code[-5:]}
+                ),
+                "portfolios": (reverse("admin:credits_portfolio_changelist"), {}),
+                "portfolios filtered": (
+                    reverse("admin:credits_portfolio_changelist"), {"process_type__exact": PortfolioProcessTypes.HARD}
+                ),
+                "creditors": (reverse("admin:credits_creditor_changelist"), {}),
+                f"agreement change ({largest.portfolio_count} portfolios)": (
+                    reverse("admin:credits_agreement_change", args=[largest.pk]), {}
+                ),
+                "creditor autocomplete": (reverse("admin:autocomplete"), {
+                    "term": largest.creditor.name[:3], "app_label": "credits",
+                    "model_name": "agreement", "field_name": "creditor",
+                }),
+            }
+
+            connection = connections["default"]
+            for name, (url, params) in scenarios.items():
+                timings, queries = [], 0
+                for _ in range(options["requests"]):
+                    with CaptureQueriesContext(connection) as captured:
+                        started = time.perf_counter()
+                        response = client.get(url, params)
+                        timings.append(time.perf_counter() - started)
+                    queries = len(captured)
+                    if response.status_code >= 400:
+                        raise CommandError(f"{name}: ответ {response.status_code}")
+                stats = results[name] = {**summarize(timings), "queries": queries}
+                self.stdout.write(
+                    f"  {name:<42} p50 {stats['p50_ms']:>8} мс  p99 {stats['p99_ms']:>8} мс  "
+                    f"запросов к базе: {queries}"
+                )
+            transaction.set_rollback(True)
+        return results
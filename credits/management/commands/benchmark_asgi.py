@@ -0,0 +1,181 @@
+import asyncio
+import io
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlencode
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.urls import reverse
+
+from credits.models import Agreement
+
+from .benchmark_credits import allowed_host, summarize
+
+
+# Режим -> (обработчик, корневые маршруты)
+MODES = {
+    "wsgi-sync": ("wsgi", "core.urls"),
+    "asgi-sync": ("asgi", "core.urls"),
+    "asgi-async": ("asgi", "core.asgi_urls"),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает пропускную способность дашборда, фрагмента портфелей и API "
+        "под WSGI (синхронные представления в пуле потоков, как у многопоточного "
+        "сервера) и под ASGI (синхронные и async-представления) при заданном "
+        "числе одновременных соединений. Обработчики Django вызываются в процессе, "
+        "без сети; читаются уже существующие данные (см. generate_credits)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", default="1,16,64", help="Одновременных соединений через запятую")
+        parser.add_argument("--requests", type=int, default=200, help="Запросов на сценарий")
+        parser.add_argument("--modes", default=",".join(MODES), help="Режимы через запятую")
+        parser.add_argument("--output", help="Файл для результатов (JSON)")
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(level) for level in options["concurrency"].split(",")]
+        except ValueError:
+            raise CommandError("--concurrency должен быть списком чисел через запятую")
+        if min(levels) < 1 or options["requests"] < 1:
+            raise CommandError("--concurrency и --requests должны быть положительными")
+        modes = options["modes"].split(",")
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            raise CommandError(f"Неизвестные режимы: {', '.join(sorted(unknown))}")
+
+        agreement = Agreement.objects.order_by("id").first()
+        if agreement is None:
+            raise CommandError("Нет договоров: сначала загрузите данные (generate_credits)")
+        self.host = allowed_host()
+        scenarios = {
+            "dashboard": (reverse("credits:dashboard"), {"agreement": agreement.pk}),
+            "portfolios fragment": (reverse("credits:agreement-portfolios", args=[agreement.pk]), {}),
+            "api list": (reverse("credits:api-list", args=["agreements"]), {"limit": 100}),
+            "api detail": (reverse("credits:api-detail", args=["agreements", agreement.pk]), {}),
+        }
+
+        results = {}
+        with override_settings(CREDITS_PERF_SAMPLE_RATE=0):
+            for mode in modes:
+                kind, urlconf = MODES[mode]
+                with override_settings(ROOT_URLCONF=urlconf):
+                    # Обработчик собирает цепочку middleware при создании - после смены настроек
+                    handler = WSGIHandler() if kind == "wsgi" else ASGIHandler()
+                    for level in levels:
+                        for name, (path, params) in scenarios.items():
+                            if kind == "wsgi":
+                                timings, elapsed = self.run_wsgi(handler, path, params, level, options["requests"])
+                            else:
+                                timings, elapsed = asyncio.run(
+                                    self.run_asgi(handler, path, params, level, options["requests"])
+                                )
+                            stats = summarize(timings)
+                            # Пропускная способность при параллельных соединениях - по общему времени
+                            stats["rps"] = round(len(timings) / elapsed, 1)
+                            results.setdefault(mode, {}).setdefault(str(level), {})[name] = stats
+                            self.stdout.write(
+                                f"{mode:<11} x{level:<4} {name:<20} {stats['rps']:>8} запр/с  "
+                                f"p50 {stats['p50_ms']:>8} мс  p99 {stats['p99_ms']:>8} мс"
+                            )
+
+        if options["output"]:
+            report = {"requests": options["requests"], "results": results}
+            Path(options["output"]).write_text(json.dumps(report, ensure_ascii=False, indent=2))
+            self.stdout.write(f"Результаты сохранены в {options['output']}")
+
+    def check_status(self, path, status):
+        if status >= 400:
+            raise CommandError(f"{path}: ответ {status}")
+
+    def run_wsgi(self, handler, path, params, concurrency, count):
+        query = urlencode(params)
+
+        def request():
+            environ = {
+                "REQUEST_METHOD": "GET",
+                "SCRIPT_NAME": "",
+                "PATH_INFO": path,
+                "QUERY_STRING": query,
+                "SERVER_NAME": self.host,
+                "SERVER_PORT": "80",
+                "SERVER_PROTOCOL": "HTTP/1.1",
+                "HTTP_HOST": self.host,
+                "wsgi.input": io.BytesIO(),
+                "wsgi.errors": sys.stderr,
+                "wsgi.url_scheme": "http",
+            }
+            status = []
+            started = time.perf_counter()
+            response = handler(environ, lambda line, headers: status.append(int(line.split()[0])))
+            try:
+                for _ in response:
+                    pass
+            finally:
+                response.close()
+            elapsed = time.perf_counter() - started
+            self.check_status(path, status[0])
+            return elapsed
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            timings = list(pool.map(lambda _: request(), range(count)))
+        return timings, time.perf_counter() - started
+
+    async def run_asgi(self, handler, path, params, concurrency, count):
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": urlencode(params).encode(),
+            "root_path": "",
+            "headers": [(b"host", self.host.encode())],
+            "client": ("127.0.0.1", 0),
+            "server": (self.host, 80),
+        }
+
+        async def request():
+            messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+            async def receive():
+                if messages:
+                    return messages.pop()
+                # Клиент не отключается до конца ответа
+                await asyncio.Future()
+
+            status = []
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    status.append(message["status"])
+
+            started = time.perf_counter()
+            await handler(dict(scope), receive, send)
+            elapsed = time.perf_counter() - started
+            self.check_status(path, status[0])
+            return elapsed
+
+        remaining = iter(range(count))
+        timings = []
+
+        async def connection():
+            # Одно соединение - запросы по очереди, как keep-alive клиента
+            for _ in remaining:
+                timings.append(await request())
+
+        started = time.perf_counter()
+        await asyncio.gather(*(connection() for _ in range(concurrency)))
+        return timings, time.perf_counter() - started
@@ -0,0 +1,181 @@
+import json
+import platform
+import statistics
+import time
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from credits.models import Agreement, Portfolio
+from credits.pagination import SORT_FIELDS
+from credits.synthetic import generate, sizes_for
+
+
+DEFAULT_SIZES = "1000,100000,1000000"
+
+
+def percentile(sorted_values, share):
+    """Перцентиль по ближайшему рангу"""
+    index = max(0, min(len(sorted_values) - 1, round(share * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def summarize(timings):
+    values = sorted(timings)
+    total = sum(values)
+    return {
+        "runs": len(values),
+        "mean_ms": round(statistics.fmean(values) * 1000, 2),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+        "p90_ms": round(percentile(values, 0.90) * 1000, 2),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2),
+        "rps": round(len(values) / total, 1) if total else None,
+    }
+
+
+def allowed_host():
+    """Имя хоста, которое пропустит ALLOWED_HOSTS"""
+    for host in settings.ALLOWED_HOSTS:
+        if host != "*":
+            return host.lstrip(".") or "localhost"
+    return "localhost"
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный замер дашборда (каждая сортировка), форм и каскадного удаления "
+        "на синтетических данных нескольких размеров в базе default. Данные создаются в транзакции "
+        "и откатываются; результаты пишутся в JSON и сравниваются с прошлым прогоном."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default=DEFAULT_SIZES,
+            help=f"Размеры набора в портфелях через запятую (по умолчанию {DEFAULT_SIZES})",
+        )
+        parser.add_argument("--requests", type=int, default=30, help="Запросов на сценарий")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Файл для результатов (JSON)")
+        parser.add_argument("--compare", help="Результаты прошлого прогона для сравнения")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=20.0,
+            help="Рост p50 в процентах, который считается регрессией",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options["sizes"].split(",")]
+        except ValueError:
+            raise CommandError("--sizes должен быть списком чисел через запятую")
+        if min(sizes) < 1 or options["requests"] < 1:
+            raise CommandError("Размеры и --requests должны быть положительными")
+        baseline = self.load_baseline(options["compare"])
+
+        report = {
+            "meta": {
+                "date": timezone.now().isoformat(),
+                "vendor": connection.vendor,
+                "database": connection.settings_dict["NAME"] and str(connection.settings_dict["NAME"]),
+                "django": django.get_version(),
+                "python": platform.python_version(),
+                "requests": options["requests"],
+            },
+            "results": {},
+        }
+        # Замеры middleware не должны искажать сравнение прогонов
+        with override_settings(CREDITS_PERF_SAMPLE_RATE=0):
+            for size in sizes:
+                report["results"][str(size)] = self.run_size(size, options)
+
+        if options["output"]:
+            Path(options["output"]).write_text(json.dumps(report, ensure_ascii=False, indent=2))
+            self.stdout.write(f"Результаты сохранены в {options['output']}")
+        if baseline:
+            self.compare(baseline, report, options["threshold"])
+
+    def load_baseline(self, path):
+        if not path:
+            return None
+        try:
+            return json.loads(Path(path).read_text())
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Не удалось прочитать {path}: {e}")
+
+    def run_size(self, size, options):
+        creditors, agreements = sizes_for(size)
+        results = {}
+        with transaction.atomic():
+            started = time.perf_counter()
+            generate(creditors, agreements, size, seed=options["seed"])
+            self.stdout.write(f"\n{size} портфелей: данные созданы за {time.perf_counter() - started:.1f} с")
+
+            client = Client(HTTP_HOST=allowed_host())
+            first = Agreement.objects.order_by("id").first()
+            # Договор с наибольшим числом портфелей - худший случай каскада
+            largest = Agreement.objects.order_by("-portfolio_count", "id").first()
+            portfolio = Portfolio.objects.filter(agreement=first).first()
+
+            scenarios = {
+                f"dashboard sort={sort}": (
+                    "get", reverse("credits:dashboard"), {"agreement": first.pk, "sort": sort}
+                )
+                for sort in SORT_FIELDS
+            }
+            scenarios["dashboard search"] = (
+                "get", reverse("credits:dashboard"), {"agreement": first.pk, "q": first.agreement_code[-4:]}
+            )
+            scenarios["agreement form"] = ("get", reverse("credits:agreement-edit", args=[first.pk]), {})
+            if portfolio:
+                scenarios["portfolio form"] = ("get", reverse("credits:portfolio-edit", args=[portfolio.pk]), {})
+            scenarios[f"delete cascade ({largest.portfolio_count} portfolios)"] = (
+                "post", reverse("credits:agreement-delete", args=[largest.pk]), {}
+            )
+
+            for name, (method, url, params) in scenarios.items():
+                timings = []
+                for _ in range(options["requests"]):
+                    # Каждый запрос в точке сохранения, откатываемой после замера:
+                    # удаление и правки не меняют набор данных для следующих
+                    savepoint = transaction.savepoint()
+                    started = time.perf_counter()
+                    response = getattr(client, method)(url, params)
+                    timings.append(time.perf_counter() - started)
+                    transaction.savepoint_rollback(savepoint)
+                    if response.status_code >= 400:
+                        raise CommandError(f"{name}: ответ {response.status_code}")
+                results[name] = summarize(timings)
+                stats = results[name]
+                self.stdout.write(
+                    f"  {name:<42} p50 {stats['p50_ms']:>8} мс  p90 {stats['p90_ms']:>8} мс  "
+                    f"p99 {stats['p99_ms']:>8} мс  {stats['rps']:>7} запр/с"
+                )
+            transaction.set_rollback(True)
+        return results
+
+    def compare(self, baseline, report, threshold):
+        regressions = []
+        for size, scenarios in report["results"].items():
+            for name, stats in scenarios.items():
+                before = baseline.get("results", {}).get(size, {}).get(name)
+                if not before or not before["p50_ms"]:
+                    continue
+                change = (stats["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100
+                if change > threshold:
+                    regressions.append(
+                        f"{size} / {name}: p50 {before['p50_ms']} -> {stats['p50_ms']} мс (+{change:.0f}%)"
+                    )
+        if regressions:
+            for line in regressions:
+                self.stderr.write(line)
+            raise CommandError(f"Регрессий: {len(regressions)}")
+        self.stdout.write(self.style.SUCCESS("Регрессий относительно прошлого прогона нет"))
@@ -0,0 +1,94 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from credits.templatetags.custom_filters import currency_format
+
+
+def float_currency_format(value):
+    """Прежняя реализация currency_format через float - эталон для сравнения"""
+    if value is None or value == '':
+        return '0,00 ₽'
+    try:
+        value = round(float(value), 2)
+        total_cents = int(value * 100)
+        rubles, kopecks = total_cents // 100, total_cents % 100
+        return f"{'{:,}'.format(rubles).replace(',', ' ')},{kopecks:02d} ₽"
+    except (ValueError, TypeError):
+        return str(value)
+
+
+def sample_values(count, seed=0, repeated=0.5):
+    """
+    Допустимые значения полей DecimalField(max_digits=10, decimal_places=2):
+    неотрицательные суммы до 99 999 999,99. Доля repeated берётся из небольшого
+    набора - суммы на дашборде часто повторяются.
+    """
+    rnd = random.Random(seed)
+    common = [Decimal(rnd.randrange(10 ** 10)) / 100 for _ in range(100)]
+    return [
+        rnd.choice(common) if rnd.random() < repeated else Decimal(rnd.randrange(10 ** 10)) / 100
+        for _ in range(count)
+    ]
+
+
+def _exact(cents):
+    return f"{'{:,}'.format(cents // 100).replace(',', ' ')},{cents % 100:02d} ₽"
+
+
+def compare(values):
+    """
+    Расхождения с прежней реализацией. Допускается только одно: float
+    терял копейку (0,29 -> 0,28), а новое значение точное.
+    Возвращает (число исправленных значений, список прочих расхождений).
+    """
+    fixed, other = 0, []
+    for value in values:
+        old, new = float_currency_format(value), currency_format(value)
+        if old == new:
+            continue
+        cents = int(value * 100)
+        if new == _exact(cents) and old == _exact(cents - 1):
+            fixed += 1
+        else:
+            other.append((value, old, new))
+    return fixed, other
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает currency_format с прежней реализацией через float: "
+        "скорость и совпадение результатов на случайных суммах"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--values", type=int, default=100_000, help="Количество значений")
+        parser.add_argument("--repeat", type=int, default=5, help="Количество замеров")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options["values"] < 1 or options["repeat"] < 1:
+            raise CommandError("--values и --repeat должны быть положительными")
+        values = sample_values(options["values"], options["seed"])
+
+        fixed, other = compare(values)
+        if other:
+            for value, old, new in other[:10]:
+                self.stderr.write(f"{value}: было «{old}», стало «{new}»")
+            raise CommandError(f"Неожиданных расхождений: {len(other)}")
+        self.stdout.write(f"Исправлено потерянных копеек: {fixed} из {len(values)}")
+
+        for name, func in (
+            ("float (прежний)", float_currency_format),
+            ("Decimal", currency_format),
+        ):
+            timings = []
+            for _ in range(options["repeat"]):
+                started = time.perf_counter()
+                for value in values:
+                    func(value)
+                timings.append(time.perf_counter() - started)
+            best = min(timings)
+            self.stdout.write(f"{name:<18} {best * 1e9 / len(values):8.0f} нс/значение")
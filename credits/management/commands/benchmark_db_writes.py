@@ -0,0 +1,198 @@
+import json
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connections, transaction
+
+from credits.models import Agreement, AgreementTypes, Creditor, CreditorType, Portfolio, PortfolioProcessTypes, PortfolioTypes
+
+from .benchmark_credits import summarize
+
+
+ALIAS = "write_benchmark"
+
+
+def sqlite_modes():
+    return {
+        # Как было: журнал отката, новое соединение на каждый запрос
+        "sqlite-default": {"CONN_MAX_AGE": 0},
+        "sqlite-wal": {"CONN_MAX_AGE": 60, "PRAGMAS": settings.CREDITS_SQLITE_PRAGMAS},
+    }
+
+
+def postgresql_modes(threads):
+    modes = {
+        "postgresql-per-request": {"CONN_MAX_AGE": 0, "CONN_HEALTH_CHECKS": False},
+        "postgresql-persistent": {"CONN_MAX_AGE": 60, "CONN_HEALTH_CHECKS": True},
+    }
+    if django.VERSION >= (5, 1):
+        modes["postgresql-pool"] = {
+            "CONN_MAX_AGE": 0,
+            "OPTIONS": {"pool": {"min_size": 2, "max_size": threads, "timeout": 10}},
+        }
+    return modes
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает пропускную способность параллельной записи портфелей "
+        "в разных режимах базы: SQLite с журналом отката и в режиме WAL, "
+        "PostgreSQL с новым соединением на запрос, постоянными соединениями и пулом. "
+        "Каждый режим пишет в отдельную временную базу."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8, help="Параллельных потоков записи")
+        parser.add_argument("--writes", type=int, default=200, help="Записей на поток")
+        parser.add_argument("--agreements", type=int, default=20, help="Договоров, между которыми делятся записи")
+        parser.add_argument(
+            "--database",
+            default="default",
+            help="Псевдоним PostgreSQL из DATABASES для режимов postgresql-* (SQLite замеряется всегда)",
+        )
+        parser.add_argument("--modes", help="Только эти режимы, через запятую")
+        parser.add_argument("--output", help="Файл для результатов (JSON)")
+
+    def handle(self, *args, **options):
+        if min(options["threads"], options["writes"], options["agreements"]) < 1:
+            raise CommandError("--threads, --writes и --agreements должны быть положительными")
+
+        base = connections[options["database"]].settings_dict
+        modes = {
+            name: {"ENGINE": "django.db.backends.sqlite3", **overrides}
+            for name, overrides in sqlite_modes().items()
+        }
+        if base["ENGINE"] == "django.db.backends.postgresql":
+            for name, overrides in postgresql_modes(options["threads"]).items():
+                config = {key: base[key] for key in ("ENGINE", "NAME", "USER", "PASSWORD", "HOST", "PORT")}
+                modes[name] = {**config, "OPTIONS": dict(base["OPTIONS"]), **overrides}
+        else:
+            self.stdout.write("Режимы PostgreSQL пропущены: --database указывает не на PostgreSQL")
+        if options["modes"]:
+            selected = options["modes"].split(",")
+            unknown = set(selected) - set(modes)
+            if unknown:
+                raise CommandError(f"Неизвестные или недоступные режимы: {', '.join(sorted(unknown))}")
+            modes = {name: modes[name] for name in selected}
+
+        results = {}
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, config in modes.items():
+                if config["ENGINE"] == "django.db.backends.sqlite3":
+                    config["NAME"] = str(Path(tmp) / f"{name}.sqlite3")
+                    config["TEST"] = {"NAME": config["NAME"]}
+                results[name] = self.run_mode(config, options)
+                stats = results[name]
+                self.stdout.write(
+                    f"{name:<24} {stats['writes_per_second']:>8} записей/с  "
+                    f"p50 {stats['p50_ms']:>7} мс  p99 {stats['p99_ms']:>8} мс  ошибок: {stats['errors']}"
+                )
+
+        if options["output"]:
+            report = {"threads": options["threads"], "writes": options["writes"], "results": results}
+            Path(options["output"]).write_text(json.dumps(report, ensure_ascii=False, indent=2))
+            self.stdout.write(f"Результаты сохранены в {options['output']}")
+
+    def run_mode(self, config, options):
+        """Создаёт временную базу с миграциями, пишет в неё из потоков и удаляет её"""
+        # create_test_db обращается к псевдониму и через settings.DATABASES
+        settings.DATABASES[ALIAS] = connections.configure_settings({"default": {}, ALIAS: config})[ALIAS]
+        connections.settings[ALIAS] = settings.DATABASES[ALIAS]
+        connection = connections[ALIAS]
+        old_name = connection.settings_dict["NAME"]
+        try:
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            with connection.cursor() as cursor:
+                journal_mode = None
+                if connection.vendor == "sqlite":
+                    cursor.execute("PRAGMA journal_mode")
+                    journal_mode = cursor.fetchone()[0]
+            agreement_ids = self.seed(options["agreements"])
+
+            timings, errors = [], []
+            lock = threading.Lock()
+            start = threading.Barrier(options["threads"])
+            workers = [
+                threading.Thread(
+                    target=self.worker,
+                    args=(agreement_ids[i::options["threads"]] or agreement_ids, options["writes"], start, lock,
+                          timings, errors),
+                )
+                for i in range(options["threads"])
+            ]
+            started = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - started
+            written = Portfolio.objects.using(ALIAS).count()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            connection.close()
+            del connections[ALIAS]
+            connections.settings.pop(ALIAS, None)
+            settings.DATABASES.pop(ALIAS, None)
+
+        return {
+            **summarize(timings or [0.0]),
+            "journal_mode": journal_mode,
+            "written": written,
+            "errors": len(errors),
+            "first_error": errors[0] if errors else None,
+            "writes_per_second": round(written / elapsed, 1),
+        }
+
+    def seed(self, count):
+        creditor = Creditor.objects.using(ALIAS).create(type=CreditorType.BANK, name="Кредитор для замера")
+        agreements = Agreement.objects.using(ALIAS).bulk_create(
+            Agreement(
+                creditor=creditor,
+                agreement_code=f"ЗАМЕР-{i + 1:04d}",
+                agreement_date=datetime(2024, 1, 1, 12, tzinfo=timezone.utc),
+                agreement_type=AgreementTypes.CESS,
+                total_amount=Decimal("1000000.00"),
+            )
+            for i in range(count)
+        )
+        return [agreement.pk for agreement in agreements]
+
+    def worker(self, agreement_ids, writes, start, lock, timings, errors):
+        """
+        Один поток - последовательность запросов на запись. После каждого
+        соединение закрывается или остаётся открытым так же, как по сигналу
+        request_finished, поэтому CONN_MAX_AGE и пул влияют на результат.
+        """
+        connection = connections[ALIAS]
+        local_timings, local_errors = [], []
+        start.wait()
+        try:
+            for i in range(writes):
+                started = time.perf_counter()
+                try:
+                    with transaction.atomic(using=ALIAS):
+                        Portfolio(
+                            agreement_id=agreement_ids[i % len(agreement_ids)],
+                            label="Замер",
+                            type=PortfolioTypes.CESS,
+                            process_type=PortfolioProcessTypes.SOFT,
+                            total_sum=Decimal("1000.00"),
+                            date_placement=date(2024, 1, 1),
+                        ).save(using=ALIAS)
+                except DatabaseError as e:
+                    local_errors.append(str(e))
+                else:
+                    local_timings.append(time.perf_counter() - started)
+                connection.close_if_unusable_or_obsolete()
+        finally:
+            connection.close()
+            with lock:
+                timings.extend(local_timings)
+                errors.extend(local_errors)
@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from credits.reports import build_portfolio_report
+from credits.synthetic import generate, sizes_for
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет построение отчёта по портфелям на синтетических данных. "
+        "Данные создаются в транзакции и откатываются после замера."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000, help="Количество портфелей")
+        parser.add_argument("--agreements", type=int, default=1000, help="Количество договоров")
+        parser.add_argument("--repeat", type=int, default=3, help="Количество замеров")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options["rows"] < 1 or options["agreements"] < 1 or options["repeat"] < 1:
+            raise CommandError("--rows, --agreements и --repeat должны быть положительными")
+
+        with transaction.atomic():
+            started = time.perf_counter()
+            creditors, _ = sizes_for(options["rows"])
+            generate(creditors, options["agreements"], options["rows"], seed=options["seed"])
+            self.stdout.write(f"Данные созданы за {time.perf_counter() - started:.1f} с")
+
+            timings = []
+            for _ in range(options["repeat"]):
+                started = time.perf_counter()
+                rows = build_portfolio_report()
+                timings.append(time.perf_counter() - started)
+            best = min(timings)
+            self.stdout.write(
+                f"Портфелей: {options['rows']}, строк отчёта: {len(rows)}, "
+                f"лучшее время: {best:.2f} с ({options['rows'] / best:,.0f} портфелей/с)"
+            )
+            transaction.set_rollback(True)
@@ -0,0 +1,44 @@
+import os
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from credits.documents import UPLOAD_DIR, remove_upload_files
+from credits.models import DocumentUpload
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаляет загрузки документов частями, которые не менялись дольше --hours часов "
+        "(брошенные или так и не привязанные к договору), вместе с их файлами."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=int, default=48, help="Возраст загрузки в часах")
+
+    def handle(self, *args, **options):
+        if options["hours"] < 1:
+            raise CommandError("--hours должен быть положительным")
+
+        cutoff = timezone.now() - timedelta(hours=options["hours"])
+        stale = DocumentUpload.objects.filter(date_update__lt=cutoff)
+        removed = 0
+        for upload in stale.iterator():
+            remove_upload_files(upload)
+            removed += 1
+        stale.delete()
+
+        # Файлы без записи о загрузке (например, после сбоя между удалением и записью);
+        # свежие не трогаем - их загрузка могла начаться после чтения списка
+        # Имена файлов загрузки начинаются с её id: <id>.part, <id>.<позиция>.chunk[...]
+        known = {str(pk) for pk in DocumentUpload.objects.values_list("pk", flat=True)}
+        orphans = 0
+        if default_storage.exists(UPLOAD_DIR):
+            for name in default_storage.listdir(UPLOAD_DIR)[1]:
+                path = default_storage.path(f"{UPLOAD_DIR}/{name}")
+                if name.split(".", 1)[0] not in known and os.path.getmtime(path) < cutoff.timestamp():
+                    default_storage.delete(f"{UPLOAD_DIR}/{name}")
+                    orphans += 1
+        self.stdout.write(self.style.SUCCESS(f"Удалено загрузок: {removed}, файлов без загрузки: {orphans}"))
@@ -0,0 +1,68 @@
+import os
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.db.models.functions import Substr
+from django.utils import timezone
+
+from credits.models import Agreement, DocumentBlob
+from credits.storage import BLOB_DIR, blob_name, collect_blob, document_storage
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчитывает ссылки договоров на содержимое документов в хранилище по хэшу, "
+        "удаляет содержимое без ссылок и файлы без записи старше --hours часов "
+        "(например, оставшиеся после отката транзакции)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=int, default=24, help="Возраст файла без записи в часах")
+
+    def handle(self, *args, **options):
+        if options["hours"] < 1:
+            raise CommandError("--hours должен быть положительным")
+
+        # sha256/<хэш>/<имя>: хэш - символы 8..71
+        counts = dict(
+            Agreement.all_objects.filter(agreement_doc__regex=r"^sha256/[0-9a-f]{64}/")
+            .annotate(digest=Substr("agreement_doc", 8, 64))
+            .values("digest")
+            .annotate(n=Count("id"))
+            .values_list("digest", "n")
+        )
+        fixed = 0
+        for blob in DocumentBlob.objects.iterator():
+            actual = counts.pop(blob.digest, 0)
+            if blob.references != actual:
+                DocumentBlob.objects.filter(digest=blob.digest).update(references=actual)
+                fixed += 1
+        for digest, actual in counts.items():
+            path = document_storage.path(blob_name(digest))
+            if os.path.exists(path):
+                DocumentBlob.objects.create(digest=digest, size=os.path.getsize(path), references=actual)
+                fixed += 1
+            else:
+                self.stderr.write(f"Нет файла содержимого {digest} ({actual} договоров)")
+
+        collected = sum(
+            collect_blob(digest)
+            for digest in DocumentBlob.objects.filter(references__lte=0).values_list("digest", flat=True)
+        )
+
+        # Файлы без записи; свежие не трогаем - их запись могла ещё не зафиксироваться
+        cutoff = (timezone.now() - timedelta(hours=options["hours"])).timestamp()
+        known = set(DocumentBlob.objects.values_list("digest", flat=True))
+        orphans = 0
+        root = document_storage.path(BLOB_DIR)
+        for directory, _, files in os.walk(root):
+            for name in files:
+                path = os.path.join(directory, name)
+                if name not in known and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    orphans += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"Исправлено счётчиков: {fixed}, удалено содержимого без ссылок: {collected}, "
+            f"файлов без записи: {orphans}"
+        ))
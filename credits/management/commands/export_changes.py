@@ -0,0 +1,76 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from credits.api import RESOURCES, serialize_rows
+from credits.changes import ChangeCursor, read_changes
+
+
+class Command(BaseCommand):
+    help = (
+        "Выводит изменения кредиторов, договоров или портфелей после водяного знака "
+        "построчно в JSON. С --cursor-file продолжает с места прошлого запуска."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("resource", choices=sorted(RESOURCES))
+        parser.add_argument("--since", help="Начальный водяной знак, ISO 8601")
+        parser.add_argument(
+            "--cursor-file",
+            help="Файл с курсором: читается при запуске и обновляется после каждой пачки",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Количество изменений в одном запросе",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size должен быть положительным")
+        resource = RESOURCES[options["resource"]]
+        cursor_file = Path(options["cursor_file"]) if options["cursor_file"] else None
+
+        cursor = self.initial_cursor(options["since"], cursor_file)
+        fields = list(resource.fields)
+        total = 0
+        while True:
+            changes, cursor = read_changes(
+                resource.model,
+                cursor,
+                batch_size,
+                lambda queryset: serialize_rows(resource, queryset, fields),
+                scope=resource.scope,
+            )
+            for change in changes:
+                self.stdout.write(json.dumps(change, cls=DjangoJSONEncoder, ensure_ascii=False))
+            total += len(changes)
+            if cursor_file:
+                # Запись через временный файл: прерванный запуск не портит курсор
+                tmp = cursor_file.with_suffix(cursor_file.suffix + ".tmp")
+                tmp.write_text(cursor.encode())
+                tmp.replace(cursor_file)
+            if len(changes) < batch_size:
+                break
+        self.stderr.write(f"Изменений: {total}; курсор: {cursor.encode()}")
+
+    def initial_cursor(self, since, cursor_file):
+        if cursor_file and cursor_file.exists():
+            cursor = ChangeCursor.decode(cursor_file.read_text().strip())
+            if cursor is None:
+                raise CommandError(f"Некорректный курсор в {cursor_file}")
+            return cursor
+        if since:
+            moment = parse_datetime(since)
+            if moment is None:
+                raise CommandError("--since должен быть датой и временем в ISO 8601")
+            if timezone.is_naive(moment):
+                moment = timezone.make_aware(moment)
+            return ChangeCursor.since(moment)
+        return ChangeCursor()
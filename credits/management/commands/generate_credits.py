@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from credits.synthetic import generate, sizes_for
+
+
+class Command(BaseCommand):
+    help = (
+        "Создаёт синтетических кредиторов, договоры и портфели с правдоподобными "
+        "распределениями типов, количеств и сумм"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--portfolios", type=int, default=100_000, help="Количество портфелей")
+        parser.add_argument("--agreements", type=int, help="Количество договоров (по умолчанию портфели / 10)")
+        parser.add_argument("--creditors", type=int, help="Количество кредиторов (по умолчанию договоры / 200)")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=10_000, help="Строк в одном INSERT")
+
+    def handle(self, *args, **options):
+        creditors, agreements = sizes_for(options["portfolios"])
+        creditors = options["creditors"] or creditors
+        agreements = options["agreements"] or agreements
+        if min(creditors, agreements, options["portfolios"], options["batch_size"]) < 1:
+            raise CommandError("Количества и --batch-size должны быть положительными")
+
+        started = time.perf_counter()
+        with transaction.atomic():
+            generate(
+                creditors,
+                agreements,
+                options["portfolios"],
+                seed=options["seed"],
+                batch_size=options["batch_size"],
+                progress=lambda n: self.stdout.write(f"Портфелей: {n}", ending="\r"),
+            )
+        self.stdout.write("")
+        self.stdout.write(self.style.SUCCESS(
+            f"Кредиторов: {creditors}, договоров: {agreements}, портфелей: {options['portfolios']} "
+            f"за {time.perf_counter() - started:.1f} с"
+        ))
@@ -0,0 +1,227 @@
+import csv
+from itertools import islice
+from pathlib import Path
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from credits.models import (
+    Agreement,
+    AgreementTypes,
+    Creditor,
+    Portfolio,
+    PortfolioProcessTypes,
+    PortfolioTypes,
+    portfolio_label,
+)
+
+
+# Колонки входного файла. Одна строка - один портфель; строки с одинаковыми
+# кредитором и реквизитами относятся к одному договору.
+REQUIRED_COLUMNS = {"creditor", "agreement_code", "agreement_date", "date_placement"}
+OPTIONAL_COLUMNS = {
+    "creditor_first",
+    "agreement_type",
+    "agreement_total_sum",
+    "agreement_total_amount",
+    "label",
+    "type",
+    "process_type",
+    "total_sum",
+    "date_finish",
+    "cession_date",
+}
+
+
+class RowForm(forms.Form):
+    """Разбор и проверка значений одной строки файла"""
+    agreement_date = forms.DateTimeField()
+    agreement_total_sum = forms.DecimalField(required=False, max_digits=10, decimal_places=2, localize=True)
+    agreement_total_amount = forms.DecimalField(required=False, max_digits=10, decimal_places=2, localize=True)
+    total_sum = forms.DecimalField(required=False, max_digits=10, decimal_places=2, localize=True)
+    date_placement = forms.DateField()
+    date_finish = forms.DateField(required=False)
+    cession_date = forms.DateField(required=False)
+
+
+def choice_value(choices, value, default):
+    """Значение choices по номеру или по подписи ("Цессия", "Софт")"""
+    if value in (None, ""):
+        return default
+    text = str(value).strip()
+    if text.isdigit() and int(text) in choices.values:
+        return int(text)
+    for number, label in choices.choices:
+        if label.lower() == text.lower():
+            return number
+    raise ValidationError(f"неизвестное значение «{text}»")
+
+
+class Command(BaseCommand):
+    help = (
+        "Потоковый импорт договоров и портфелей из CSV/XLSX. "
+        "Обязательные колонки: " + ", ".join(sorted(REQUIRED_COLUMNS)) + "; "
+        "необязательные: " + ", ".join(sorted(OPTIONAL_COLUMNS)) + ". "
+        "Для XLSX нужен пакет openpyxl."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Путь к файлу .csv или .xlsx")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=2000,
+            help="Количество строк в одной транзакции",
+        )
+        parser.add_argument("--delimiter", default=";", help="Разделитель CSV")
+        parser.add_argument("--encoding", default="utf-8-sig", help="Кодировка CSV")
+
+    def handle(self, *args, **options):
+        path = Path(options["path"])
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size должен быть положительным")
+        if not path.exists():
+            raise CommandError(f"Файл не найден: {path}")
+
+        # Реестр кредиторов небольшой - держим его в памяти целиком
+        self.creditors = {}
+        self.creditor_names = {}
+        for pk, name in Creditor.objects.values_list("pk", "name").order_by("-pk"):
+            self.creditors[name.strip().lower()] = pk
+            self.creditor_names[pk] = name
+
+        rows = self.read_rows(path, options)
+        imported = agreements = 0
+        while True:
+            chunk = list(islice(rows, batch_size))
+            if not chunk:
+                break
+            created = self.import_chunk(chunk, imported)
+            imported += len(chunk)
+            agreements += created
+            self.stdout.write(f"Импортировано строк: {imported}", ending="\r")
+
+        self.stdout.write("")
+        self.stdout.write(
+            self.style.SUCCESS(f"Портфелей: {imported}, новых договоров: {agreements}")
+        )
+
+    def read_rows(self, path, options):
+        """Строки файла как словари; файл читается потоково"""
+        if path.suffix.lower() == ".xlsx":
+            yield from self.read_xlsx(path)
+            return
+        with path.open(newline="", encoding=options["encoding"]) as f:
+            reader = csv.DictReader(f, delimiter=options["delimiter"])
+            self.check_columns(reader.fieldnames or [])
+            yield from reader
+
+    def read_xlsx(self, path):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise CommandError("Для импорта XLSX установите openpyxl")
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            sheet_rows = workbook.active.iter_rows(values_only=True)
+            header = [str(cell or "").strip() for cell in next(sheet_rows, ())]
+            self.check_columns(header)
+            for values in sheet_rows:
+                if any(value not in (None, "") for value in values):
+                    yield dict(zip(header, values))
+        finally:
+            workbook.close()
+
+    def check_columns(self, columns):
+        missing = REQUIRED_COLUMNS.difference(columns)
+        if missing:
+            raise CommandError("Нет обязательных колонок: " + ", ".join(sorted(missing)))
+
+    def creditor_id(self, name, required=True):
+        if name in (None, ""):
+            if required:
+                raise ValidationError("не указан кредитор")
+            return None
+        try:
+            return self.creditors[str(name).strip().lower()]
+        except KeyError:
+            raise ValidationError(f"кредитор «{name}» не найден")
+
+    def parse_row(self, row):
+        form = RowForm(row)
+        if not form.is_valid():
+            raise ValidationError(
+                "; ".join(f"{field}: {' '.join(errors)}" for field, errors in form.errors.items())
+            )
+        data = form.cleaned_data
+        agreement = Agreement(
+            creditor_id=self.creditor_id(row.get("creditor")),
+            creditor_first_id=self.creditor_id(row.get("creditor_first"), required=False),
+            agreement_code=str(row["agreement_code"] or "").strip(),
+            agreement_date=data["agreement_date"],
+            agreement_type=choice_value(AgreementTypes, row.get("agreement_type"), AgreementTypes.CESS),
+            total_sum=data["agreement_total_sum"],
+            total_amount=data["agreement_total_amount"],
+        )
+        if not agreement.agreement_code:
+            raise ValidationError("не указаны реквизиты договора")
+        portfolio = Portfolio(
+            label=str(row.get("label") or "").strip() or None,
+            type=choice_value(PortfolioTypes, row.get("type"), PortfolioTypes.CESS),
+            process_type=choice_value(
+                PortfolioProcessTypes, row.get("process_type"), PortfolioProcessTypes.LEGAL
+            ),
+            total_sum=data["total_sum"],
+            date_placement=data["date_placement"],
+            date_finish=data["date_finish"],
+            cession_date=data["cession_date"],
+        )
+        return agreement, portfolio
+
+    @transaction.atomic
+    def import_chunk(self, chunk, offset):
+        """Импортирует пачку строк в одной транзакции; возвращает число новых договоров"""
+        parsed = []
+        # Строка 1 - заголовок
+        for line, row in enumerate(chunk, start=offset + 2):
+            try:
+                parsed.append(self.parse_row(row))
+            except ValidationError as e:
+                raise CommandError(f"Строка {line}: {' '.join(e.messages)}")
+
+        # Договоры, уже существующие в базе (при дублях - с наименьшим id)
+        codes = {agreement.agreement_code for agreement, _ in parsed}
+        known = {
+            (creditor_id, code): (pk, agreement_type)
+            for pk, creditor_id, code, agreement_type in Agreement.objects.filter(agreement_code__in=codes)
+            .order_by("-pk")
+            .values_list("pk", "creditor_id", "agreement_code", "agreement_type")
+        }
+
+        new_agreements = {}
+        for agreement, _ in parsed:
+            key = (agreement.creditor_id, agreement.agreement_code)
+            if key not in known and key not in new_agreements:
+                new_agreements[key] = agreement
+        Agreement.objects.bulk_create(new_agreements.values())
+        for key, agreement in new_agreements.items():
+            known[key] = (agreement.pk, agreement.agreement_type)
+
+        portfolios = []
+        for agreement, portfolio in parsed:
+            creditor_id = agreement.creditor_id
+            portfolio.agreement_id, agreement_type = known[(creditor_id, agreement.agreement_code)]
+            # bulk_create не вызывает save(), поэтому наименование строим здесь
+            if not portfolio.label:
+                portfolio.label = portfolio_label(
+                    self.creditor_names[creditor_id],
+                    agreement_type,
+                    portfolio.date_placement,
+                    portfolio.process_type,
+                )
+            portfolios.append(portfolio)
+        Portfolio.objects.bulk_create(portfolios)
+        return len(new_agreements)
@@ -0,0 +1,44 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from credits.deletion import requeue_stale, run_deletion
+from credits.models import DeletionJob, DeletionStatus
+
+
+class Command(BaseCommand):
+    help = (
+        "Выполняет задания на удаление кредиторов и договоров из очереди. Задания, "
+        "которые не продвигались дольше --stale-minutes минут (процесс был остановлен), "
+        "возвращаются в очередь и продолжаются с того места, где остановились."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--stale-minutes", type=int, default=30, help="Когда считать задание прерванным")
+        parser.add_argument("--retry-failed", action="store_true", help="Повторить завершившиеся ошибкой")
+
+    def handle(self, *args, **options):
+        if options["stale_minutes"] < 1:
+            raise CommandError("--stale-minutes должен быть положительным")
+
+        requeued = requeue_stale(timedelta(minutes=options["stale_minutes"]))
+        if options["retry_failed"]:
+            requeued += DeletionJob.objects.filter(status=DeletionStatus.FAILED).update(
+                status=DeletionStatus.PENDING, error=""
+            )
+        if requeued:
+            self.stdout.write(f"Возвращено в очередь: {requeued}")
+
+        pending = DeletionJob.objects.filter(status=DeletionStatus.PENDING).order_by("id")
+        done = failed = 0
+        for job_id in pending.values_list("pk", flat=True):
+            job = run_deletion(job_id)
+            if job is None:
+                continue
+            if job.status == DeletionStatus.DONE:
+                done += 1
+                self.stdout.write(f"{job.label}: удалено портфелей {job.deleted}")
+            else:
+                failed += 1
+                self.stderr.write(f"{job.label}: {job.error}")
+        self.stdout.write(self.style.SUCCESS(f"Выполнено заданий: {done}, с ошибкой: {failed}"))
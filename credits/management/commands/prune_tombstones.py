@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from credits.models import Tombstone
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаляет записи об удалении старше --days дней пачками по --batch-size. "
+        "Клиент ленты изменений, не читавший её дольше этого срока, должен "
+        "перечитать ресурс целиком."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=30, help="Срок хранения записей в днях")
+        parser.add_argument("--batch-size", type=int, default=10000, help="Записей в одном DELETE")
+
+    def handle(self, *args, **options):
+        if options["days"] < 1 or options["batch_size"] < 1:
+            raise CommandError("--days и --batch-size должны быть положительными")
+
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        removed = 0
+        while True:
+            pks = list(
+                Tombstone.objects.filter(date_deleted__lt=cutoff)
+                .order_by("date_deleted", "id").values_list("pk", flat=True)[:options["batch_size"]]
+            )
+            if not pks:
+                break
+            removed += Tombstone.objects.filter(pk__in=pks).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f"Удалено записей об удалении: {removed}"))
@@ -0,0 +1,76 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from credits.models import Agreement, portfolio_aggregates, refresh_portfolio_aggregates
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает и проверяет агрегаты портфелей, хранящиеся в договорах"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Только проверить агрегаты, ничего не меняя",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Количество договоров в одной транзакции",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size должен быть положительным")
+
+        if not options["verify"]:
+            rebuilt = 0
+            for batch in self.batches(batch_size):
+                with transaction.atomic():
+                    rebuilt += refresh_portfolio_aggregates(batch)
+            self.stdout.write(f"Пересчитано договоров: {rebuilt}")
+
+        mismatched = sum(self.count_mismatches(batch) for batch in self.batches(batch_size))
+        if mismatched:
+            raise CommandError(f"Расхождений в агрегатах: {mismatched}")
+        self.stdout.write(self.style.SUCCESS("Агрегаты портфелей совпадают"))
+
+    def batches(self, batch_size):
+        """Идентификаторы договоров пачками, по индексу первичного ключа"""
+        last_id = 0
+        while True:
+            batch = list(
+                Agreement.objects.filter(pk__gt=last_id)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not batch:
+                return
+            yield batch
+            last_id = batch[-1]
+
+    def count_mismatches(self, batch):
+        fields = list(portfolio_aggregates())
+        expected = {f"expected_{name}": expr for name, expr in portfolio_aggregates().items()}
+        rows = (
+            Agreement.objects.filter(pk__in=batch)
+            .annotate(**expected)
+            .values("pk", *fields, *expected)
+        )
+        mismatched = 0
+        for row in rows:
+            for name in fields:
+                stored, actual = row[name], row[f"expected_{name}"]
+                if isinstance(stored, Decimal) or isinstance(actual, Decimal):
+                    stored, actual = Decimal(stored or 0), Decimal(actual or 0)
+                if stored != actual:
+                    self.stderr.write(
+                        f"Договор {row['pk']}: {name} = {stored}, ожидается {actual}"
+                    )
+                    mismatched += 1
+                    break
+        return mismatched
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from credits.models import Portfolio, rebuild_portfolio_labels
+
+
+class Command(BaseCommand):
+    help = (
+        "Перестраивает наименования портфелей, например после переименования "
+        "кредитора. Без фильтров обрабатываются все портфели. Наименования, "
+        "заданные вручную или импортированные в другом формате, меняются "
+        "только с --overwrite."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--creditor",
+            type=int,
+            action="append",
+            default=[],
+            help="id кредитора; можно указать несколько раз",
+        )
+        parser.add_argument(
+            "--agreement",
+            type=int,
+            action="append",
+            default=[],
+            help="id договора; можно указать несколько раз",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Количество портфелей в одном UPDATE",
+        )
+        parser.add_argument(
+            "--overwrite",
+            action="store_true",
+            help="Перезаписать и наименования, заданные не автоматически",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size должен быть положительным")
+
+        portfolios = Portfolio.objects.all()
+        if options["creditor"]:
+            portfolios = portfolios.filter(agreement__creditor__in=options["creditor"])
+        if options["agreement"]:
+            portfolios = portfolios.filter(agreement__in=options["agreement"])
+
+        updated = rebuild_portfolio_labels(portfolios, batch_size=batch_size, overwrite=options["overwrite"])
+        self.stdout.write(self.style.SUCCESS(f"Обновлено наименований: {updated}"))
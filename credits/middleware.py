@@ -0,0 +1,178 @@
+"""
+Замеры запросов: SQL (число, время, повторы), рендер шаблонов, размер ответа.
+
+Для доли запросов CREDITS_PERF_SAMPLE_RATE результаты добавляются в заголовок
+Server-Timing и пишутся JSON-строкой в лог credits.performance. Остальные
+запросы проходят без обёрток SQL. Время рендера учитывает бэкенд шаблонов
+TimedDjangoTemplates (TEMPLATES в настройках): вне выборки он только
+проверяет, что замеров нет. Под ASGI middleware работает асинхронно и не
+переводит async-представления в поток.
+"""
+import json
+import logging
+import random
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+
+logger = logging.getLogger('credits.performance')
+
+# Один и тот же SQL столько раз за запрос - признак N+1
+DUPLICATE_THRESHOLD = 3
+
+_current = ContextVar('credits_request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = Counter()
+        self.query_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Обёртка connection.execute_wrapper
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.query_time += time.perf_counter() - started
+            self.queries[sql] += 1
+
+    @property
+    def query_count(self):
+        return sum(self.queries.values())
+
+    def duplicates(self):
+        """SQL, выполненные DUPLICATE_THRESHOLD и более раз, от частых к редким"""
+        return [(sql, n) for sql, n in self.queries.most_common() if n >= DUPLICATE_THRESHOLD]
+
+
+@contextmanager
+def measured_queries(metrics):
+    """
+    Учитывает в metrics SQL всех соединений текущего потока.
+    """
+    if metrics is None:
+        yield
+        return
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(metrics))
+        yield
+
+
+class TimedTemplate(Template):
+    """Шаблон, время рендера которого учитывается в замерах запроса из выборки"""
+
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return super().render(context, request)
+        # Вложенный рендер (render_to_string из тега) уже учтён внешним
+        metrics.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Бэкенд шаблонов Django, отдающий TimedTemplate"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+class PerformanceMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def sampled(self):
+        sample_rate = getattr(settings, 'CREDITS_PERF_SAMPLE_RATE', 0.0)
+        return sample_rate > 0 and random.random() < sample_rate
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            with measured_queries(metrics):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.report(request, response, metrics, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        # Соединения запроса живут в потоке, где Django выполняет синхронный
+        # код запроса: обёртки ставятся и снимаются там же
+        stack = ExitStack()
+        try:
+            await sync_to_async(stack.enter_context)(measured_queries(metrics))
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            _current.reset(token)
+        return self.report(request, response, metrics, time.perf_counter() - started)
+
+    def report(self, request, response, metrics, total):
+        size = None if response.streaming else len(response.content)
+        duplicates = metrics.duplicates()
+        response.headers['Server-Timing'] = ', '.join([
+            f'db;dur={metrics.query_time * 1000:.1f};desc="SQL x{metrics.query_count}"',
+            f'tpl;dur={metrics.template_time * 1000:.1f};desc="Templates"',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': getattr(request.resolver_match, 'view_name', None),
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            'db_ms': round(metrics.query_time * 1000, 1),
+            'queries': metrics.query_count,
+            'template_ms': round(metrics.template_time * 1000, 1),
+            'response_bytes': size,
+            'duplicate_queries': [{'sql': sql[:300], 'count': n} for sql, n in duplicates[:5]],
+        }
+        message = json.dumps(record, ensure_ascii=False)
+        if duplicates:
+            logger.warning(message)
+        else:
+            logger.info(message)
+        return response
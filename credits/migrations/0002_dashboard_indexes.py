@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:00
+
+from django.db import migrations, models
+
+
+def analyze_tables(apps, schema_editor):
+    # Обновляем статистику планировщика, чтобы новые индексы сразу выбирались
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        for table in ('credit_creditor', 'agreement', 'credit_portfolio'):
+            schema_editor.execute(f'ANALYZE {schema_editor.quote_name(table)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('credits', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='agreement',
+            index=models.Index(fields=['agreement_code', 'id'], name='agreement_code_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='agreement',
+            index=models.Index(fields=['agreement_date', 'id'], name='agreement_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='agreement',
+            index=models.Index(fields=['total_sum', 'id'], name='agreement_total_sum_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='agreement',
+            index=models.Index(fields=['agreement_type', 'id'], name='agreement_type_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='agreement',
+            index=models.Index(fields=['creditor', 'id'], name='agreement_creditor_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='creditor',
+            index=models.Index(fields=['name', 'id'], name='creditor_name_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='portfolio',
+            index=models.Index(fields=['agreement', 'date_placement', 'id'], name='portfolio_agr_placement_idx'),
+        ),
+        migrations.RunPython(analyze_tables, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:05
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_portfolio_aggregates(apps, schema_editor):
+    Agreement = apps.get_model('credits', 'Agreement')
+    Portfolio = apps.get_model('credits', 'Portfolio')
+    portfolios = Portfolio.objects.filter(agreement=OuterRef('pk')).order_by().values('agreement')
+    Agreement.objects.using(schema_editor.connection.alias).update(
+        portfolio_count=Coalesce(Subquery(portfolios.annotate(value=Count('id')).values('value')), 0),
+        portfolio_total_sum=Coalesce(
+            Subquery(portfolios.annotate(value=Sum('total_sum')).values('value')),
+            Decimal('0'),
+            output_field=models.DecimalField(max_digits=14, decimal_places=2),
+        ),
+        portfolio_date_first=Subquery(portfolios.annotate(value=Min('date_placement')).values('value')),
+        portfolio_date_last=Subquery(portfolios.annotate(value=Max('date_finish')).values('value')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('credits', '0002_dashboard_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agreement',
+            name='portfolio_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество портфелей'),
+        ),
+        migrations.AddField(
+            model_name='agreement',
+            name='portfolio_date_first',
+            field=models.DateField(blank=True, editable=False, null=True, verbose_name='Начало работы по портфелям'),
+        ),
+        migrations.AddField(
+            model_name='agreement',
+            name='portfolio_date_last',
+            field=models.DateField(blank=True, editable=False, null=True, verbose_name='Окончание работы по портфелям'),
+        ),
+        migrations.AddField(
+            model_name='agreement',
+            name='portfolio_total_sum',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0'), editable=False, max_digits=14, verbose_name='Сумма портфелей'),
+        ),
+        migrations.RunPython(fill_portfolio_aggregates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='agreement',
+            index=models.Index(fields=['portfolio_count', 'id'], name='agreement_pf_count_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='agreement',
+            index=models.Index(fields=['portfolio_total_sum', 'id'], name='agreement_pf_sum_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='agreement',
+            index=models.Index(fields=['portfolio_date_first', 'id'], name='agreement_pf_first_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='agreement',
+            index=models.Index(fields=['portfolio_date_last', 'id'], name='agreement_pf_last_id_idx'),
+        ),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:20
+
+from django.db import migrations
+
+# Состояние credits.search на момент миграции: модули приложения меняются,
+# а миграция должна выполняться так же и на новой установке
+
+SEARCH_TABLE = 'agreement_search'
+
+SQLITE_TRIGGERS = {
+    'agreement_search_ai': """
+        CREATE TRIGGER IF NOT EXISTS agreement_search_ai AFTER INSERT ON agreement BEGIN
+            INSERT INTO agreement_search (rowid, agreement_code, creditor_name)
+            VALUES (new.id, new.agreement_code,
+                    (SELECT name FROM credit_creditor WHERE id = new.creditor_id));
+        END
+    """,
+    'agreement_search_au': """
+        CREATE TRIGGER IF NOT EXISTS agreement_search_au
+        AFTER UPDATE OF id, agreement_code, creditor_id ON agreement BEGIN
+            DELETE FROM agreement_search WHERE rowid = old.id;
+            INSERT INTO agreement_search (rowid, agreement_code, creditor_name)
+            VALUES (new.id, new.agreement_code,
+                    (SELECT name FROM credit_creditor WHERE id = new.creditor_id));
+        END
+    """,
+    'agreement_search_ad': """
+        CREATE TRIGGER IF NOT EXISTS agreement_search_ad AFTER DELETE ON agreement BEGIN
+            DELETE FROM agreement_search WHERE rowid = old.id;
+        END
+    """,
+    'creditor_search_au': """
+        CREATE TRIGGER IF NOT EXISTS creditor_search_au
+        AFTER UPDATE OF name ON credit_creditor WHEN new.name IS NOT old.name BEGIN
+            UPDATE agreement_search SET creditor_name = new.name
+            WHERE rowid IN (SELECT id FROM agreement WHERE creditor_id = new.id);
+        END
+    """,
+}
+
+POSTGRESQL_INDEXES = {
+    'agreement_code_trgm_idx': 'agreement USING gin (UPPER(agreement_code::text) gin_trgm_ops)',
+    'creditor_name_trgm_idx': 'credit_creditor USING gin (UPPER(name::text) gin_trgm_ops)',
+}
+
+
+def install_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} '
+                "USING fts5(agreement_code, creditor_name, tokenize = 'trigram')"
+            )
+            for sql in SQLITE_TRIGGERS.values():
+                cursor.execute(sql)
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE} (rowid, agreement_code, creditor_name) '
+                'SELECT a.id, a.agreement_code, c.name '
+                'FROM agreement a LEFT JOIN credit_creditor c ON c.id = a.creditor_id'
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for name, definition in POSTGRESQL_INDEXES.items():
+                cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {definition}')
+
+
+def remove_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            for name in SQLITE_TRIGGERS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+            cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+        elif connection.vendor == 'postgresql':
+            for name in POSTGRESQL_INDEXES:
+                cursor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('credits', '0003_agreement_portfolio_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, remove_search_index),
+    ]
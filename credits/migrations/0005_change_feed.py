@@ -0,0 +1,44 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:30
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('credits', '0004_agreement_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=50, verbose_name='Модель')),
+                ('object_id', models.IntegerField(verbose_name='id удалённой записи')),
+                ('date_deleted', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата удаления')),
+            ],
+            options={
+                'verbose_name': 'удалённая запись',
+                'verbose_name_plural': 'Удалённые записи',
+                'db_table': 'credit_tombstone',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='agreement',
+            index=models.Index(fields=['date_update', 'id'], name='agreement_updated_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='creditor',
+            index=models.Index(fields=['date_update', 'id'], name='creditor_updated_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='portfolio',
+            index=models.Index(fields=['date_update', 'id'], name='portfolio_updated_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['model', 'date_deleted', 'id'], name='tombstone_model_deleted_idx'),
+        ),
+    ]
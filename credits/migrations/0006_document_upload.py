@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:01
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('credits', '0005_change_feed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255, verbose_name='Имя файла')),
+                ('size', models.BigIntegerField(verbose_name='Размер, байт')),
+                ('offset', models.BigIntegerField(default=0, verbose_name='Принято, байт')),
+                ('sha256', models.CharField(blank=True, max_length=64, verbose_name='SHA-256')),
+                ('complete', models.BooleanField(default=False, verbose_name='Завершена')),
+                ('date_add', models.DateTimeField(auto_now_add=True)),
+                ('date_update', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'загрузка документа',
+                'verbose_name_plural': 'Загрузки документов',
+                'db_table': 'credit_document_upload',
+            },
+        ),
+    ]
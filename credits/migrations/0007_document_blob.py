@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:05
+
+import credits.models
+import credits.storage
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('credits', '0006_document_upload'),
+    ]
+
+    operations = [
+        # Хранилище на схему не влияет; AlterField пересоздал бы таблицу
+        # на SQLite, а её триггеры поиска ссылаются на неё по имени
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='agreement',
+                    name='agreement_doc',
+                    field=models.FileField(max_length=1024, null=True, storage=credits.storage.DocumentStorage(), upload_to=credits.models.Agreement.agreement_doc_path, verbose_name='Документ'),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DocumentBlob',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False, verbose_name='SHA-256')),
+                ('size', models.BigIntegerField(verbose_name='Размер, байт')),
+                ('references', models.IntegerField(default=0, verbose_name='Ссылок')),
+                ('date_add', models.DateTimeField(auto_now_add=True)),
+                ('date_saved', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Последнее сохранение')),
+            ],
+            options={
+                'verbose_name': 'содержимое документа',
+                'verbose_name_plural': 'Содержимое документов',
+                'db_table': 'credit_document_blob',
+                'indexes': [models.Index(fields=['references', 'date_saved'], name='document_blob_unused_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('credits', '0007_document_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agreement',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Помечен на удаление'),
+        ),
+        migrations.AddField(
+            model_name='creditor',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Помечен на удаление'),
+        ),
+        migrations.CreateModel(
+            name='DeletionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=50, verbose_name='Модель')),
+                ('object_id', models.IntegerField(verbose_name='id удаляемой записи')),
+                ('label', models.CharField(max_length=250, verbose_name='Запись')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Завершено'), ('failed', 'Ошибка')], default='pending', max_length=20, verbose_name='Состояние')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Портфелей')),
+                ('deleted', models.PositiveIntegerField(default=0, verbose_name='Удалено портфелей')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('date_add', models.DateTimeField(auto_now_add=True)),
+                ('date_update', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'задание на удаление',
+                'verbose_name_plural': 'Задания на удаление',
+                'db_table': 'credit_deletion_job',
+                'indexes': [models.Index(fields=['status', 'date_update'], name='deletion_job_status_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('credits', '0008_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='portfolio',
+            index=models.Index(fields=['process_type', 'id'], name='portfolio_process_id_idx'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:15
+
+from django.db import migrations, models
+
+
+# Триггеры поиска (см. 0004_agreement_search_index)
+SEARCH_TRIGGERS = ['agreement_search_ai', 'agreement_search_au', 'agreement_search_ad', 'creditor_search_au']
+
+
+def drop_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for name in SEARCH_TRIGGERS:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+
+def creditor_name_key(name):
+    # Как credits.models.creditor_name_key на момент миграции
+    return " ".join(name.split()).casefold()[:250]
+
+
+def fill_name_keys(apps, schema_editor):
+    Creditor = apps.get_model('credits', 'Creditor')
+    creditors = Creditor.objects.using(schema_editor.connection.alias).only('id', 'name')
+    batch = []
+    for creditor in creditors.iterator(chunk_size=2000):
+        creditor.name_key = creditor_name_key(creditor.name)
+        batch.append(creditor)
+        if len(batch) >= 2000:
+            Creditor.objects.using(schema_editor.connection.alias).bulk_update(batch, ['name_key'])
+            batch = []
+    Creditor.objects.using(schema_editor.connection.alias).bulk_update(batch, ['name_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('credits', '0009_portfolio_process_index'),
+    ]
+
+    operations = [
+        # Таблица кредиторов пересоздаётся; триггеры поиска вернёт post_migrate
+        migrations.RunPython(drop_search_triggers, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='creditor',
+            name='name_key',
+            field=models.CharField(default='', editable=False, max_length=250, verbose_name='Ключ поиска'),
+        ),
+        migrations.RunPython(fill_name_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='creditor',
+            index=models.Index(fields=['name_key', 'id'], name='creditor_name_key_idx', opclasses=['varchar_pattern_ops', 'int4_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='creditor',
+            index=models.Index(fields=['type', 'name_key'], name='creditor_type_name_key_idx', opclasses=['int4_ops', 'varchar_pattern_ops']),
+        ),
+    ]
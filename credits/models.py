@@ -1,7 +1,15 @@
 # credits/models.py
-from django.db import models
+import uuid
+from decimal import Decimal
+
+from django.db import connections, models, router, transaction
+from django.db.models import Count, F, Max, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
+from .registry import from_registry, invalidate_creditors
+from .storage import document_storage
+
 
 class CreditorType(models.IntegerChoices):
     BANK = 1, "Банк"
@@ -9,25 +17,118 @@ class CreditorType(models.IntegerChoices):
     MKO = 3, "МКО"
 
 
+class ActiveManager(models.Manager):
+    """
+    Менеджер по умолчанию: без записей, помеченных на удаление (deleted_at).
+    Сами записи удаляет фоновое задание (credits.deletion) через all_objects.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+def creditor_name_key(name):
+    """
+    Ключ поиска по началу наименования: без регистра и лишних пробелов.
+    Считается в Python: lower() в SQLite не меняет регистр кириллицы.
+    """
+    return " ".join(name.split()).casefold()[:250]
+
+
+class CreditorQuerySet(models.QuerySet):
+    """
+    Массовые операции с кредиторами, поддерживающие ключ поиска name_key
+    и реестр кредиторов в кэше (сигналы при них не отправляются).
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.name_key = creditor_name_key(obj.name)
+        objs = super().bulk_create(objs, *args, **kwargs)
+        invalidate_creditors(self.db)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        if "name" in fields:
+            for obj in objs:
+                obj.name_key = creditor_name_key(obj.name)
+            fields = [*fields, "name_key"]
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        invalidate_creditors(self.db)
+        return rows
+
+    def update(self, **kwargs):
+        # auto_now при update() не срабатывает: без date_update строки не попадут в ленту изменений
+        kwargs.setdefault("date_update", timezone.now())
+        if isinstance(kwargs.get("name"), str):
+            kwargs["name_key"] = creditor_name_key(kwargs["name"])
+        rows = super().update(**kwargs)
+        invalidate_creditors(self.db)
+        return rows
+
+    update.alters_data = True
+
+    def name_prefix(self, prefix):
+        """
+        Кредиторы, наименование которых начинается с prefix (без регистра).
+        Диапазон по name_key идёт по индексу; в PostgreSQL - LIKE 'x%'
+        по индексу с varchar_pattern_ops.
+        """
+        key = creditor_name_key(prefix)
+        if not key:
+            return self
+        if self.db and connections[self.db].vendor == "postgresql":
+            return self.filter(name_key__startswith=key)
+        # Верхняя граница: ключ с наибольшим символом Юникода в конце
+        return self.filter(name_key__gte=key, name_key__lt=key + "\U0010ffff")
+
+
 class Creditor(models.Model):
     id = models.AutoField(unique=True, primary_key=True, null=False, blank=False)
     type = models.IntegerField(
         "Тип кредитора", null=False, blank=False, choices=CreditorType.choices
     )
     name = models.CharField("Наименование", max_length=250, null=False, blank=False)
+    name_key = models.CharField("Ключ поиска", max_length=250, default="", editable=False)
 
     date_add = models.DateTimeField("Дата создания", default=timezone.now)
     date_update = models.DateTimeField("Дата обновления", auto_now=True)
+    deleted_at = models.DateTimeField("Помечен на удаление", null=True, blank=True, editable=False)
+
+    objects = ActiveManager.from_queryset(CreditorQuerySet)()
+    all_objects = models.Manager.from_queryset(CreditorQuerySet)()
 
     class Meta:
         app_label = "credits"
         db_table = "credit_creditor"
         verbose_name_plural = "Кредитор"
         verbose_name = "кредитора"
+        indexes = [
+            # Сортировка договоров по наименованию кредитора
+            models.Index(fields=["name", "id"], name="creditor_name_id_idx"),
+            # Поиск по началу наименования (автодополнение), в том числе по типу
+            models.Index(
+                fields=["name_key", "id"], name="creditor_name_key_idx", opclasses=["varchar_pattern_ops", "int4_ops"]
+            ),
+            models.Index(
+                fields=["type", "name_key"], name="creditor_type_name_key_idx", opclasses=["int4_ops", "varchar_pattern_ops"]
+            ),
+            # Лента изменений
+            models.Index(fields=["date_update", "id"], name="creditor_updated_id_idx"),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.name_key = creditor_name_key(self.name)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "name" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "name_key"}
+        super().save(*args, **kwargs)
+
 
 class AgreementTypes(models.IntegerChoices):
     CESS = 1, "Цессия"
@@ -112,25 +213,212 @@ class Agreement(models.Model):
         blank=False,
     )
 
+    # Агрегаты по портфелям договора: хранятся в договоре и пересчитываются
+    # при изменении портфелей (см. refresh_portfolio_aggregates)
+    portfolio_count = models.PositiveIntegerField(
+        "Количество портфелей",
+        default=0,
+        editable=False,
+    )
+
+    portfolio_total_sum = models.DecimalField(
+        "Сумма портфелей",
+        decimal_places=2,
+        max_digits=14,
+        default=Decimal("0"),
+        editable=False,
+    )
+
+    portfolio_date_first = models.DateField(
+        "Начало работы по портфелям",
+        null=True,
+        blank=True,
+        editable=False,
+    )
+
+    portfolio_date_last = models.DateField(
+        "Окончание работы по портфелям",
+        null=True,
+        blank=True,
+        editable=False,
+    )
+
+    deleted_at = models.DateTimeField(
+        "Помечен на удаление",
+        null=True,
+        blank=True,
+        editable=False,
+    )
+
     def agreement_doc_path(self, filename):
-        return f"agreements/{self.agreement_code}/{filename}"
+        # Каталог выбирает хранилище по хэшу содержимого (credits.storage)
+        return filename
 
     agreement_doc = models.FileField(
         verbose_name="Документ",
         upload_to=agreement_doc_path,
+        storage=document_storage,
         max_length=1024,
         null=True,
     )
 
+    objects = ActiveManager()
+    all_objects = models.Manager()
+
     class Meta:
         app_label = "credits"
         db_table = "agreement"
         verbose_name = "Договор"
         verbose_name_plural = "Договор"
+        indexes = [
+            # Сортировки дашборда: (поле сортировки, id) для курсорной пагинации
+            models.Index(fields=["agreement_code", "id"], name="agreement_code_id_idx"),
+            models.Index(fields=["agreement_date", "id"], name="agreement_date_id_idx"),
+            models.Index(fields=["total_sum", "id"], name="agreement_total_sum_id_idx"),
+            models.Index(fields=["agreement_type", "id"], name="agreement_type_id_idx"),
+            models.Index(fields=["creditor", "id"], name="agreement_creditor_id_idx"),
+            models.Index(fields=["portfolio_count", "id"], name="agreement_pf_count_id_idx"),
+            models.Index(fields=["portfolio_total_sum", "id"], name="agreement_pf_sum_id_idx"),
+            models.Index(fields=["portfolio_date_first", "id"], name="agreement_pf_first_id_idx"),
+            models.Index(fields=["portfolio_date_last", "id"], name="agreement_pf_last_id_idx"),
+            # Лента изменений
+            models.Index(fields=["date_update", "id"], name="agreement_updated_id_idx"),
+        ]
 
     def __str__(self):
         return f"{self.agreement_code} ({self.get_agreement_type_display()})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Прежний документ: при замене у его содержимого убавляется ссылка
+        instance._loaded_document = instance.__dict__.get("agreement_doc")
+        return instance
+
+
+# Подписи choices для portfolio_label: .choices строит список заново при каждом обращении
+AGREEMENT_TYPE_LABELS = dict(AgreementTypes.choices)
+PROCESS_TYPE_LABELS = dict(PortfolioProcessTypes.choices)
+
+
+def portfolio_label(creditor, agreement_type, date_placement, process_type):
+    """
+    Наименование портфеля: <кредитор>_<тип договора>_<дата начала>_<тип работы>.
+    Единый формат для Portfolio.save() и массовых операций в обход save().
+    """
+    return (
+        f"{creditor}_"
+        f"{AGREEMENT_TYPE_LABELS.get(agreement_type, agreement_type)}_"
+        f"{date_placement.strftime('%d.%m.%Y')}_"
+        f"{PROCESS_TYPE_LABELS.get(process_type, process_type)}"
+    )
+
+
+# Поля портфеля, от которых зависят агрегаты договора
+AGGREGATE_SOURCE_FIELDS = {"agreement", "agreement_id", "total_sum", "date_placement", "date_finish"}
+AGGREGATE_SOURCE_ATTNAMES = ("agreement_id", "total_sum", "date_placement", "date_finish")
+
+
+class PortfolioQuerySet(models.QuerySet):
+    """
+    Массовые операции с портфелями, поддерживающие агрегаты договоров.
+    """
+
+    def _agreement_ids(self):
+        return set(self.order_by().values_list("agreement_id", flat=True).distinct())
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        with transaction.atomic(using=self.db):
+            agreement_ids = lock_agreements({obj.agreement_id for obj in objs}, using=self.db)
+            objs = super().bulk_create(objs, *args, **kwargs)
+            refresh_portfolio_aggregates(agreement_ids, using=self.db)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        if AGGREGATE_SOURCE_FIELDS.isdisjoint(fields):
+            return super().bulk_update(objs, fields, *args, **kwargs)
+        with transaction.atomic(using=self.db):
+            agreement_ids = {obj.agreement_id for obj in objs}
+            if {"agreement", "agreement_id"}.intersection(fields):
+                # Договоры, от которых портфели уходят
+                agreement_ids |= self.filter(pk__in=[obj.pk for obj in objs])._agreement_ids()
+            lock_agreements(agreement_ids, using=self.db)
+            rows = super().bulk_update(objs, fields, *args, **kwargs)
+            refresh_portfolio_aggregates(agreement_ids, using=self.db)
+        return rows
+
+    def update(self, **kwargs):
+        # auto_now при update() не срабатывает: без date_update строки не попадут в ленту изменений
+        kwargs.setdefault("date_update", timezone.now())
+        if AGGREGATE_SOURCE_FIELDS.isdisjoint(kwargs):
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            agreement_ids = self._agreement_ids()
+            moved_pks = None
+            if "agreement" in kwargs or "agreement_id" in kwargs:
+                moved_pks = list(self.values_list("pk", flat=True))
+                # Договор, к которому портфели переходят
+                target = kwargs.get("agreement_id", kwargs.get("agreement"))
+                if isinstance(target, models.Model):
+                    target = target.pk
+                if isinstance(target, int):
+                    agreement_ids.add(target)
+            lock_agreements(agreement_ids, using=self.db)
+            rows = super().update(**kwargs)
+            if moved_pks:
+                # Договоры, к которым портфели перешли
+                agreement_ids |= self.model.objects.using(self.db).filter(pk__in=moved_pks)._agreement_ids()
+            refresh_portfolio_aggregates(agreement_ids, using=self.db)
+        return rows
+
+    update.alters_data = True
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            agreement_ids = lock_agreements(self._agreement_ids(), using=self.db)
+            record_tombstones(self)
+            result = super().delete()
+            refresh_portfolio_aggregates(agreement_ids, using=self.db)
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def with_label_data(self):
+        """Подтягивает в том же запросе всё, что нужно для наименования"""
+        return self.annotate(
+            label_creditor=F("agreement__creditor__name"),
+            label_agreement_type=F("agreement__agreement_type"),
+        )
+
+    def bulk_edit(self, **changes):
+        """
+        Записывает одинаковые значения changes (тип работы, даты, стоимость)
+        во все портфели queryset в одной транзакции: строки блокируются и
+        читаются вместе с данными для наименования одним запросом, новые
+        значения, наименования и date_update записываются одним bulk_update,
+        агрегаты договоров пересчитываются один раз. Возвращает список портфелей.
+        """
+        with transaction.atomic(using=self.db):
+            portfolios = list(
+                self.with_label_data()
+                .select_for_update(of=("self",))
+                .only("id", "agreement_id", "label", "date_placement", "process_type", "date_update")
+                .order_by("pk")
+            )
+            if not portfolios:
+                return portfolios
+            now = timezone.now()
+            for portfolio in portfolios:
+                for name, value in changes.items():
+                    setattr(portfolio, name, value)
+                portfolio.label = portfolio.build_label()
+                portfolio.date_update = now
+            self.model.objects.using(self.db).bulk_update(portfolios, [*changes, "label", "date_update"])
+        return portfolios
+
 
 class Portfolio(models.Model):
     id = models.AutoField(
@@ -204,21 +492,351 @@ class Portfolio(models.Model):
         blank=True,
     )
 
+    objects = PortfolioQuerySet.as_manager()
+
     class Meta:
         app_label = "credits"
         db_table = "credit_portfolio"
         verbose_name = "портфель"
         verbose_name_plural = "Портфель"
+        indexes = [
+            # Портфели выбранного договора в порядке даты начала работы
+            models.Index(
+                fields=["agreement", "date_placement", "id"],
+                name="portfolio_agr_placement_idx",
+            ),
+            # Лента изменений
+            models.Index(fields=["date_update", "id"], name="portfolio_updated_id_idx"),
+            # Фильтр по типу работы в админке (список по убыванию id)
+            models.Index(fields=["process_type", "id"], name="portfolio_process_id_idx"),
+        ]
 
     def __str__(self):
         return self.label or "Без названия"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем исходный договор, чтобы при переносе портфеля
+        # пересчитать агрегаты и у прежнего договора, и исходные значения
+        # полей агрегатов, чтобы не пересчитывать их без изменений
+        instance._loaded_agreement_id = instance.__dict__.get("agreement_id")
+        instance._loaded_aggregate_values = instance._aggregate_values()
+        return instance
+
+    def _aggregate_values(self):
+        # Неотложенные поля агрегатов; None - если какое-то поле не загружено
+        if any(name not in self.__dict__ for name in AGGREGATE_SOURCE_ATTNAMES):
+            return None
+        return tuple(self.__dict__[name] for name in AGGREGATE_SOURCE_ATTNAMES)
+
+    def aggregates_changed(self, update_fields=None):
+        """Изменились ли с загрузки поля, от которых зависят агрегаты договора"""
+        if update_fields is not None and AGGREGATE_SOURCE_FIELDS.isdisjoint(update_fields):
+            return False
+        if self._state.adding:
+            return True
+        loaded = getattr(self, "_loaded_aggregate_values", None)
+        return loaded is None or loaded != self._aggregate_values()
+
+    def label_source(self):
+        """
+        (кредитор, тип договора) для наименования. Берутся из with_label_data()
+        или из уже загруженных связей, иначе - из базы. Наименование сохраняется,
+        поэтому кредитор из реестра в кэше (credits.registry) не используется:
+        его копия может отставать от базы.
+        """
+        if hasattr(self, "label_creditor"):
+            return self.label_creditor, self.label_agreement_type
+        if Portfolio.agreement.is_cached(self):
+            agreement = self.agreement
+            if Agreement.creditor.is_cached(agreement) and not from_registry(agreement.creditor):
+                return agreement.creditor.name, agreement.agreement_type
+            name = Creditor.all_objects.filter(pk=agreement.creditor_id).values_list("name", flat=True).get()
+            return name, agreement.agreement_type
+        return (
+            Agreement.all_objects.filter(pk=self.agreement_id)
+            .values_list("creditor__name", "agreement_type")
+            .get()
+        )
+
+    def build_label(self):
+        creditor, agreement_type = self.label_source()
+        return portfolio_label(creditor, agreement_type, self.date_placement, self.process_type)
+
     def save(self, *args, **kwargs):
         if not self.label:
-            self.label = (
-                f"{self.agreement.creditor}_"
-                f"{self.agreement.get_agreement_type_display()}_"
-                f"{self.date_placement.strftime('%d.%m.%Y')}_"
-                f"{self.get_process_type_display()}"
+            self.label = self.build_label()
+        using = kwargs.get("using") or router.db_for_write(type(self), instance=self)
+        if not self.aggregates_changed(kwargs.get("update_fields")):
+            # Наименование, тип работы и т. п.: договор и его date_update не трогаются
+            super().save(*args, **kwargs)
+            return
+        with transaction.atomic(using=using):
+            agreement_ids = lock_agreements(
+                {self.agreement_id, getattr(self, "_loaded_agreement_id", None)}, using=using
             )
-        super().save(*args, **kwargs)
\ No newline at end of file
+            super().save(*args, **kwargs)
+            refresh_portfolio_aggregates(agreement_ids, using=using)
+        self._loaded_agreement_id = self.agreement_id
+        self._loaded_aggregate_values = self._aggregate_values()
+
+    def delete(self, *args, **kwargs):
+        using = kwargs.get("using") or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            lock_agreements({self.agreement_id}, using=using)
+            record_tombstones(Portfolio.objects.using(using).filter(pk=self.pk))
+            result = super().delete(*args, **kwargs)
+            refresh_portfolio_aggregates({self.agreement_id}, using=using)
+        return result
+
+
+class Tombstone(models.Model):
+    """
+    Запись об удалении кредитора, договора или портфеля для ленты изменений.
+    Кредиторы и договоры записывает обработчик post_delete, портфели -
+    record_tombstones пачкой (см. credits.signals). Старые записи удаляет
+    команда prune_tombstones.
+    """
+    model = models.CharField("Модель", max_length=50)
+    object_id = models.IntegerField("id удалённой записи")
+    date_deleted = models.DateTimeField("Дата удаления", default=timezone.now)
+
+    class Meta:
+        app_label = "credits"
+        db_table = "credit_tombstone"
+        verbose_name = "удалённая запись"
+        verbose_name_plural = "Удалённые записи"
+        indexes = [
+            models.Index(fields=["model", "date_deleted", "id"], name="tombstone_model_deleted_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.model} {self.object_id}"
+
+
+class DocumentUpload(models.Model):
+    """
+    Загрузка документа договора частями (см. credits.documents).
+    offset - сколько байт уже принято; после последней части файл
+    проверяется по SHA-256 и загрузка отмечается завершённой.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    filename = models.CharField("Имя файла", max_length=255)
+    size = models.BigIntegerField("Размер, байт")
+    offset = models.BigIntegerField("Принято, байт", default=0)
+    sha256 = models.CharField("SHA-256", max_length=64, blank=True)
+    complete = models.BooleanField("Завершена", default=False)
+    date_add = models.DateTimeField(auto_now_add=True)
+    date_update = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        app_label = "credits"
+        db_table = "credit_document_upload"
+        verbose_name = "загрузка документа"
+        verbose_name_plural = "Загрузки документов"
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
+
+
+class DocumentBlob(models.Model):
+    """
+    Содержимое документа в хранилище по хэшу (credits.storage).
+    references - число договоров, ссылающихся на содержимое.
+    """
+    digest = models.CharField("SHA-256", max_length=64, primary_key=True)
+    size = models.BigIntegerField("Размер, байт")
+    references = models.IntegerField("Ссылок", default=0)
+    date_add = models.DateTimeField(auto_now_add=True)
+    date_saved = models.DateTimeField("Последнее сохранение", default=timezone.now)
+
+    class Meta:
+        app_label = "credits"
+        db_table = "credit_document_blob"
+        verbose_name = "содержимое документа"
+        verbose_name_plural = "Содержимое документов"
+        indexes = [
+            models.Index(fields=["references", "date_saved"], name="document_blob_unused_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.digest} ({self.references})"
+
+
+class DeletionStatus(models.TextChoices):
+    PENDING = "pending", "В очереди"
+    RUNNING = "running", "Выполняется"
+    DONE = "done", "Завершено"
+    FAILED = "failed", "Ошибка"
+
+
+class DeletionJob(models.Model):
+    """
+    Фоновое удаление кредитора или договора с портфелями (см. credits.deletion).
+    total - сколько портфелей удалить, deleted - сколько уже удалено.
+    """
+    model = models.CharField("Модель", max_length=50)
+    object_id = models.IntegerField("id удаляемой записи")
+    label = models.CharField("Запись", max_length=250)
+    status = models.CharField(
+        "Состояние", max_length=20, choices=DeletionStatus.choices, default=DeletionStatus.PENDING
+    )
+    total = models.PositiveIntegerField("Портфелей", default=0)
+    deleted = models.PositiveIntegerField("Удалено портфелей", default=0)
+    error = models.TextField("Ошибка", blank=True)
+    date_add = models.DateTimeField(auto_now_add=True)
+    date_update = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        app_label = "credits"
+        db_table = "credit_deletion_job"
+        verbose_name = "задание на удаление"
+        verbose_name_plural = "Задания на удаление"
+        indexes = [
+            models.Index(fields=["status", "date_update"], name="deletion_job_status_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.label}: {self.get_status_display()}"
+
+    @property
+    def progress(self):
+        """Доля удалённых портфелей, 0..1"""
+        if self.status == DeletionStatus.DONE:
+            return 1.0
+        return min(1.0, self.deleted / self.total) if self.total else 0.0
+
+
+def portfolio_aggregates():
+    """
+    Выражения для пересчёта агрегатов договора по его портфелям.
+    Каждый подзапрос читает портфели одного договора по индексу agreement_id.
+    """
+    portfolios = Portfolio.objects.filter(agreement=OuterRef("pk")).order_by().values("agreement")
+    return {
+        "portfolio_count": Coalesce(
+            Subquery(portfolios.annotate(value=Count("id")).values("value")), 0
+        ),
+        "portfolio_total_sum": Coalesce(
+            Subquery(portfolios.annotate(value=Sum("total_sum")).values("value")),
+            Decimal("0"),
+            output_field=models.DecimalField(max_digits=14, decimal_places=2),
+        ),
+        "portfolio_date_first": Subquery(
+            portfolios.annotate(value=Min("date_placement")).values("value")
+        ),
+        "portfolio_date_last": Subquery(
+            portfolios.annotate(value=Max("date_finish")).values("value")
+        ),
+    }
+
+
+def is_generated_label(label, agreement_type, date_placement, process_type):
+    """
+    Наименование построено portfolio_label (возможно, с прежним наименованием
+    кредитора) или пустое. Заданные вручную и импортированные наименования
+    в другом формате сюда не подходят.
+    """
+    return not label or label.endswith(portfolio_label("", agreement_type, date_placement, process_type))
+
+
+def rebuild_portfolio_labels(queryset, batch_size=1000, overwrite=False):
+    """
+    Перестраивает наименования портфелей из queryset пачками по batch_size:
+    данные для наименования читаются в том же запросе, изменившиеся
+    наименования записываются одним bulk_update на пачку, без save() на строку.
+    Без overwrite меняются только построенные автоматически наименования
+    (is_generated_label), с overwrite - все.
+    Возвращает число обновлённых портфелей.
+    """
+    queryset = (
+        queryset.with_label_data()
+        .only("id", "label", "date_placement", "process_type", "date_update")
+        .order_by("pk")
+    )
+    updated = last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return updated
+        last_pk = batch[-1].pk
+        changed = []
+        now = timezone.now()
+        for portfolio in batch:
+            if not overwrite and not is_generated_label(
+                portfolio.label, portfolio.label_agreement_type, portfolio.date_placement, portfolio.process_type
+            ):
+                continue
+            label = portfolio.build_label()
+            if portfolio.label != label:
+                portfolio.label = label
+                portfolio.date_update = now
+                changed.append(portfolio)
+        if changed:
+            Portfolio.objects.using(queryset.db).bulk_update(changed, ["label", "date_update"])
+            updated += len(changed)
+
+
+def record_tombstones(queryset):
+    """
+    Записи об удалении строк queryset одним INSERT ... SELECT: id строк
+    не читаются в Python, сколько бы их ни было. Возвращает число записей.
+    Вызывается до удаления: у портфелей нет обработчиков post_delete,
+    чтобы каскад и QuerySet.delete() удаляли их одним DELETE, не загружая строки.
+    """
+    connection = connections[queryset.db]
+    date_deleted = Tombstone._meta.get_field("date_deleted").get_db_prep_value(
+        timezone.now(), connection
+    )
+    select, params = (
+        queryset.order_by().annotate(tombstone_id=F("pk")).values_list("tombstone_id")
+        .query.get_compiler(queryset.db).as_sql()
+    )
+    quote = connection.ops.quote_name
+    sql = (
+        f"INSERT INTO {quote(Tombstone._meta.db_table)} "
+        f"({quote('model')}, {quote('object_id')}, {quote('date_deleted')}) "
+        f"SELECT %s, deleted_rows.tombstone_id, %s FROM ({select}) deleted_rows"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, (queryset.model._meta.model_name, date_deleted, *params))
+        return cursor.rowcount
+
+
+def lock_agreements(agreement_ids, using=None):
+    """
+    Блокирует строки договоров (SELECT ... FOR UPDATE, по порядку id) до
+    изменения их портфелей. Агрегаты пересчитываются по снимку данных:
+    без блокировки две параллельные транзакции видели бы каждая только свои
+    портфели, и зафиксированная последней затёрла бы агрегаты другой.
+    Вызывается внутри транзакции; возвращает множество id договоров.
+    """
+    agreement_ids = {pk for pk in agreement_ids if pk is not None}
+    if agreement_ids:
+        list(
+            Agreement.all_objects.using(using)
+            .select_for_update()
+            .filter(pk__in=agreement_ids)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+    return agreement_ids
+
+
+def refresh_portfolio_aggregates(agreement_ids, using=None):
+    """
+    Пересчитывает агрегаты портфелей у перечисленных договоров одним UPDATE.
+    Стоимость пропорциональна числу портфелей затронутых договоров.
+    date_update договоров сдвигается: агрегаты - часть их данных.
+    Договоры, помеченные на удаление, пропускаются (менеджер по умолчанию).
+    Строки договоров должны быть заблокированы до изменения портфелей (lock_agreements).
+    """
+    agreement_ids = {pk for pk in agreement_ids if pk is not None}
+    if not agreement_ids:
+        return 0
+    return (
+        Agreement.objects.using(using)
+        .filter(pk__in=agreement_ids)
+        .update(date_update=timezone.now(), **portfolio_aggregates())
+    )
\ No newline at end of file
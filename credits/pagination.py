@@ -0,0 +1,245 @@
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+from datetime import date, datetime
+from operator import attrgetter
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import F, Q
+from django.db.models.expressions import Col
+
+from .registry import attach_creditors
+
+
+PAGE_SIZE = 50
+
+# Ключ сортировки из GET-параметра -> поля модели Agreement.
+# Последним ключом всегда идёт id; creditor__name дополнительно упорядочен
+# по creditor_id, чтобы порядок совпадал с индексом (name, id) кредиторов.
+SORT_FIELDS = {
+    'id': (),
+    'agreement_code': ('agreement_code',),
+    'agreement_date': ('agreement_date',),
+    'total_sum': ('total_sum',),
+    'creditor': ('creditor__name', 'creditor_id'),
+    'agreement_type': ('agreement_type',),
+    'portfolio_count': ('portfolio_count',),
+    'portfolio_total_sum': ('portfolio_total_sum',),
+    'portfolio_date_first': ('portfolio_date_first',),
+    'portfolio_date_last': ('portfolio_date_last',),
+}
+
+# Подписи ключей сортировки для формы дашборда
+SORT_LABELS = {
+    'id': "По порядку",
+    'agreement_code': "Реквизиты",
+    'agreement_date': "Дата договора",
+    'total_sum': "Стоимость",
+    'creditor': "Кредитор",
+    'agreement_type': "Тип договора",
+    'portfolio_count': "Число портфелей",
+    'portfolio_total_sum': "Стоимость портфелей",
+    'portfolio_date_first': "Начало работы",
+    'portfolio_date_last': "Окончание работы",
+}
+
+# Поля, допускающие NULL. NULL стоят там, где их по умолчанию ставит база
+# (SQLite - в начале по возрастанию, PostgreSQL - в конце), чтобы порядок
+# совпадал с обычным индексом (поле, id) в обоих направлениях.
+NULLABLE_FIELDS = {'total_sum', 'portfolio_date_first', 'portfolio_date_last'}
+
+
+class JoinedPk(F):
+    """
+    Первичный ключ связанной таблицы, взятый из самого JOIN.
+
+    Django сокращает `creditor__id` до `agreement.creditor_id`: значение то же,
+    но планировщик SQLite не видит, что сортировка по нему совпадает с индексом
+    (name, id) кредиторов, и досортировывает строки во временном B-дереве.
+
+    Публичного способа сослаться на столбец из JOIN нет, поэтому используются
+    внутренние Query.setup_joins и Col; получаемый SQL закреплён тестом
+    test_creditor_tiebreaker_orders_by_joined_pk - он упадёт при несовместимом
+    обновлении Django.
+    """
+
+    def resolve_expression(self, query=None, allow_joins=True, reuse=None, summarize=False, for_save=False):
+        field = query.get_meta().get_field(self.name)
+        join_info = query.setup_joins([self.name], query.get_meta(), query.get_initial_alias())
+        return Col(join_info.joins[-1], field.related_model._meta.pk)
+
+
+# Выражения для сортировки там, где поле курсора не годится для ORDER BY
+ORDERING_EXPRESSIONS = {
+    'creditor_id': JoinedPk('creditor'),
+}
+
+
+@dataclass
+class KeysetPage:
+    items: list
+    next_cursor: str | None = None
+    prev_cursor: str | None = None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def resolve_sort(sort, direction):
+    """
+    Возвращает (ключ сортировки, поля модели, по убыванию) для GET-параметров.
+    Неизвестный ключ сортировки заменяется на 'id'.
+    """
+    if sort not in SORT_FIELDS:
+        sort = 'id'
+    return sort, SORT_FIELDS[sort], direction == 'desc'
+
+
+def keyset_ordering(fields, descending):
+    """Порядок сортировки со стабильным дополнительным ключом по id."""
+    ordering = []
+    for field in fields:
+        expr = ORDERING_EXPRESSIONS.get(field) or F(field)
+        ordering.append(expr.desc() if descending else expr.asc())
+    ordering.append('-id' if descending else 'id')
+    return ordering
+
+
+def _cursor_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if value is not None and not isinstance(value, (int, str)):
+        return str(value)
+    return value
+
+
+def _direction(descending):
+    return 'desc' if descending else 'asc'
+
+
+def encode_cursor(sort, values, pk, descending=False):
+    raw = json.dumps(
+        [sort, _direction(descending), [_cursor_value(v) for v in values], pk],
+        ensure_ascii=False,
+        separators=(',', ':'),
+    )
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+# Целые курсора вне bigint база не примет (OverflowError при запросе)
+CURSOR_INT_RANGE = range(-2 ** 63, 2 ** 63)
+
+
+def _valid_int(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value in CURSOR_INT_RANGE
+
+
+def decode_cursor(cursor, sort, descending=False):
+    """
+    Разбирает курсор. Возвращает (значения полей, id) или None,
+    если курсор повреждён или выдан для другой сортировки или направления:
+    позиция из списка по возрастанию в списке по убыванию указывает
+    на другую страницу.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, direction, values, pk = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        return None
+    if cursor_sort not in SORT_FIELDS or cursor_sort != sort or direction != _direction(descending):
+        return None
+    if not isinstance(values, list) or len(values) != len(SORT_FIELDS[sort]):
+        return None
+    if not _valid_int(pk) or pk < 0 or any(isinstance(v, int) and not _valid_int(v) for v in values):
+        return None
+    return values, pk
+
+
+def keyset_filter(fields, values, pk, greater, nulls_largest=False):
+    """
+    Условие «кортеж (fields..., id) строго больше/меньше (values..., pk)».
+    NULL считается наибольшим значением при nulls_largest, иначе наименьшим.
+
+    Каждый уровень записан как `f >= v AND (f > v OR (f = v AND ...))`:
+    ведущее неравенство позволяет базе начать просмотр индекса
+    сразу с позиции курсора, а не фильтровать его с начала.
+    """
+    if not fields:
+        return Q(id__gt=pk) if greater else Q(id__lt=pk)
+    field, value = fields[0], values[0]
+    rest = keyset_filter(fields[1:], values[1:], pk, greater, nulls_largest)
+    # NULL лежат дальше по ходу просмотра
+    nulls_ahead = greater == nulls_largest
+    if value is None:
+        condition = Q(**{f'{field}__isnull': True}) & rest
+        if not nulls_ahead:
+            condition |= Q(**{f'{field}__isnull': False})
+        return condition
+    strict, loose = ('gt', 'gte') if greater else ('lt', 'lte')
+    condition = Q(**{f'{field}__{loose}': value}) & (
+        Q(**{f'{field}__{strict}': value}) | (Q(**{field: value}) & rest)
+    )
+    if nulls_ahead and field in NULLABLE_FIELDS:
+        condition |= Q(**{f'{field}__isnull': True})
+    return condition
+
+
+def paginate_agreements(queryset, sort, direction, after=None, before=None, per_page=PAGE_SIZE):
+    """
+    Курсорная (keyset) пагинация списка договоров.
+
+    Вместо OFFSET страница выбирается условием по кортежу (поля сортировки, id)
+    относительно последней/первой строки соседней страницы, поэтому глубокие
+    страницы стоят столько же, сколько первая.
+    """
+    sort, fields, descending = resolve_sort(sort, direction)
+    # Значения курсора из связанных таблиц читаются тем же запросом, что и
+    # сортировка: связи подставляются из реестра в кэше и могут от него отставать
+    related = {field: f'keyset_{i}' for i, field in enumerate(fields) if '__' in field}
+    getters = [attrgetter(related.get(field, field)) for field in fields]
+    queryset = queryset.annotate(**{alias: F(field) for field, alias in related.items()})
+
+    position = decode_cursor(before, sort, descending)
+    backwards = position is not None
+    if not backwards:
+        position = decode_cursor(after, sort, descending)
+
+    # Для перехода назад читаем в обратном порядке и разворачиваем результат
+    qs = queryset.order_by(*keyset_ordering(fields, descending != backwards))
+    if position is not None:
+        values, pk = position
+        try:
+            nulls_largest = connections[queryset.db].features.nulls_order_largest
+            qs = qs.filter(keyset_filter(fields, values, pk, descending == backwards, nulls_largest))
+        except (ValidationError, ValueError, TypeError):
+            # Значение в курсоре не приводится к типу поля - начинаем с начала
+            qs = queryset.order_by(*keyset_ordering(fields, descending))
+            position, backwards = None, False
+
+    items = list(qs[:per_page + 1])
+    has_more = len(items) > per_page
+    # Кредиторы для отображения - из реестра в кэше
+    items = attach_creditors(items[:per_page])
+    if backwards:
+        items.reverse()
+
+    page = KeysetPage(items=items)
+    if not items:
+        return page
+    first, last = items[0], items[-1]
+    # Есть ли следующая страница: при движении вперёд - по лишней строке,
+    # при движении назад - она есть всегда (мы пришли с неё)
+    if has_more or backwards:
+        page.next_cursor = encode_cursor(sort, [get(last) for get in getters], last.pk, descending)
+    # Есть ли предыдущая: при движении назад - по лишней строке,
+    # при движении вперёд - если страница открыта по курсору
+    if (backwards and has_more) or (not backwards and position is not None):
+        page.prev_cursor = encode_cursor(sort, [get(first) for get in getters], first.pk, descending)
+    return page
@@ -0,0 +1,162 @@
+"""
+Реестр кредиторов в кэше.
+
+Кредиторов немного и меняются они редко, а читаются почти в каждом запросе:
+строки дашборда, формы договора и портфеля. Поэтому строки кредиторов
+хранятся по id в кэше Django и в словаре процесса. Обе копии действительны,
+пока не изменилась версия реестра - отметка в кэше Django, которую меняет
+invalidate_creditors: её вызывают post_save/post_delete кредитора
+(credits.signals) и массовые операции CreditorQuerySet.
+
+Версия видна всем процессам, только если кэш Django общий (CACHES в
+настройках, например Redis). С LocMemCache каждый процесс видел бы свою
+версию и не замечал бы изменений из других, DummyCache ничего не хранит -
+с ними реестр ничего не кэширует и читает кредиторов из базы одним
+запросом (CREDITS_CREDITOR_REGISTRY задаёт это явно). Ключи записей
+содержат отпечаток набора полей: строки хранятся кортежами значений,
+и после миграции старые записи не подойдут к новой модели.
+
+Реестр - только для отображения: то, что сохраняется в базу (наименования
+портфелей), читается из базы.
+
+Версия меняется сразу и ещё раз после фиксации транзакции: иначе другой
+процесс мог бы между изменением и фиксацией прочитать прежние данные и
+сохранить их под новой версией. Записи и версия живут не дольше
+REGISTRY_TIMEOUT, так что и прочитанное в откаченной транзакции долго
+не задерживается.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import router, transaction
+
+
+VERSION_KEY = "credits:creditors:version"
+REGISTRY_TIMEOUT = 60 * 60
+
+# Копия процесса: (версия, {id: значения полей})
+_local = (None, {})
+
+
+def _fields():
+    from .models import Creditor
+
+    return [field.attname for field in Creditor._meta.concrete_fields]
+
+
+def _fingerprint():
+    return hashlib.sha1(",".join(_fields()).encode()).hexdigest()[:12]
+
+
+def _entry_key(version, fingerprint, pk):
+    return f"credits:creditor:{version}:{fingerprint}:{pk}"
+
+
+def registry_enabled():
+    """Кэшируются ли кредиторы: CREDITS_CREDITOR_REGISTRY или общий ли кэш Django"""
+    enabled = getattr(settings, 'CREDITS_CREDITOR_REGISTRY', None)
+    if enabled is None:
+        return not isinstance(caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache))
+    return enabled
+
+
+def from_registry(creditor):
+    """Взят ли экземпляр из реестра (а не прочитан из базы)"""
+    return getattr(creditor, '_from_registry', False)
+
+
+def registry_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, REGISTRY_TIMEOUT)
+        # Без кэша (DummyCache) каждый вызов получает свою версию - реестр не кэшируется
+        version = cache.get(VERSION_KEY) or uuid.uuid4().hex
+    return version
+
+
+def _bump_version():
+    cache.set(VERSION_KEY, uuid.uuid4().hex, REGISTRY_TIMEOUT)
+
+
+def invalidate_creditors(using=None):
+    """Делает кэшированные записи кредиторов недействительными во всех процессах"""
+    _bump_version()
+    transaction.on_commit(_bump_version, using=using)
+
+
+def get_creditors(ids):
+    """
+    {id: Creditor} для перечисленных id. Отсутствующие в копии процесса
+    читаются одним get_many из кэша Django, оставшиеся - одним запросом
+    (включая помеченных на удаление: реестр нужен для отображения).
+    Без общего кэша (registry_enabled) - всегда одним запросом.
+    """
+    from .models import Creditor
+
+    global _local
+    ids = {pk for pk in ids if pk is not None}
+    if not ids:
+        return {}
+    if not registry_enabled():
+        return Creditor.all_objects.in_bulk(ids)
+    version = registry_version()
+    local_version, rows = _local
+    if local_version != version:
+        rows = {}
+        _local = (version, rows)
+
+    found = {pk: rows[pk] for pk in ids if pk in rows}
+    missing = ids - found.keys()
+    if missing:
+        fingerprint = _fingerprint()
+        keys = {_entry_key(version, fingerprint, pk): pk for pk in missing}
+        for key, values in cache.get_many(keys).items():
+            found[keys[key]] = values
+        missing -= found.keys()
+    if missing:
+        loaded = {
+            values[0]: values
+            for values in Creditor.all_objects.filter(pk__in=missing).values_list(*_fields())
+        }
+        cache.set_many(
+            {_entry_key(version, fingerprint, pk): values for pk, values in loaded.items()}, REGISTRY_TIMEOUT
+        )
+        found.update(loaded)
+    rows.update(found)
+
+    # Каждый раз новые экземпляры: изменения одного запроса не видны другим
+    db, fields = router.db_for_read(Creditor), _fields()
+    creditors = {}
+    for pk, values in found.items():
+        creditor = creditors[pk] = Creditor.from_db(db, fields, values)
+        creditor._from_registry = True
+    return creditors
+
+
+def get_creditor(pk):
+    return get_creditors([pk]).get(pk)
+
+
+def attach_creditors(objects, fields=("creditor", "creditor_first")):
+    """
+    Подставляет кредиторов из реестра в связи fields (по умолчанию - creditor
+    и creditor_first договоров) вместо select_related или ленивого запроса
+    на каждый объект. Уже загруженные связи не трогаются. Возвращает список объектов.
+    """
+    objects = list(objects)
+    if not objects:
+        return objects
+    relations = [getattr(type(objects[0]), name).field for name in fields]
+    creditors = get_creditors(
+        getattr(obj, field.attname) for obj in objects for field in relations
+    )
+    for obj in objects:
+        for field in relations:
+            creditor = creditors.get(getattr(obj, field.attname))
+            if creditor is not None and not field.is_cached(obj):
+                field.set_cached_value(obj, creditor)
+    return objects
@@ -0,0 +1,91 @@
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import models
+from django.db.models import Count, Sum
+from django.db.models.functions import Cast, Substr
+
+from .models import Agreement, CreditorType, Portfolio, PortfolioProcessTypes
+
+
+REPORT_CACHE_KEY = "credits:portfolio-report"
+REPORT_CACHE_TIMEOUT = 300
+
+
+@dataclass
+class ReportRow:
+    month: date
+    creditor_type: int
+    process_type: int
+    portfolio_count: int = 0
+    portfolio_sum: Decimal = Decimal("0")
+    agreement_count: int = 0
+    agreement_sum: Decimal = Decimal("0")
+    agreement_amount: Decimal = Decimal("0")
+
+    @property
+    def creditor_type_display(self):
+        return CreditorType(self.creditor_type).label
+
+    @property
+    def process_type_display(self):
+        return PortfolioProcessTypes(self.process_type).label
+
+    @property
+    def share(self):
+        """Доля суммы портфелей в стоимости договоров, %"""
+        if not self.agreement_sum:
+            return None
+        return self.portfolio_sum * 100 / self.agreement_sum
+
+
+def build_portfolio_report():
+    """
+    Сумма портфелей по месяцу начала работы, типу кредитора и типу работы
+    в сравнении со стоимостью и размером договоров-владельцев.
+
+    База группирует портфели одним запросом до уровня (договор, месяц,
+    тип работы) без JOIN: так стоимость договора учитывается в группе один
+    раз, сколько бы его портфелей в неё ни попало. Месяц берётся как
+    префикс 'YYYY-MM' текстового представления даты - это встроенные
+    функции базы, а не вызов Python-функции на каждую строку, как у
+    TruncMonth в SQLite. Тип кредитора и суммы договоров подставляются
+    из словаря договоров, а в Python сворачиваются уже сгруппированные строки.
+    """
+    agreements = {
+        pk: (creditor_type, total_sum or 0, total_amount or 0)
+        for pk, creditor_type, total_sum, total_amount in Agreement.objects.values_list(
+            "pk", "creditor__type", "total_sum", "total_amount"
+        ).iterator(chunk_size=10_000)
+    }
+    rows = (
+        Portfolio.objects.order_by()
+        .annotate(month=Substr(Cast("date_placement", models.CharField()), 1, 7))
+        .values_list("month", "process_type", "agreement_id")
+        .annotate(portfolio_sum=Sum("total_sum"), portfolio_count=Count("id"))
+    )
+
+    groups = {}
+    for month, process_type, agreement_id, portfolio_sum, count in rows.iterator(chunk_size=10_000):
+        if agreement_id not in agreements:
+            # Договор помечен на удаление, его портфели удаляет фоновое задание
+            continue
+        creditor_type, agreement_sum, agreement_amount = agreements[agreement_id]
+        key = (month, creditor_type, process_type)
+        row = groups.get(key)
+        if row is None:
+            row = groups[key] = ReportRow(date.fromisoformat(f"{month}-01"), creditor_type, process_type)
+        row.portfolio_count += count
+        row.portfolio_sum += portfolio_sum or 0
+        row.agreement_count += 1
+        row.agreement_sum += agreement_sum
+        row.agreement_amount += agreement_amount
+    return sorted(groups.values(), key=lambda r: (r.month, r.creditor_type, r.process_type))
+
+
+def portfolio_report():
+    """Отчёт из кэша; пересчитывается не чаще раза в REPORT_CACHE_TIMEOUT секунд"""
+    return cache.get_or_set(REPORT_CACHE_KEY, build_portfolio_report, REPORT_CACHE_TIMEOUT)
+
@@ -0,0 +1,235 @@
+"""
+Поиск договоров по части реквизитов договора или наименования кредитора.
+
+SQLite: триграммный индекс FTS5 в таблице agreement_search (rowid = id договора),
+который поддерживают триггеры на таблицах договоров и кредиторов.
+PostgreSQL: GIN-индексы pg_trgm по UPPER(agreement_code) и UPPER(name) -
+те выражения, которые Django строит для icontains.
+"""
+from django.db import connections
+from django.db.models import F, FloatField, Func, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest, Upper
+
+from .models import Agreement
+
+
+SEARCH_TABLE = 'agreement_search'
+
+# Сколько лучших совпадений индекса ранжируется перед применением фильтров дашборда
+SEARCH_CANDIDATES = 1000
+
+# Триграммный индекс не находит подстроки короче трёх символов
+MIN_INDEXED_LENGTH = 3
+
+SQLITE_TRIGGERS = {
+    'agreement_search_ai': """
+        CREATE TRIGGER IF NOT EXISTS agreement_search_ai AFTER INSERT ON agreement BEGIN
+            INSERT INTO agreement_search (rowid, agreement_code, creditor_name)
+            VALUES (new.id, new.agreement_code,
+                    (SELECT name FROM credit_creditor WHERE id = new.creditor_id));
+        END
+    """,
+    'agreement_search_au': """
+        CREATE TRIGGER IF NOT EXISTS agreement_search_au
+        AFTER UPDATE OF id, agreement_code, creditor_id ON agreement BEGIN
+            DELETE FROM agreement_search WHERE rowid = old.id;
+            INSERT INTO agreement_search (rowid, agreement_code, creditor_name)
+            VALUES (new.id, new.agreement_code,
+                    (SELECT name FROM credit_creditor WHERE id = new.creditor_id));
+        END
+    """,
+    'agreement_search_ad': """
+        CREATE TRIGGER IF NOT EXISTS agreement_search_ad AFTER DELETE ON agreement BEGIN
+            DELETE FROM agreement_search WHERE rowid = old.id;
+        END
+    """,
+    'creditor_search_au': """
+        CREATE TRIGGER IF NOT EXISTS creditor_search_au
+        AFTER UPDATE OF name ON credit_creditor WHEN new.name IS NOT old.name BEGIN
+            UPDATE agreement_search SET creditor_name = new.name
+            WHERE rowid IN (SELECT id FROM agreement WHERE creditor_id = new.id);
+        END
+    """,
+}
+
+POSTGRESQL_INDEXES = {
+    'agreement_code_trgm_idx': 'agreement USING gin (UPPER(agreement_code::text) gin_trgm_ops)',
+    'creditor_name_trgm_idx': 'credit_creditor USING gin (UPPER(name::text) gin_trgm_ops)',
+}
+
+
+class Similarity(Func):
+    """Триграммное сходство строк pg_trgm"""
+    function = 'SIMILARITY'
+    output_field = FloatField()
+
+
+def _sqlite_has_table(cursor):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [SEARCH_TABLE])
+    return cursor.fetchone() is not None
+
+
+def rebuild_search_index(connection):
+    """Заполняет индекс SQLite заново по текущим договорам"""
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, agreement_code, creditor_name) '
+            'SELECT a.id, a.agreement_code, c.name '
+            'FROM agreement a LEFT JOIN credit_creditor c ON c.id = a.creditor_id'
+        )
+
+
+def install_search_index(connection):
+    """
+    Создаёт поисковый индекс, если его нет. Повторный вызов безопасен.
+
+    SQLite пересоздаёт таблицу при многих изменениях схемы и теряет при этом
+    её триггеры, поэтому функция вызывается и после каждой миграции: если
+    триггеров не хватает, они создаются заново, а индекс перестраивается.
+    """
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            created = not _sqlite_has_table(cursor)
+            if created:
+                cursor.execute(
+                    f'CREATE VIRTUAL TABLE {SEARCH_TABLE} '
+                    "USING fts5(agreement_code, creditor_name, tokenize = 'trigram')"
+                )
+            cursor.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name IN (%s, %s, %s, %s)",
+                list(SQLITE_TRIGGERS),
+            )
+            complete = cursor.fetchone()[0] == len(SQLITE_TRIGGERS)
+            for sql in SQLITE_TRIGGERS.values():
+                cursor.execute(sql)
+        if created or not complete:
+            rebuild_search_index(connection)
+    elif connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for name, definition in POSTGRESQL_INDEXES.items():
+                cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {definition}')
+
+
+def remove_search_index(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            for name in SQLITE_TRIGGERS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+            cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+        elif connection.vendor == 'postgresql':
+            for name in POSTGRESQL_INDEXES:
+                cursor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+def drop_search_triggers(connection):
+    """
+    Для миграций, которые пересоздают таблицы договоров или кредиторов в SQLite:
+    переименование таблицы падает на триггерах, которые ссылаются на неё.
+    Триггеры и индекс возвращает restore_search_index после миграции.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name in SQLITE_TRIGGERS:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+
+def restore_search_index(sender, using, **kwargs):
+    """Обработчик post_migrate: возвращает триггеры, потерянные при миграции"""
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            if not _sqlite_has_table(cursor):
+                return
+        install_search_index(connection)
+
+
+def normalize_query(query):
+    return ' '.join((query or '').split())[:100]
+
+
+def _terms(query):
+    """Слова запроса: (для индекса, слишком короткие для индекса)"""
+    words = query.split()
+    return (
+        [w for w in words if len(w) >= MIN_INDEXED_LENGTH],
+        [w for w in words if len(w) < MIN_INDEXED_LENGTH],
+    )
+
+
+def _fts_query(words):
+    # Каждое слово - отдельная фраза: совпадение подстроки в любой колонке
+    return ' '.join('"{}"'.format(w.replace('"', '""')) for w in words)
+
+
+def _word_filter(word):
+    return Q(agreement_code__icontains=word) | Q(creditor__name__icontains=word)
+
+
+def search_agreements(queryset, query):
+    """
+    Договоры, у которых каждое слово запроса входит в реквизиты договора
+    или в наименование кредитора.
+    """
+    indexed, short = _terms(query)
+    vendor = connections[queryset.db].vendor
+    if vendor == 'sqlite' and indexed:
+        queryset = queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s',
+            [_fts_query(indexed)],
+        ))
+    elif vendor == 'postgresql':
+        # Объединение двух выборок, чтобы каждая шла по своему GIN-индексу:
+        # OR по колонкам двух таблиц базе приходится проверять построчно
+        for word in indexed:
+            queryset = queryset.filter(pk__in=(
+                Agreement.objects.filter(agreement_code__icontains=word).values('pk')
+                .union(Agreement.objects.filter(creditor__name__icontains=word).values('pk'))
+            ))
+    else:
+        short = indexed + short
+    for word in short:
+        queryset = queryset.filter(_word_filter(word))
+    return queryset
+
+
+def _ranked_ids(queryset, query, limit):
+    """id лучших совпадений по релевантности, начиная с лучшего"""
+    indexed, _ = _terms(query)
+    connection = connections[queryset.db]
+    if connection.vendor == 'sqlite' and indexed:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s '
+                # Совпадение в реквизитах договора весит больше, чем в кредиторе
+                f'ORDER BY bm25({SEARCH_TABLE}, 2.0, 1.0) LIMIT %s',
+                [_fts_query(indexed), limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+    matches = search_agreements(Agreement.objects.using(queryset.db), query)
+    if connection.vendor == 'postgresql':
+        text = Upper(F('agreement_code')), Upper(F('creditor__name'))
+        matches = matches.annotate(
+            search_rank=Greatest(*(Similarity(expr, Upper(query)) for expr in text))
+        ).order_by('-search_rank', 'id')
+    else:
+        matches = matches.order_by('id')
+    return list(matches.values_list('pk', flat=True)[:limit])
+
+
+def ranked_agreements(queryset, query, limit):
+    """
+    Не более limit договоров из queryset, лучших по релевантности запросу.
+    Ранжируются SEARCH_CANDIDATES лучших совпадений индекса; фильтры
+    queryset применяются к ним одним запросом по первичному ключу.
+    """
+    ids = _ranked_ids(queryset, query, SEARCH_CANDIDATES)
+    position = {pk: i for i, pk in enumerate(ids)}
+    items = queryset.filter(pk__in=ids)
+    # Индекс ищет только по длинным словам - короткие проверяем здесь
+    for word in _terms(query)[1]:
+        items = items.filter(_word_filter(word))
+    return sorted(items, key=lambda a: position[a.pk])[:limit]
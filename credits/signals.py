@@ -0,0 +1,79 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import Agreement, Creditor, DocumentBlob, Portfolio, Tombstone, record_tombstones
+from .registry import invalidate_creditors
+from .storage import collect_blob, document_storage, name_digest
+
+
+@receiver(post_delete, sender=Creditor)
+@receiver(post_delete, sender=Agreement)
+def record_tombstone(sender, instance, using, origin=None, **kwargs):
+    # post_delete приходит и для строк, удалённых каскадом, в той же транзакции
+    Tombstone.objects.using(using).create(model=sender._meta.model_name, object_id=instance.pk)
+
+
+@receiver(pre_delete, sender=Agreement)
+def record_portfolio_tombstones(sender, instance, using, **kwargs):
+    # Портфели удаляются каскадом одним DELETE без загрузки и без сигналов:
+    # записи об удалении - пачкой, пока строки ещё есть
+    record_tombstones(Portfolio.objects.using(using).filter(agreement_id=instance.pk))
+
+
+@receiver(post_save, sender=Creditor)
+@receiver(post_delete, sender=Creditor)
+def invalidate_creditor_registry(sender, using, **kwargs):
+    invalidate_creditors(using)
+
+
+def add_document_reference(name, using):
+    digest = name_digest(name)
+    if not digest:
+        return
+    if not DocumentBlob.objects.using(using).filter(digest=digest).update(references=F('references') + 1):
+        # Имя перенесено из другого договора без сохранения файла
+        DocumentBlob.objects.using(using).create(
+            digest=digest, size=document_storage.size(name), references=1
+        )
+
+
+def remove_document_reference(name, using):
+    digest = name_digest(name)
+    if not digest:
+        return
+    DocumentBlob.objects.using(using).filter(digest=digest).update(references=F('references') - 1)
+    # Файл удаляется только после фиксации: при откате ссылка остаётся
+    transaction.on_commit(partial(collect_blob, digest, using=using), using=using)
+
+
+@receiver(post_save, sender=Agreement)
+def count_document_references(sender, instance, using, raw=False, **kwargs):
+    name = instance.agreement_doc.name or None
+    loaded = getattr(instance, '_loaded_document', None) or None
+    if raw or name == loaded:
+        return
+    add_document_reference(name, using)
+    remove_document_reference(loaded, using)
+    instance._loaded_document = name
+
+
+@receiver(post_delete, sender=Agreement)
+def release_document(sender, instance, using, **kwargs):
+    # Приходит и для договоров, удалённых каскадом вместе с кредитором
+    remove_document_reference(instance.agreement_doc.name, using)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    # PRAGMA действуют на соединение, а не на файл базы (кроме journal_mode)
+    pragmas = connection.settings_dict.get('PRAGMAS')
+    if connection.vendor != 'sqlite' or not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,161 @@
+"""
+Хранилище документов договоров с адресацией по содержимому.
+
+Файл хэшируется (SHA-256) во время записи и хранится один раз под своим
+хэшем: blobs/<первые 2 символа>/<хэш>. В поле договора записывается имя
+sha256/<хэш>/<исходное имя файла> - исходное имя нужно для скачивания,
+а одинаковые документы разных договоров (и повторные загрузки при правке)
+ссылаются на один файл.
+
+Ссылки на файл считает DocumentBlob.references: их меняют обработчики
+post_save/post_delete договора (см. credits.signals), в том числе при
+каскадном удалении договоров кредитора. Файл без ссылок удаляется после
+фиксации транзакции (collect_blob), пропущенное добирает команда
+collect_document_blobs.
+
+Документы, сохранённые до перехода на это хранилище (agreements/...),
+отдаются по прежним путям и в подсчёте ссылок не участвуют.
+"""
+import hashlib
+import os
+import re
+import tempfile
+from datetime import timedelta
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+
+BLOB_DIR = 'blobs'
+NAME_RE = re.compile(r'^sha256/([0-9a-f]{64})/[^/]+$')
+READ_SIZE = 1024 * 1024
+
+# Файл без ссылок не удаляется, пока с последнего сохранения его содержимого
+# прошло меньше SAVE_GRACE: ссылку добавляет post_save договора уже после
+# записи файла в хранилище
+SAVE_GRACE = timedelta(minutes=10)
+
+
+def name_digest(name):
+    """Хэш содержимого по имени в поле договора; None - документ в прежнем формате"""
+    match = NAME_RE.match(name or '')
+    return match.group(1) if match else None
+
+
+def blob_name(digest):
+    return f'{BLOB_DIR}/{digest[:2]}/{digest}'
+
+
+@deconstructible
+class DocumentStorage(FileSystemStorage):
+    """FileSystemStorage, который хранит каждое содержимое один раз под его хэшем"""
+
+    def stored_name(self, name):
+        """Путь файла относительно MEDIA_ROOT (для X-Accel-Redirect и url)"""
+        digest = name_digest(name)
+        return blob_name(digest) if digest else name
+
+    def path(self, name):
+        return super().path(self.stored_name(name))
+
+    def url(self, name):
+        return super().url(self.stored_name(name))
+
+    def get_available_name(self, name, max_length=None):
+        # Имя определяется содержимым, а не каталогом upload_to
+        return name
+
+    def _save(self, name, content):
+        from .models import DocumentBlob
+
+        filename = os.path.basename(name)
+        if hasattr(content, 'temporary_file_path'):
+            # Файл уже на диске (загрузка частями, большой файл формы): он
+            # переносится без копирования во временный файл хранилища и
+            # хэшируется уже там - по прежнему пути его больше никто не
+            # изменит, и имя общего файла задаёт только посчитанный хэш
+            source = self._temporary_path()
+            file_move_safe(content.temporary_file_path(), source, allow_overwrite=True)
+            digest, size = self._hash_file(source), os.path.getsize(source)
+        else:
+            source, digest, size = self._write_temporary(content)
+
+        # Отметка до проверки файла: удаление файла без ссылок (collect_blob)
+        # и эта запись не могут пройти одновременно
+        DocumentBlob.objects.update_or_create(
+            digest=digest, defaults={'size': size, 'date_saved': timezone.now()}
+        )
+        full_path = super().path(blob_name(digest))
+        if os.path.exists(full_path):
+            os.remove(source)
+        else:
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            # Одинаковое содержимое, записанное параллельно, просто заменяется
+            os.replace(source, full_path)
+            if self.file_permissions_mode is not None:
+                os.chmod(full_path, self.file_permissions_mode)
+        return f'sha256/{digest}/{filename}'
+
+    def _hash_file(self, path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while block := f.read(READ_SIZE):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _temporary_directory(self):
+        directory = super().path(f'{BLOB_DIR}/tmp')
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def _temporary_path(self):
+        """Путь для временного файла рядом с хранилищем (файл создаётся пустым)"""
+        fd, path = tempfile.mkstemp(dir=self._temporary_directory())
+        os.close(fd)
+        return path
+
+    def _write_temporary(self, content):
+        """Пишет содержимое во временный файл рядом с хранилищем, считая хэш по ходу записи"""
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=self._temporary_directory(), delete=False) as f:
+            try:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            except BaseException:
+                os.remove(f.name)
+                raise
+        return f.name, digest.hexdigest(), size
+
+    def delete(self, name):
+        # Общий файл удаляется только по счётчику ссылок (collect_blob)
+        if not name_digest(name):
+            super().delete(name)
+
+    def delete_blob(self, digest):
+        super().delete(blob_name(digest))
+
+
+document_storage = DocumentStorage()
+
+
+def collect_blob(digest, using=None):
+    """Удаляет запись и файл содержимого, на которое больше нет ссылок"""
+    from .models import DocumentBlob
+
+    with transaction.atomic(using=using):
+        deleted, _ = DocumentBlob.objects.using(using).filter(
+            digest=digest, references__lte=0, date_saved__lt=timezone.now() - SAVE_GRACE
+        ).delete()
+        # Файл удаляется до фиксации: параллельное сохранение того же
+        # содержимого ждёт блокировки записи и затем пишет файл заново
+        if deleted:
+            document_storage.delete_blob(digest)
+    return bool(deleted)
@@ -0,0 +1,125 @@
+"""
+Синтетические кредиторы, договоры и портфели с правдоподобными распределениями
+для бенчмарков и нагрузочных замеров.
+
+- типы кредиторов, договоров и работ - с весами, как в рабочих данных;
+- договоры распределены по кредиторам неравномерно (несколько крупных
+  кредиторов держат большую часть договоров);
+- число портфелей у договора и суммы - с тяжёлым хвостом (логнормально).
+"""
+import math
+import random
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+
+from .models import (
+    Agreement,
+    AgreementTypes,
+    Creditor,
+    CreditorType,
+    Portfolio,
+    PortfolioProcessTypes,
+    PortfolioTypes,
+    portfolio_label,
+)
+
+
+CREDITOR_TYPE_WEIGHTS = {CreditorType.BANK: 4, CreditorType.MFKO: 3, CreditorType.MKO: 3}
+AGREEMENT_TYPE_WEIGHTS = {AgreementTypes.CESS: 7, AgreementTypes.OUTS: 3}
+PROCESS_TYPE_WEIGHTS = {
+    PortfolioProcessTypes.SOFT: 35,
+    PortfolioProcessTypes.HARD: 20,
+    PortfolioProcessTypes.LEGAL: 25,
+    PortfolioProcessTypes.IP: 15,
+    PortfolioProcessTypes.SEIZE: 5,
+}
+
+FIRST_DAY = date(2018, 1, 1)
+DAYS = 8 * 365
+
+CREDITOR_NAMES = ("Альфа", "Бета", "Гамма", "Дельта", "Омега", "Вектор", "Капитал", "Финанс")
+
+
+def _weighted(rnd, weights, k):
+    return rnd.choices(list(weights), weights=list(weights.values()), k=k)
+
+
+def _amount(rnd, median, sigma=1.0, limit=Decimal("99999999.99")):
+    value = Decimal(round(rnd.lognormvariate(math.log(median), sigma), 2)).quantize(Decimal("0.01"))
+    return min(value, limit)
+
+
+def sizes_for(portfolios):
+    """(кредиторов, договоров) для заданного числа портфелей"""
+    agreements = max(1, portfolios // 10)
+    return max(5, agreements // 200), agreements
+
+
+def generate(creditors, agreements, portfolios, seed=0, batch_size=10_000, progress=None):
+    """
+    Создаёт данные пачками bulk_create. Портфели создаются по договорам
+    подряд, поэтому пересчёт агрегатов после каждой пачки затрагивает только
+    её договоры. progress(создано портфелей) вызывается после каждой пачки.
+    """
+    rnd = random.Random(seed)
+    creditor_objs = Creditor.objects.bulk_create(
+        Creditor(type=creditor_type, name=f"{rnd.choice(CREDITOR_NAMES)} {i}")
+        for i, creditor_type in enumerate(_weighted(rnd, CREDITOR_TYPE_WEIGHTS, creditors))
+    )
+    # Закон Ципфа: i-й кредитор получает долю, пропорциональную 1 / (i + 1)
+    creditor_weights = [1 / (i + 1) for i in range(len(creditor_objs))]
+
+    agreement_objs = []
+    for offset in range(0, agreements, batch_size):
+        count = min(batch_size, agreements - offset)
+        owners = rnd.choices(creditor_objs, weights=creditor_weights, k=count)
+        types = _weighted(rnd, AGREEMENT_TYPE_WEIGHTS, count)
+        agreement_objs += Agreement.objects.bulk_create(
+            Agreement(
+                creditor=owner,
+                creditor_first=rnd.choice(creditor_objs) if rnd.random() < 0.3 else None,
+                agreement_code=f"{'ДЦ' if agreement_type == AgreementTypes.CESS else 'ДА'}-{offset + i + 1:07d}",
+                agreement_date=datetime.combine(
+                    FIRST_DAY + timedelta(days=rnd.randrange(DAYS)), time(12), tzinfo=timezone.utc
+                ),
+                agreement_type=agreement_type,
+                total_sum=_amount(rnd, 5_000_000, 1.2) if rnd.random() < 0.9 else None,
+                total_amount=_amount(rnd, 20_000_000, 1.2),
+            )
+            for i, (owner, agreement_type) in enumerate(zip(owners, types))
+        )
+
+    # Портфели: логнормальное число на договор, нормированное к заданному итогу
+    raw = [rnd.lognormvariate(0, 1) for _ in agreement_objs]
+    scale = portfolios / sum(raw)
+    counts = [int(r * scale) for r in raw]
+    for i in rnd.sample(range(len(counts)), portfolios - sum(counts)):
+        counts[i] += 1
+
+    created, batch = 0, []
+    for agreement, count in zip(agreement_objs, counts):
+        start = agreement.agreement_date.date()
+        for _ in range(count):
+            placement = start + timedelta(days=rnd.randrange(365))
+            process_type = _weighted(rnd, PROCESS_TYPE_WEIGHTS, 1)[0]
+            batch.append(Portfolio(
+                agreement=agreement,
+                label=portfolio_label(agreement.creditor.name, agreement.agreement_type, placement, process_type),
+                type=PortfolioTypes.CESS,
+                process_type=process_type,
+                total_sum=_amount(rnd, 200_000, 1.5) if rnd.random() < 0.95 else None,
+                date_placement=placement,
+                date_finish=placement + timedelta(days=rnd.randrange(90, 720)) if rnd.random() < 0.6 else None,
+            ))
+        if len(batch) >= batch_size:
+            Portfolio.objects.bulk_create(batch)
+            created += len(batch)
+            batch = []
+            if progress:
+                progress(created)
+    if batch:
+        Portfolio.objects.bulk_create(batch)
+        created += len(batch)
+        if progress:
+            progress(created)
+    return creditor_objs, agreement_objs
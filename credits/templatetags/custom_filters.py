@@ -1,7 +1,21 @@
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
 from django import template
 
 register = template.Library()
 
+KOPECK = Decimal('0.01')
+
+
+def _format_currency(value):
+    # float берём по его десятичной записи (0.29 -> Decimal('0.29')),
+    # а не по точному двоичному значению 0.28999...
+    number = Decimal(repr(value)) if isinstance(value, float) else Decimal(value)
+    # Группировка разрядов средствами Decimal: '1,234.50' -> '1 234,50'
+    grouped = f"{number.quantize(KOPECK, rounding=ROUND_HALF_UP):,}"
+    return grouped.replace(',', ' ').replace('.', ',') + ' ₽'
+
+
 @register.filter
 def currency_format(value):
     """
@@ -10,27 +24,16 @@ def currency_format(value):
     100000 -> 100 000,00 ₽
     100000.5 -> 100 000,50 ₽
     400400.00 -> 400 400,00 ₽
+
+    Считает в Decimal без перехода через float, поэтому копейки не теряются
+    на больших суммах.
     """
     if value is None or value == '':
         return '0,00 ₽'
     
     try:
-        # Преобразуем в float и округляем до 2 знаков
-        value = float(value)
-        value = round(value, 2)
-        
-        # Разделяем на рубли и копейки
-        total_cents = int(value * 100)
-        rubles = total_cents // 100
-        kopecks = total_cents % 100
-        
-        # Форматируем рубли с пробелами между тысячами
-        formatted_rubles = '{:,}'.format(rubles).replace(',', ' ')
-        
-        # Всегда показываем 2 знака копеек
-        return f"{formatted_rubles},{kopecks:02d} ₽"
-            
-    except (ValueError, TypeError):
+        return _format_currency(value)
+    except (InvalidOperation, ValueError, TypeError):
         return str(value)
 
 @register.filter
@@ -38,4 +41,4 @@ def currency_format_strict(value):
     """
     Тот же фильтр, но всегда показывает копейки
     """
-    return currency_format(value)
\ No newline at end of file
+    return currency_format(value)
@@ -6,9 +6,13 @@ register = template.Library()
 def query_transform(context, **kwargs):
     """
     Возвращает текущий GET-запрос с изменёнными/добавленными параметрами.
+    Параметр со значением None удаляется из запроса.
     """
     request = context['request']
     updated = request.GET.copy()
     for k, v in kwargs.items():
-        updated[k] = v
+        if v is None:
+            updated.pop(k, None)
+        else:
+            updated[k] = v
     return updated.urlencode()
\ No newline at end of file
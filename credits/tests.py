@@ -1,3 +1,1634 @@
-from django.test import TestCase
+import csv
+import hashlib
+import json
+import os
+import re
+import tempfile
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+from urllib.parse import quote, unquote
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.template.loader import get_template, render_to_string
+from django.template.backends.django import Template as DjangoTemplate
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from .models import (
+    Agreement,
+    AgreementTypes,
+    Creditor,
+    CreditorType,
+    DeletionJob,
+    DeletionStatus,
+    DocumentBlob,
+    DocumentUpload,
+    Portfolio,
+    PortfolioProcessTypes,
+    PortfolioTypes,
+    Tombstone,
+    lock_agreements,
+)
+from .management.commands.benchmark_currency_format import compare, sample_values
+from .registry import attach_creditors, get_creditors
+from .deletion import DeletionError, run_deletion, schedule_deletion
+from .documents import AssembledFile, UploadError, document_download_view, part_path, write_chunk
+from .middleware import PerformanceMiddleware, TimedTemplate
+from .pagination import PAGE_SIZE, SORT_FIELDS, decode_cursor, encode_cursor, keyset_ordering, paginate_agreements
+from .reports import build_portfolio_report
+from .storage import document_storage
+from .synthetic import generate
+from .templatetags.custom_filters import currency_format
+
+
+class AgreementsKeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        creditors = [
+            Creditor.objects.create(type=CreditorType.BANK, name=name)
+            for name in ("Альфа", "Бета", "Альфа")
+        ]
+        for i in range(23):
+            Agreement.objects.create(
+                creditor=creditors[i % 3],
+                agreement_code=f"Д-{i % 5}",
+                agreement_date=datetime(2024, 1, 1 + i % 4, tzinfo=dt_timezone.utc),
+                agreement_type=AgreementTypes.CESS if i % 2 else AgreementTypes.OUTS,
+                total_sum=None if i % 4 == 0 else Decimal(100 * (i % 3)),
+            )
+
+    def expected_ids(self, sort, descending):
+        fields = SORT_FIELDS[sort]
+        rows = Agreement.objects.values_list('id', *fields)
+        # NULL стоят там, где их ставит база, id - последний ключ
+        nulls_largest = connection.features.nulls_order_largest
+        key = lambda row: tuple(
+            ((v is None) == nulls_largest, v if v is not None else 0) for v in row[1:]
+        ) + (row[0],)
+        return [row[0] for row in sorted(rows, key=key, reverse=descending)]
+
+    def walk(self, sort, direction):
+        qs = Agreement.objects.select_related('creditor')
+        pages = [paginate_agreements(qs, sort, direction, per_page=5)]
+        while pages[-1].next_cursor:
+            pages.append(paginate_agreements(qs, sort, direction, after=pages[-1].next_cursor, per_page=5))
+        return pages
+
+    def test_forward_walk_matches_full_ordering(self):
+        for sort in SORT_FIELDS:
+            for direction in ('asc', 'desc'):
+                with self.subTest(sort=sort, direction=direction):
+                    pages = self.walk(sort, direction)
+                    ids = [a.id for page in pages for a in page]
+                    self.assertEqual(ids, self.expected_ids(sort, direction == 'desc'))
+                    self.assertIsNone(pages[0].prev_cursor)
+
+    def test_backward_walk_returns_same_pages(self):
+        qs = Agreement.objects.select_related('creditor')
+        for sort in SORT_FIELDS:
+            for direction in ('asc', 'desc'):
+                with self.subTest(sort=sort, direction=direction):
+                    pages = self.walk(sort, direction)
+                    page = pages[-1]
+                    for expected in reversed(pages[:-1]):
+                        page = paginate_agreements(qs, sort, direction, before=page.prev_cursor, per_page=5)
+                        self.assertEqual([a.id for a in page], [a.id for a in expected])
+                    self.assertIsNone(page.prev_cursor)
+
+    def test_foreign_or_broken_cursor_starts_from_first_page(self):
+        qs = Agreement.objects.select_related('creditor')
+        cursor = paginate_agreements(qs, 'total_sum', 'asc', per_page=5).next_cursor
+        first = [a.id for a in paginate_agreements(qs, 'agreement_date', 'asc', per_page=5)]
+        for bad in (cursor, 'не-курсор', '!!!'):
+            page = paginate_agreements(qs, 'agreement_date', 'asc', after=bad, per_page=5)
+            self.assertEqual([a.id for a in page], first)
+
+        # Целые вне bigint не доходят до базы
+        for sort, values, pk in (('agreement_date', ["2024-01-01"], 2 ** 63), ('portfolio_count', [2 ** 70], 1),
+                                 ('agreement_date', ["2024-01-01"], -1)):
+            bad = encode_cursor(sort, values, pk)
+            self.assertIsNone(decode_cursor(bad, sort))
+            page = paginate_agreements(qs, sort, 'asc', after=bad, per_page=5)
+            self.assertEqual(len(page), 5)
+
+        # Курсор страницы по возрастанию не применяется к списку по убыванию
+        cursor = paginate_agreements(qs, 'agreement_date', 'asc', per_page=5).next_cursor
+        first_desc = [a.id for a in paginate_agreements(qs, 'agreement_date', 'desc', per_page=5)]
+        page = paginate_agreements(qs, 'agreement_date', 'desc', after=cursor, per_page=5)
+        self.assertEqual([a.id for a in page], first_desc)
+
+    def test_creditor_tiebreaker_orders_by_joined_pk(self):
+        # JoinedPk опирается на внутренние Query.setup_joins и Col: после
+        # обновления Django сортировка должна по-прежнему идти по id из JOIN
+        # кредитора, а не по agreement.creditor_id
+        qs = Agreement.objects.order_by(*keyset_ordering(SORT_FIELDS['creditor'], False))
+        sql = str(qs.query)
+        self.assertRegex(sql, r'ORDER BY "credit_creditor"\."name" ASC, "credit_creditor"\."id" ASC, "agreement"\."id" ASC')
+
+
+# Один процесс: LocMemCache для реестра общий
+@override_settings(CREDITS_CREDITOR_REGISTRY=True)
+class DashboardQueryPlanTests(TestCase):
+    """
+    Регрессия планов запросов дашборда: ни один запрос не должен читать
+    таблицу целиком или досортировывать строки во временном B-дереве.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        creditors = Creditor.objects.bulk_create(
+            Creditor(type=CreditorType.BANK, name=f"Кредитор {i}") for i in range(5)
+        )
+        agreements = Agreement.objects.bulk_create(
+            Agreement(
+                creditor=creditors[i % 5],
+                agreement_code=f"Д-{i}",
+                agreement_date=datetime(2024, 1, 1 + i % 28, tzinfo=dt_timezone.utc),
+                agreement_type=AgreementTypes.CESS,
+                total_sum=None if i % 7 == 0 else Decimal(i),
+            )
+            for i in range(40)
+        )
+        Portfolio.objects.bulk_create(
+            Portfolio(agreement=a, date_placement=date(2024, 1, 1 + j)) for a in agreements for j in range(3)
+        )
+        cls.agreement = agreements[0]
+        # Планы строятся по актуальной статистике, как на рабочей базе
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # На маленьких таблицах PostgreSQL всегда выбирает Seq Scan
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(f'EXPLAIN {sql}')
+            else:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [str(row[-1]) for row in cursor.fetchall()]
+
+    def assertIndexedPlan(self, sql):
+        plan = self.explain(sql)
+        message = f"{sql}\n" + "\n".join(plan)
+        for step in plan:
+            self.assertNotIn('TEMP B-TREE', step, message)
+            self.assertNotRegex(step, r'\bSort\b|Seq Scan', message)
+            # Упорядоченный проход по индексу допустим только под LIMIT:
+            # он останавливается на границе страницы
+            if step.startswith('SCAN') and not re.search(r'\bLIMIT\b', sql):
+                self.fail(f"Полный просмотр без LIMIT: {message}")
+
+    def dashboard_queries(self, **params):
+        params.setdefault('agreement', self.agreement.pk)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('credits:dashboard'), params)
+        self.assertEqual(response.status_code, 200)
+        return [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT')]
+
+    def test_dashboard_queries_use_indexes_for_every_sort(self):
+        qs = Agreement.objects.select_related('creditor')
+        for sort in SORT_FIELDS:
+            for direction in ('asc', 'desc'):
+                cursor = paginate_agreements(qs, sort, direction, per_page=10).next_cursor
+                for page in ({}, {'after': cursor}, {'before': cursor}):
+                    with self.subTest(sort=sort, direction=direction, page=list(page)):
+                        for sql in self.dashboard_queries(sort=sort, dir=direction, **page):
+                            self.assertIndexedPlan(sql)
+
+
+# Один процесс: LocMemCache для реестра общий
+@override_settings(CREDITS_CREDITOR_REGISTRY=True)
+class DashboardQueryBudgetTests(TestCase):
+    """Число запросов дашборда не зависит от количества договоров."""
+
+    def add_agreements(self, count):
+        Agreement.objects.bulk_create(
+            Agreement(
+                creditor=self.creditors[i % 2],
+                creditor_first=self.creditors[(i + 1) % 2],
+                agreement_code=f"Д-{i}",
+                agreement_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+                total_sum=Decimal(i),
+            )
+            for i in range(count)
+        )
+
+    def test_query_count_is_constant(self):
+        self.creditors = Creditor.objects.bulk_create(
+            Creditor(type=CreditorType.BANK, name=name) for name in ("Альфа", "Бета")
+        )
+        # Кредиторы читаются из реестра в кэше
+        get_creditors(c.pk for c in self.creditors)
+        url = reverse('credits:dashboard')
+        created = 0
+        for total in (10, 1_000, 10_000):
+            self.add_agreements(total - created)
+            created = total
+            first, last = Agreement.objects.order_by('id')[0], Agreement.objects.order_by('-id')[0]
+            Portfolio.objects.bulk_create(Portfolio(agreement=a) for a in (first, last) for _ in range(5))
+            with self.subTest(agreements=total):
+                # Страница договоров + портфели выбранного договора
+                with self.assertNumQueries(2):
+                    response = self.client.get(url, {'agreement': first.pk})
+                self.assertContains(response, 'portfolio-item')
+                # Выбранный договор не попал на страницу - ещё один запрос
+                with self.assertNumQueries(3 if total > PAGE_SIZE else 2):
+                    self.client.get(url, {'agreement': last.pk})
+
+
+class AgreementPortfoliosFragmentTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        creditor = Creditor.objects.create(type=CreditorType.BANK, name="Альфа")
+        cls.agreement = Agreement.objects.create(
+            creditor=creditor,
+            agreement_code="Д-1",
+            agreement_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        Portfolio.objects.bulk_create(
+            Portfolio(agreement=cls.agreement, label=f"Портфель {i}", date_placement=date(2024, 1, 10 - i))
+            for i in range(3)
+        )
+
+    def test_fragment_renders_only_portfolios_panel(self):
+        url = reverse('credits:agreement-portfolios', args=[self.agreement.pk])
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        content = response.content.decode()
+        self.assertTrue(content.strip().startswith('<div class="portfolios-panel">'))
+        self.assertNotIn('agreements-panel', content)
+        # Портфели идут по дате начала работы
+        self.assertLess(content.index("Портфель 2"), content.index("Портфель 0"))
+
+    def test_fragment_for_missing_agreement_is_404(self):
+        response = self.client.get(reverse('credits:agreement-portfolios', args=[0]))
+        self.assertEqual(response.status_code, 404)
+
+
+class PortfolioAggregatesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.creditor = Creditor.objects.create(type=CreditorType.BANK, name="Альфа")
+
+    def setUp(self):
+        self.first, self.second = (
+            Agreement.objects.create(
+                creditor=self.creditor,
+                agreement_code=code,
+                agreement_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+            )
+            for code in ("Д-1", "Д-2")
+        )
+
+    def assertAggregates(self, agreement, count, total, first=None, last=None):
+        agreement.refresh_from_db()
+        self.assertEqual(
+            (agreement.portfolio_count, agreement.portfolio_total_sum,
+             agreement.portfolio_date_first, agreement.portfolio_date_last),
+            (count, Decimal(total), first, last),
+        )
+
+    def test_save_and_delete_keep_aggregates(self):
+        portfolio = Portfolio(agreement=self.first, total_sum=Decimal("100.10"), date_placement=date(2024, 3, 1))
+        portfolio.save()
+        Portfolio.objects.create(
+            agreement=self.first, total_sum=Decimal("0.20"),
+            date_placement=date(2024, 2, 1), date_finish=date(2024, 5, 1),
+        )
+        self.assertAggregates(self.first, 2, "100.30", date(2024, 2, 1), date(2024, 5, 1))
+
+        # Перенос портфеля в другой договор пересчитывает оба
+        portfolio = Portfolio.objects.get(pk=portfolio.pk)
+        portfolio.agreement = self.second
+        portfolio.save()
+        self.assertAggregates(self.first, 1, "0.20", date(2024, 2, 1), date(2024, 5, 1))
+        self.assertAggregates(self.second, 1, "100.10", date(2024, 3, 1))
+
+        portfolio.delete()
+        self.assertAggregates(self.second, 0, "0")
+
+    def test_bulk_operations_keep_aggregates(self):
+        Portfolio.objects.bulk_create(
+            Portfolio(agreement=self.first, total_sum=Decimal(10), date_placement=date(2024, 1, d))
+            for d in (1, 2, 3)
+        )
+        self.assertAggregates(self.first, 3, "30", date(2024, 1, 1))
+
+        Portfolio.objects.filter(date_placement__gte=date(2024, 1, 2)).update(total_sum=Decimal(1))
+        self.assertAggregates(self.first, 3, "12", date(2024, 1, 1))
+
+        portfolios = list(Portfolio.objects.order_by("date_placement"))
+        for p in portfolios[:2]:
+            p.agreement = self.second
+        Portfolio.objects.bulk_update(portfolios[:2], ["agreement"])
+        self.assertAggregates(self.first, 1, "1", date(2024, 1, 3))
+        self.assertAggregates(self.second, 2, "11", date(2024, 1, 1))
+
+        Portfolio.objects.filter(agreement=self.second).update(agreement=self.first)
+        self.assertAggregates(self.first, 3, "12", date(2024, 1, 1))
+        self.assertAggregates(self.second, 0, "0")
+
+        Portfolio.objects.filter(total_sum=Decimal(1)).delete()
+        self.assertAggregates(self.first, 1, "10", date(2024, 1, 1))
+
+    def test_save_without_aggregate_changes_keeps_agreement(self):
+        Portfolio.objects.create(agreement=self.first, total_sum=Decimal(5), date_placement=date(2024, 1, 1))
+        portfolio = Portfolio.objects.get()
+        self.first.refresh_from_db()
+        updated = self.first.date_update
+
+        portfolio.process_type = PortfolioProcessTypes.HARD
+        portfolio.label = "Переименован"
+        portfolio.total_sum = Decimal("5.00")
+        with CaptureQueriesContext(connection) as queries:
+            portfolio.save()
+        self.assertFalse([q for q in queries.captured_queries if 'UPDATE "agreement"' in q['sql']])
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.date_update, updated)
+
+        portfolio.total_sum = Decimal(7)
+        portfolio.save()
+        self.assertAggregates(self.first, 1, "7", date(2024, 1, 1))
+        # Сохранение загруженного без полей агрегатов пересчитывает их на всякий случай
+        Portfolio.objects.only("id", "label").get().save()
+        self.assertAggregates(self.first, 1, "7", date(2024, 1, 1))
+
+    def test_agreements_are_locked_before_portfolios_change(self):
+        from . import models
+
+        locked = []
+
+        def lock(agreement_ids, using=None):
+            # Портфели ещё не изменены: блокировка берётся до записи
+            count = Portfolio.objects.count()
+            agreement_ids = lock_agreements(agreement_ids, using)
+            locked.append((agreement_ids, count))
+            return agreement_ids
+
+        with mock.patch.object(models, "lock_agreements", side_effect=lock):
+            portfolio = Portfolio.objects.create(agreement=self.first, total_sum=Decimal(1))
+            Portfolio.objects.bulk_create([Portfolio(agreement=self.second, total_sum=Decimal(1))])
+            Portfolio.objects.filter(pk=portfolio.pk).update(agreement=self.second)
+            Portfolio.objects.filter(agreement=self.second).delete()
+        self.assertEqual(locked, [
+            ({self.first.pk}, 0),
+            ({self.second.pk}, 1),
+            ({self.first.pk, self.second.pk}, 2),
+            ({self.second.pk}, 2),
+        ])
+
+        # SQLite не поддерживает FOR UPDATE: проверяется сам запрос
+        select_for_update = QuerySet.select_for_update
+        with mock.patch.object(QuerySet, "select_for_update", autospec=True,
+                               side_effect=select_for_update) as for_update, \
+                CaptureQueriesContext(connection) as queries:
+            lock_agreements({self.second.pk, self.first.pk})
+        for_update.assert_called_once()
+        self.assertTrue(queries.captured_queries[0]['sql'].endswith('ORDER BY "agreement"."id" ASC'))
+
+    def test_rebuild_command_verifies_and_repairs(self):
+        Portfolio.objects.create(agreement=self.first, total_sum=Decimal(5))
+        # Расхождение, которое могло появиться в обход ORM
+        Agreement.objects.filter(pk=self.first.pk).update(portfolio_count=7)
+
+        with self.assertRaises(CommandError):
+            call_command("rebuild_portfolio_aggregates", verify=True, stdout=StringIO(), stderr=StringIO())
+        call_command("rebuild_portfolio_aggregates", batch_size=1, stdout=StringIO())
+        self.assertAggregates(self.first, 1, "5", timezone.localdate())
+
+
+class ImportCreditsCommandTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.creditor = Creditor.objects.create(type=CreditorType.BANK, name="Альфа")
+        Creditor.objects.create(type=CreditorType.MKO, name="Бета")
+
+    def write_csv(self, text):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False, encoding="utf-8") as f:
+            f.write(text)
+        self.addCleanup(os.unlink, f.name)
+        return f.name
+
+    def test_import_matches_save_labels_and_reuses_agreements(self):
+        existing = Agreement.objects.create(
+            creditor=self.creditor, agreement_code="Д-1", agreement_type=AgreementTypes.OUTS,
+            agreement_date=datetime(2023, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        path = self.write_csv(
+            "creditor;creditor_first;agreement_code;agreement_date;agreement_type;process_type;total_sum;date_placement\n"
+            "альфа;;Д-1;01.01.2024;Цессия;Софт;100,50;01.02.2024\n"
+            "Бета;Альфа;Д-2;2024-01-05;;3;10;2024-02-02\n"
+            "Бета;;Д-2;2024-01-05;;Хард;;2024-02-03\n"
+        )
+        call_command("import_credits", path, batch_size=2, stdout=StringIO())
+
+        self.assertEqual(Agreement.objects.count(), 2)
+        imported = Portfolio.objects.order_by("pk")
+        self.assertEqual([p.agreement.agreement_code for p in imported], ["Д-1", "Д-2", "Д-2"])
+        for portfolio in imported:
+            expected = Portfolio(
+                agreement=portfolio.agreement,
+                date_placement=portfolio.date_placement,
+                process_type=portfolio.process_type,
+            )
+            expected.save()
+            self.assertEqual(portfolio.label, expected.label)
+            expected.delete()
+        self.assertEqual(imported[0].label, "Альфа_Аутсорсинг_01.02.2024_Софт")
+        existing.refresh_from_db()
+        self.assertEqual((existing.portfolio_count, existing.portfolio_total_sum), (1, Decimal("100.50")))
+
+    def test_invalid_row_is_reported_with_line_number(self):
+        path = self.write_csv(
+            "creditor;agreement_code;agreement_date;date_placement\n"
+            "Альфа;Д-1;2024-01-01;2024-01-01\n"
+            "Гамма;Д-2;2024-01-01;2024-01-01\n"
+        )
+        with self.assertRaisesMessage(CommandError, "Строка 3: кредитор «Гамма» не найден"):
+            call_command("import_credits", path, stdout=StringIO())
+        self.assertFalse(Agreement.objects.exists())
+
+
+class ExportViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        creditor = Creditor.objects.create(type=CreditorType.BANK, name="Альфа")
+        cls.agreements = [
+            Agreement.objects.create(
+                creditor=creditor,
+                agreement_code=f"Д-{i}",
+                agreement_date=datetime(2024, 1, 1, 12, tzinfo=dt_timezone.utc),
+                total_sum=Decimal(1000 * i) + Decimal("0.5"),
+            )
+            for i in range(3)
+        ]
+        Portfolio.objects.bulk_create(
+            Portfolio(agreement=cls.agreements[1], label=f"П-{i}", date_placement=date(2024, 2, 2 - i))
+            for i in range(2)
+        )
+
+    def export(self, **params):
+        response = self.client.get(reverse('credits:export'), params)
+        self.assertTrue(response.streaming)
+        content = b"".join(response.streaming_content).decode()
+        self.assertTrue(content.startswith("\ufeff"))
+        return list(csv.reader(StringIO(content.lstrip("\ufeff")), delimiter=";"))
+
+    def test_export_follows_dashboard_sort(self):
+        rows = self.export(sort='total_sum', dir='desc')
+        self.assertEqual([r[1] for r in rows[1:]], ["Д-2", "Д-1", "Д-1", "Д-0"])
+        # Портфели договора - по дате начала работы, суммы - как в currency_format
+        self.assertEqual([r[9] for r in rows[2:4]], ["П-1", "П-0"])
+        self.assertEqual(rows[1][6], "2 000,50 ₽")
+        self.assertEqual(rows[1][2], "01.01.2024")
+
+
+class PortfolioReportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_report_counts_agreement_once_per_group(self):
+        bank = Creditor.objects.create(type=CreditorType.BANK, name="Альфа")
+        mko = Creditor.objects.create(type=CreditorType.MKO, name="Бета")
+        first, second = (
+            Agreement.objects.create(
+                creditor=creditor, agreement_code=code, total_sum=Decimal(1000), total_amount=Decimal(3000),
+                agreement_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+            )
+            for creditor, code in ((bank, "Д-1"), (mko, "Д-2"))
+        )
+        Portfolio.objects.bulk_create([
+            Portfolio(agreement=first, total_sum=Decimal(100), date_placement=date(2024, 1, 5)),
+            Portfolio(agreement=first, total_sum=Decimal(150), date_placement=date(2024, 1, 20)),
+            Portfolio(agreement=first, total_sum=Decimal(10), date_placement=date(2024, 2, 1),
+                      process_type=PortfolioProcessTypes.SOFT),
+            Portfolio(agreement=second, total_sum=Decimal(500), date_placement=date(2024, 1, 7)),
+        ])
+
+        rows = [
+            (r.month, r.creditor_type, r.process_type, r.portfolio_count, r.portfolio_sum,
+             r.agreement_count, r.agreement_sum, r.share)
+            for r in build_portfolio_report()
+        ]
+        legal, soft = PortfolioProcessTypes.LEGAL, PortfolioProcessTypes.SOFT
+        self.assertEqual(rows, [
+            (date(2024, 1, 1), CreditorType.BANK, legal, 2, Decimal(250), 1, Decimal(1000), Decimal(25)),
+            (date(2024, 1, 1), CreditorType.MKO, legal, 1, Decimal(500), 1, Decimal(1000), Decimal(50)),
+            (date(2024, 2, 1), CreditorType.BANK, soft, 1, Decimal(10), 1, Decimal(1000), Decimal(1)),
+        ])
+
+    def test_report_page_renders(self):
+        response = self.client.get(reverse('credits:report'))
+        self.assertContains(response, "Нет портфелей")
+
+
+class PortfolioLabelTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.creditor = Creditor.objects.create(type=CreditorType.BANK, name="Альфа")
+        cls.agreement = Agreement.objects.create(
+            creditor=cls.creditor, agreement_code="Д-1", agreement_type=AgreementTypes.CESS,
+            agreement_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+        )
+
+    @override_settings(CREDITS_CREDITOR_REGISTRY=True)
+    def test_save_reads_label_data_in_one_query(self):
+        portfolio = Portfolio(agreement_id=self.agreement.pk, date_placement=date(2024, 3, 1))
+        with self.assertNumQueries(1):
+            creditor, agreement_type = portfolio.label_source()
+        self.assertEqual((creditor, agreement_type), ("Альфа", AgreementTypes.CESS))
+
+        # Кредитор из реестра мог устареть (изменён в обход сигналов) - наименование читается из базы
+        get_creditors([self.creditor.pk])
+        Creditor._base_manager.filter(pk=self.creditor.pk).update(name="Бета")
+        agreement = attach_creditors([Agreement.objects.get(pk=self.agreement.pk)], fields=['creditor'])[0]
+        self.assertEqual(agreement.creditor.name, "Альфа")
+        portfolio = Portfolio(agreement=agreement, date_placement=date(2024, 3, 1))
+        with self.assertNumQueries(1):
+            self.assertEqual(portfolio.label_source(), ("Бета", AgreementTypes.CESS))
+        Creditor._base_manager.filter(pk=self.creditor.pk).update(name="Альфа")
+
+        portfolio = Portfolio.objects.select_related("agreement__creditor").get(pk=Portfolio.objects.create(
+            agreement=self.agreement, date_placement=date(2024, 3, 1),
+        ).pk)
+        with self.assertNumQueries(0):
+            label = portfolio.build_label()
+        self.assertEqual(label, portfolio.label)
+        self.assertTrue(label.startswith("Альфа_"))
+
+    def test_rebuild_after_creditor_rename(self):
+        Portfolio.objects.bulk_create(
+            Portfolio(agreement=self.agreement, date_placement=date(2024, 1, d)) for d in (1, 2, 3)
+        )
+        custom = Portfolio.objects.create(agreement=self.agreement, label="Пул 7", date_placement=date(2024, 1, 4))
+        other = Portfolio.objects.create(
+            agreement=Agreement.objects.create(
+                creditor=Creditor.objects.create(type=CreditorType.MKO, name="Бета"),
+                agreement_code="Д-2", agreement_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+            ),
+            label="не трогать",
+        )
+        Creditor.objects.filter(pk=self.creditor.pk).update(name="Альфа-Банк")
+
+        call_command("rebuild_portfolio_labels", creditor=[self.creditor.pk], batch_size=2, stdout=StringIO())
+        labels = list(Portfolio.objects.filter(agreement=self.agreement).exclude(pk=custom.pk).values_list("label", flat=True))
+        self.assertEqual(len(labels), 3)
+        self.assertTrue(all(label.startswith("Альфа-Банк_") for label in labels))
+        other.refresh_from_db()
+        self.assertEqual(other.label, "не трогать")
+        # Наименование, заданное вручную, меняется только с --overwrite
+        custom.refresh_from_db()
+        self.assertEqual(custom.label, "Пул 7")
+        call_command("rebuild_portfolio_labels", agreement=[self.agreement.pk], overwrite=True, stdout=StringIO())
+        custom.refresh_from_db()
+        self.assertTrue(custom.label.startswith("Альфа-Банк_"))
+
+
+class AgreementSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alpha = Creditor.objects.create(type=CreditorType.BANK, name="Альфа-Банк")
+        cls.beta = Creditor.objects.create(type=CreditorType.MKO, name="Бета Финанс")
+        Agreement.objects.bulk_create(
+            Agreement(
+                creditor=cls.alpha if i % 2 else cls.beta,
+                agreement_code=f"ДЦ-{i:03}/24",
+                agreement_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+            )
+            for i in range(120)
+        )
+
+    def codes(self, params):
+        response = self.client.get(reverse('credits:dashboard'), {'agreement': 1, **params})
+        return [a.agreement_code for a in response.context['agreements']]
+
+    def test_search_by_code_and_creditor(self):
+        self.assertEqual(self.codes({'q': '017/24'}), ["ДЦ-017/24"])
+        # Регистр не важен, слова ищутся в обеих колонках
+        self.assertEqual(self.codes({'q': 'альфа 017', 'sort': 'id'}), ["ДЦ-017/24"])
+        self.assertEqual(self.codes({'q': 'бета 017'}), [])
+        # Короткие слова проверяются без индекса
+        self.assertEqual(len(self.codes({'q': 'Бета 1', 'sort': 'id'})), 15)
+
+    def test_sorted_search_is_paginated(self):
+        url = reverse('credits:dashboard')
+        params = {'agreement': 1, 'q': 'альфа', 'sort': 'agreement_code', 'dir': 'desc'}
+        codes, after = [], None
+        while True:
+            response = self.client.get(url, {**params, **({'after': after} if after else {})})
+            codes += [a.agreement_code for a in response.context['agreements']]
+            after = response.context['next_cursor']
+            if not after:
+                break
+        self.assertEqual(codes, [f"ДЦ-{i:03}/24" for i in range(119, 0, -2)])
+
+    def test_filters_and_sort_are_in_the_form(self):
+        first = Agreement.objects.order_by('id')[0]
+        Portfolio.objects.bulk_create([
+            Portfolio(agreement=agreement, total_sum=Decimal(10))
+            for agreement in Agreement.objects.order_by('id')[:PAGE_SIZE + 2]
+        ])
+        params = {'portfolio_count_min': '1', 'sort': 'portfolio_total_sum', 'dir': 'desc'}
+        response = self.client.get(reverse('credits:dashboard'), {'agreement': first.pk, **params})
+        self.assertEqual(len(response.context['agreements']), PAGE_SIZE)
+        self.assertContains(response, 'name="portfolio_count_min" value="1"')
+        self.assertContains(response, '<option value="portfolio_total_sum" selected>')
+        self.assertContains(response, '<option value="desc" selected>')
+        # Ссылка на следующую страницу сохраняет отбор и сортировку
+        next_url = re.search(r'href="\?([^"]*after=[^"]*)"', response.content.decode()).group(1)
+        response = self.client.get(f"{reverse('credits:dashboard')}?{next_url.replace('&amp;', '&')}")
+        self.assertEqual(len(response.context['agreements']), 2)
+
+        # Пустая сортировка из формы - лучшие совпадения поиска
+        response = self.client.get(reverse('credits:dashboard'), {'agreement': first.pk, 'q': 'альфа', 'sort': ''})
+        self.assertEqual(response.context['current_sort'], 'rank')
+
+    def test_index_follows_changes(self):
+        agreement = Agreement.objects.get(agreement_code="ДЦ-005/24")
+        agreement.agreement_code = "НОВЫЙ-1"
+        agreement.save()
+        Creditor.objects.filter(pk=self.alpha.pk).update(name="Гамма")
+        self.assertEqual(self.codes({'q': 'новый'}), ["НОВЫЙ-1"])
+        self.assertEqual(self.codes({'q': 'альфа'}), [])
+        self.assertEqual(len(self.codes({'q': 'гамма', 'sort': 'id'})), PAGE_SIZE)
+        agreement.delete()
+        self.assertEqual(self.codes({'q': 'новый'}), [])
+
+
+class ApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.creditor = Creditor.objects.create(type=CreditorType.BANK, name="Альфа")
+        cls.agreements = Agreement.objects.bulk_create(
+            Agreement(
+                creditor=cls.creditor, agreement_code=f"Д-{i}", total_sum=Decimal("10.50"),
+                agreement_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+            )
+            for i in range(5)
+        )
+
+    def test_cursor_pagination_and_field_selection(self):
+        url = reverse('credits:api-list', args=['agreements'])
+        response = self.client.get(url, {'limit': 2, 'fields': 'agreement_code,total_sum'})
+        data = response.json()
+        self.assertEqual(data['results'][0], {'id': self.agreements[0].pk, 'agreement_code': "Д-0", 'total_sum': "10.50"})
+        codes = []
+        while True:
+            codes += [row['agreement_code'] for row in data['results']]
+            if not data['next']:
+                break
+            data = self.client.get(data['next']).json()
+        self.assertEqual(codes, [f"Д-{i}" for i in range(5)])
+
+        self.assertEqual(self.client.get(url, {'fields': 'secret'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'limit': 0}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('credits:api-list', args=['users'])).status_code, 404)
+
+    def test_conditional_get(self):
+        url = reverse('credits:api-detail', args=['agreements', self.agreements[0].pk])
+        response = self.client.get(url)
+        self.assertEqual(response.json()['creditor'], self.creditor.pk)
+        etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        # Другой набор полей - другое тело и другой ETag
+        self.assertEqual(self.client.get(url, {'fields': 'id'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # Новый портфель меняет агрегаты договора, а с ними и его версию
+        Portfolio.objects.create(agreement=self.agreements[0], total_sum=Decimal(1))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['portfolio_count'], 1)
+
+        list_url = reverse('credits:api-list', args=['portfolios'])
+        etag = self.client.get(list_url, {'agreement': self.agreements[0].pk}).headers['ETag']
+        self.assertEqual(
+            self.client.get(list_url, {'agreement': self.agreements[0].pk}, HTTP_IF_NONE_MATCH=etag).status_code, 304
+        )
+
+    def test_list_last_modified_moves_on_deletion(self):
+        url = reverse('credits:api-list', args=['agreements'])
+        last_modified = self.client.get(url).headers['Last-Modified']
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        # Удаление не меняет date_update оставшихся строк; время записи
+        # сдвинуто - Last-Modified с точностью до секунды
+        Agreement.objects.filter(pk=self.agreements[-1].pk).delete()
+        Tombstone.objects.update(date_deleted=timezone.now() + timedelta(seconds=5))
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+
+
+@mock.patch('credits.changes.CHANGE_FEED_LAG', timedelta(0))
+class ChangeFeedTests(TestCase):
+    def feed(self, resource, **params):
+        return self.client.get(reverse('credits:api-changes', args=[resource]), params).json()
+
+    def test_feed_returns_changes_and_cascade_tombstones(self):
+        creditor = Creditor.objects.create(type=CreditorType.BANK, name="Альфа")
+        agreement = Agreement.objects.create(
+            creditor=creditor, agreement_code="Д-1",
+            agreement_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        portfolios = [Portfolio.objects.create(agreement=agreement) for _ in range(3)]
+
+        page = self.feed('portfolios', limit=2)
+        self.assertEqual([c['id'] for c in page['results']], [p.pk for p in portfolios[:2]])
+        page = self.feed('portfolios', cursor=page['cursor'])
+        self.assertEqual([(c['op'], c['id']) for c in page['results']], [('upsert', portfolios[2].pk)])
+        cursor = page['cursor']
+        self.assertEqual(self.feed('portfolios', cursor=cursor)['results'], [])
+
+        portfolios[0].label = "Изменён"
+        portfolios[0].save()
+        page = self.feed('portfolios', cursor=cursor)
+        self.assertEqual([(c['op'], c['data']['label']) for c in page['results']], [('upsert', "Изменён")])
+
+        # Каскад Creditor -> Agreement -> Portfolio оставляет записи об удалении
+        creditor.delete()
+        changes = [(c['op'], c['id']) for c in self.feed('portfolios', cursor=page['cursor'])['results']]
+        self.assertCountEqual(changes, [('delete', p.pk) for p in portfolios])
+        self.assertEqual(
+            [(c['op'], c['id']) for c in self.feed('agreements')['results']][-1], ('delete', agreement.pk)
+        )
+        self.assertEqual(Tombstone.objects.filter(model='creditor').count(), 1)
+
+    def test_queryset_updates_are_in_feed(self):
+        creditor = Creditor.objects.create(type=CreditorType.BANK, name="Альфа")
+        agreement = Agreement.objects.create(
+            creditor=creditor, agreement_code="Д-1",
+            agreement_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        portfolio = Portfolio.objects.create(agreement=agreement)
+        cursors = {name: self.feed(name)['cursor'] for name in ('creditors', 'portfolios')}
+
+        Creditor.objects.filter(pk=creditor.pk).update(name="Бета")
+        Portfolio.objects.filter(pk=portfolio.pk).update(process_type=PortfolioProcessTypes.HARD)
+        changes = self.feed('creditors', cursor=cursors['creditors'])['results']
+        self.assertEqual([(c['id'], c['data']['name']) for c in changes], [(creditor.pk, "Бета")])
+        changes = self.feed('portfolios', cursor=cursors['portfolios'])['results']
+        self.assertEqual([(c['id'], c['data']['process_type']) for c in changes],
+                         [(portfolio.pk, PortfolioProcessTypes.HARD)])
+
+    @override_settings(CREDITS_DELETION_THREAD=False)
+    def test_marked_agreement_is_deleted_in_feed(self):
+        creditor = Creditor.objects.create(type=CreditorType.BANK, name="Альфа")
+        agreement = Agreement.objects.create(
+            creditor=creditor, agreement_code="Д-1",
+            agreement_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        Portfolio.objects.create(agreement=agreement)
+        cursor = self.feed('agreements')['cursor']
+
+        schedule_deletion(agreement)
+        changes = self.feed('agreements', cursor=cursor)['results']
+        self.assertEqual([(c['op'], c['id']) for c in changes], [('delete', agreement.pk)])
+        # Портфели ждут фонового удаления и скрыты, как в списке API
+        self.assertEqual(self.feed('portfolios')['results'], [])
+
+    def test_prune_tombstones(self):
+        Tombstone.objects.bulk_create([
+            Tombstone(model='portfolio', object_id=1, date_deleted=timezone.now() - timedelta(days=40)),
+            Tombstone(model='portfolio', object_id=2),
+        ])
+        call_command("prune_tombstones", days=30, stdout=StringIO())
+        self.assertEqual(list(Tombstone.objects.values_list('object_id', flat=True)), [2])
+
+    def test_command_resumes_from_cursor_file(self):
+        creditors = [Creditor.objects.create(type=CreditorType.BANK, name=f"К{i}") for i in range(3)]
+        with tempfile.TemporaryDirectory() as tmp:
+            cursor_file = os.path.join(tmp, "creditors.cursor")
+            out = StringIO()
+            call_command("export_changes", "creditors", cursor_file=cursor_file, batch_size=2,
+                         stdout=out, stderr=StringIO())
+            self.assertEqual([json.loads(line)['data']['name'] for line in out.getvalue().splitlines()],
+                             ["К0", "К1", "К2"])
+
+            creditors[1].name = "К1-новый"
+            creditors[1].save()
+            out = StringIO()
+            call_command("export_changes", "creditors", cursor_file=cursor_file, stdout=out, stderr=StringIO())
+            lines = out.getvalue().splitlines()
+            self.assertEqual([json.loads(line)['data']['name'] for line in lines], ["К1-новый"])
+
+
+class AgreementRowCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.creditor = Creditor.objects.create(type=CreditorType.BANK, name="Альфа")
+        self.agreements = Agreement.objects.bulk_create(
+            Agreement(
+                creditor=self.creditor, agreement_code=f"Д-{i}", total_sum=Decimal(1000),
+                agreement_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+            )
+            for i in range(3)
+        )
+
+    def render(self):
+        with mock.patch('credits.fragments.render_to_string', wraps=render_to_string) as render:
+            response = self.client.get(reverse('credits:dashboard'), {'agreement': self.agreements[0].pk})
+        # Две части (сводка и детали) на каждую отрендеренную строку
+        return response, render.call_count // 2
+
+    def test_only_changed_rows_are_rendered(self):
+        response, rendered = self.render()
+        self.assertEqual(rendered, 3)
+        self.assertContains(response, 'class="agreement-item active"')
+
+        response, rendered = self.render()
+        self.assertEqual(rendered, 0)
+        self.assertContains(response, "Д-2", count=2)
+
+        agreement = self.agreements[1]
+        agreement.agreement_code = "Д-новый"
+        agreement.save()
+        response, rendered = self.render()
+        self.assertEqual(rendered, 1)
+        self.assertContains(response, "Д-новый", count=2)
+
+        # Переименование кредитора меняет ключи всех его строк
+        self.creditor.name = "Бета"
+        self.creditor.save()
+        response, rendered = self.render()
+        self.assertEqual(rendered, 3)
+        self.assertNotContains(response, "Альфа")
+
+
+class CurrencyFormatTests(TestCase):
+    def test_matches_float_version_except_lost_kopecks(self):
+        fixed, other = compare(sample_values(20_000, seed=1))
+        self.assertEqual(other, [])
+        self.assertGreater(fixed, 0)
+
+    def test_formatting(self):
+        cases = {
+            None: "0,00 ₽",
+            "": "0,00 ₽",
+            0: "0,00 ₽",
+            Decimal("0.29"): "0,29 ₽",
+            0.29: "0,29 ₽",
+            100000.5: "100 000,50 ₽",
+            Decimal("99999999.99"): "99 999 999,99 ₽",
+            "400400.00": "400 400,00 ₽",
+            "abc": "abc",
+        }
+        for value, expected in cases.items():
+            with self.subTest(value=value):
+                self.assertEqual(currency_format(value), expected)
+
+
+@override_settings(CREDITS_PERF_SAMPLE_RATE=1.0, CREDITS_CREDITOR_REGISTRY=True)
+class PerformanceMiddlewareTests(TestCase):
+    def test_dashboard_metrics(self):
+        creditor = Creditor.objects.create(type=CreditorType.BANK, name="Альфа")
+        agreement = Agreement.objects.create(
+            creditor=creditor, agreement_code="Д-1",
+            agreement_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        get_creditors([creditor.pk])
+        with self.assertLogs('credits.performance', 'INFO') as logs:
+            response = self.client.get(reverse('credits:dashboard'), {'agreement': agreement.pk})
+        self.assertRegex(response.headers['Server-Timing'], r'^db;dur=[\d.]+;desc="SQL x2", tpl;dur=[\d.]+')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'credits:dashboard')
+        self.assertEqual((record['queries'], record['duplicate_queries']), (2, []))
+        self.assertEqual(record['response_bytes'], len(response.content))
+        self.assertGreater(record['template_ms'], 0)
+
+    def test_repeated_queries_are_flagged(self):
+        def view(request):
+            for creditor in Creditor.objects.all():
+                Agreement.objects.filter(creditor=creditor).count()
+            return HttpResponse("ok")
+
+        for i in range(3):
+            Creditor.objects.create(type=CreditorType.BANK, name=f"К{i}")
+        with self.assertLogs('credits.performance', 'WARNING') as logs:
+            PerformanceMiddleware(view)(RequestFactory().get('/'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['queries'], 4)
+        self.assertEqual(record['duplicate_queries'][0]['count'], 3)
+
+    @override_settings(CREDITS_PERF_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_untouched(self):
+        response = self.client.get(reverse('credits:report'))
+        self.assertNotIn('Server-Timing', response.headers)
+
+    def test_template_timing_is_scoped_to_request(self):
+        render = DjangoTemplate.render
+        with self.assertLogs('credits.performance', 'INFO') as logs:
+            self.client.get(reverse('credits:report'))
+        self.assertGreater(json.loads(logs.records[0].getMessage())['template_ms'], 0)
+        # Рендер вне запроса из выборки не учитывается и ничего не подменяет
+        self.assertIsInstance(get_template('credits/report.html'), TimedTemplate)
+        get_template('credits/report.html').render({})
+        self.assertIs(DjangoTemplate.render, render)
+
+
+class SyntheticDataTests(TestCase):
+    def test_generate_exact_sizes(self):
+        creditors, agreements = generate(3, 20, 250, seed=1)
+        self.assertEqual((len(creditors), len(agreements)), (3, 20))
+        self.assertEqual(Portfolio.objects.count(), 250)
+        self.assertEqual(sum(Agreement.objects.values_list("portfolio_count", flat=True)), 250)
+
+    def test_benchmark_harness_writes_results(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, "bench.json")
+            call_command("benchmark_credits", sizes="200", requests=1, output=output, stdout=StringIO())
+            with open(output) as f:
+                results = json.load(f)["results"]["200"]
+            self.assertIn("dashboard sort=creditor", results)
+            self.assertEqual(results["agreement form"]["runs"], 1)
+            call_command("benchmark_credits", sizes="200", requests=1, compare=output, threshold=1e9,
+                         stdout=StringIO())
+        # Данные прогона откатываются
+        self.assertFalse(Agreement.objects.exists())
+
+
+class DatabaseProfileTests(TestCase):
+    def test_write_benchmark_applies_sqlite_pragmas(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, "writes.json")
+            call_command("benchmark_db_writes", threads=2, writes=5, agreements=2, output=output,
+                         stdout=StringIO())
+            with open(output) as f:
+                results = json.load(f)["results"]
+        self.assertEqual(results["sqlite-default"]["journal_mode"], "delete")
+        self.assertEqual(results["sqlite-wal"]["journal_mode"], "wal")
+        for stats in results.values():
+            self.assertEqual(stats["written"] + stats["errors"], 10)
+        # Временные базы не задевают основную
+        self.assertFalse(Portfolio.objects.exists())
+
+
+@override_settings(ROOT_URLCONF='core.asgi_urls', CREDITS_PERF_SAMPLE_RATE=0)
+class AsyncViewsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        creditor = Creditor.objects.create(type=CreditorType.BANK, name="Альфа")
+        cls.agreement = Agreement.objects.create(
+            creditor=creditor, agreement_code="Д-1",
+            agreement_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        for i in range(3):
+            Portfolio.objects.create(
+                agreement=cls.agreement, type=PortfolioTypes.CESS, process_type=PortfolioProcessTypes.SOFT,
+                date_placement=date(2024, 1, i + 1),
+            )
+
+    async def test_pages_match_sync_views(self):
+        urls = [
+            (reverse('credits:dashboard'), {'agreement': self.agreement.pk}),
+            (reverse('credits:dashboard'), {'agreement': self.agreement.pk, 'q': "Альф"}),
+            (reverse('credits:agreement-portfolios', args=[self.agreement.pk]), {}),
+            (reverse('credits:api-index'), {}),
+            (reverse('credits:api-list', args=['portfolios']), {'limit': 2}),
+            (reverse('credits:api-detail', args=['agreements', self.agreement.pk]), {}),
+        ]
+        for url, params in urls:
+            response = await self.async_client.get(url, params)
+            with self.settings(ROOT_URLCONF='core.urls'):
+                expected = await self.async_client.get(url, params)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertEqual(response.content, expected.content, url)
+
+    async def test_redirect_and_errors(self):
+        response = await self.async_client.get(reverse('credits:dashboard'), {'q': "Д"})
+        self.assertRedirects(response, f"{reverse('credits:dashboard')}?q=%D0%94&agreement={self.agreement.pk}",
+                             fetch_redirect_response=False)
+        response = await self.async_client.get(reverse('credits:agreement-portfolios', args=[0]))
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.post(reverse('credits:api-list', args=['agreements']))
+        self.assertEqual(response.status_code, 405)
+
+    async def test_export_is_streamed_asynchronously(self):
+        response = await self.async_client.get(reverse('credits:export'))
+        self.assertTrue(response.is_async)
+        content = b"".join([part async for part in response.streaming_content])
+        with self.settings(ROOT_URLCONF='core.urls'):
+            expected = await self.async_client.get(reverse('credits:export'))
+        self.assertFalse(expected.is_async)
+        self.assertEqual(content, await sync_to_async(b"".join)(expected.streaming_content))
+        self.assertIn("Д-1".encode(), content)
+
+    @override_settings(CREDITS_PERF_SAMPLE_RATE=1.0)
+    async def test_sampled_async_request_counts_queries(self):
+        with self.assertLogs('credits.performance', 'INFO') as logs:
+            response = await self.async_client.get(reverse('credits:dashboard'), {'agreement': self.agreement.pk})
+        self.assertIn('Server-Timing', response.headers)
+        self.assertGreaterEqual(json.loads(logs.records[0].getMessage())['queries'], 2)
+
+
+class AsgiBenchmarkTests(TransactionTestCase):
+    def setUp(self):
+        creditor = Creditor.objects.create(type=CreditorType.BANK, name="Альфа")
+        self.agreement = Agreement.objects.create(
+            creditor=creditor, agreement_code="Д-1",
+            agreement_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        Portfolio.objects.create(
+            agreement=self.agreement, label="Портфель 1", type=PortfolioTypes.CESS,
+            process_type=PortfolioProcessTypes.SOFT, date_placement=date(2024, 1, 1),
+        )
+
+    def test_benchmark(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, "asgi.json")
+            call_command("benchmark_asgi", concurrency="2", requests=2, output=output, stdout=StringIO())
+            with open(output) as f:
+                results = json.load(f)["results"]
+        self.assertEqual(set(results), {"wsgi-sync", "asgi-sync", "asgi-async"})
+        self.assertEqual(results["asgi-async"]["2"]["dashboard"]["runs"], 2)
+
+
+class DocumentUploadTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name, CREDITS_UPLOAD_CHUNK_SIZE=4))
+        creditor = Creditor.objects.create(type=CreditorType.BANK, name="Альфа")
+        self.agreement = Agreement.objects.create(
+            creditor=creditor, agreement_code="Д-1",
+            agreement_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        self.content = b"0123456789"
+
+    def start_upload(self, **extra):
+        response = self.client.post(
+            reverse('credits:document-uploads'),
+            json.dumps({'filename': "../скан.pdf", 'size': len(self.content), **extra}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def put(self, url, start, end, **headers):
+        return self.client.put(
+            url, self.content[start:end + 1], content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f"bytes {start}-{end}/{len(self.content)}", **headers,
+        )
+
+    def test_resumable_upload_attached_by_form(self):
+        status = self.start_upload(sha256=hashlib.sha256(self.content).hexdigest())
+        self.assertEqual((status['filename'], status['offset']), ("скан.pdf", 0))
+        url = status['url']
+
+        self.assertEqual(self.put(url, 0, 3).json()['offset'], 4)
+        # Повтор принятой части и неверная контрольная сумма не сдвигают позицию
+        self.assertEqual(self.put(url, 0, 3).status_code, 409)
+        response = self.put(url, 4, 7, HTTP_X_CHUNK_SHA256="0" * 64)
+        self.assertEqual((response.status_code, response.headers['Upload-Offset']), (400, "4"))
+        self.assertEqual(self.client.get(url).json()['offset'], 4)
+
+        self.assertEqual(self.put(url, 4, 7, HTTP_X_CHUNK_SHA256=hashlib.sha256(b"4567").hexdigest()).status_code, 200)
+        self.assertTrue(self.put(url, 8, 9).json()['complete'])
+
+        response = self.client.post(reverse('credits:agreement-edit', args=[self.agreement.pk]), {
+            'creditor': self.agreement.creditor_id, 'agreement_code': "Д-2", 'agreement_date': "2024-01-01",
+            'agreement_type': self.agreement.agreement_type, 'total_sum': "1", 'total_amount': "1",
+            'document_upload': status['id'],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.agreement.refresh_from_db()
+        self.assertRegex(self.agreement.agreement_doc.name, r"^sha256/[0-9a-f]{64}/скан\.pdf$")
+        self.assertEqual(self.agreement.agreement_doc.read(), self.content)
+        self.assertFalse(DocumentUpload.objects.exists())
+
+    def test_file_checksum_mismatch_restarts_upload(self):
+        url = self.start_upload(sha256="f" * 64)['url']
+        self.put(url, 0, 3)
+        self.put(url, 4, 7)
+        response = self.put(url, 8, 9)
+        self.assertEqual((response.status_code, response.headers['Upload-Offset']), (422, "0"))
+
+    def test_losing_parallel_chunk_leaves_accepted_bytes(self):
+        upload = DocumentUpload.objects.get(pk=self.start_upload()['id'])
+        stale = DocumentUpload.objects.get(pk=upload.pk)
+        write_chunk(upload, BytesIO(b"0123"), 0, 3, 10)
+        with self.assertRaises(UploadError) as error:
+            write_chunk(stale, BytesIO(b"XXXX"), 0, 3, 10)
+        self.assertEqual(error.exception.status, 409)
+        write_chunk(upload, BytesIO(b"456789"), 4, 9, 10)
+        with open(part_path(upload), 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(upload.sha256, hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(os.listdir(os.path.dirname(part_path(upload))), [f"{upload.pk}.part"])
+
+    def test_interrupted_assembly_is_finished_by_next_request(self):
+        retries = [lambda url: self.client.get(url), lambda url: self.put(url, 4, 9)]
+        for retry in retries:
+            status = self.start_upload(sha256=hashlib.sha256(self.content).hexdigest())
+            self.put(status['url'], 0, 3)
+            # Процесс оборвался после приёма последней части, до сборки файла
+            with mock.patch('credits.documents.finish_upload'):
+                self.put(status['url'], 4, 9)
+            upload = DocumentUpload.objects.get(pk=status['id'])
+            self.assertEqual((upload.offset, upload.complete), (10, False))
+
+            response = retry(status['url'])
+            self.assertEqual((response.status_code, response.json()['complete']), (200, True))
+            with open(part_path(upload), 'rb') as f:
+                self.assertEqual(f.read(), self.content)
+
+    def test_upload_size_is_limited(self):
+        with self.settings(CREDITS_UPLOAD_MAX_SIZE=5):
+            response = self.client.post(
+                reverse('credits:document-uploads'), json.dumps({'filename': "скан.pdf", 'size': 10}),
+                content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 413)
+
+    def test_incomplete_upload_is_rejected_by_form(self):
+        status = self.start_upload()
+        response = self.client.post(reverse('credits:agreement-new'), {
+            'creditor': self.agreement.creditor_id, 'agreement_code': "Д-3", 'agreement_date': "2024-01-01",
+            'agreement_type': self.agreement.agreement_type, 'total_sum': "1", 'total_amount': "1",
+            'document_upload': status['id'],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Agreement.objects.filter(agreement_code="Д-3").exists())
+
+    def test_download_with_range(self):
+        self.agreement.agreement_doc.save("скан.pdf", ContentFile(self.content))
+        digest = hashlib.sha256(self.content).hexdigest()
+        url = reverse('credits:agreement-document', args=[self.agreement.pk])
+
+        response = self.client.get(url)
+        self.assertEqual((response.status_code, b"".join(response.streaming_content)), (200, self.content))
+        self.assertEqual(response.headers['Accept-Ranges'], "bytes")
+
+        response = self.client.get(url, HTTP_RANGE="bytes=2-5")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers['Content-Range'], "bytes 2-5/10")
+        self.assertEqual(b"".join(response.streaming_content), b"2345")
+        self.assertEqual(b"".join(self.client.get(url, HTTP_RANGE="bytes=-3").streaming_content), b"789")
+        self.assertEqual(self.client.get(url, HTTP_RANGE="bytes=20-").status_code, 416)
+
+        with self.settings(CREDITS_DOCUMENT_SENDFILE='x-accel-redirect'):
+            response = self.client.get(url)
+        self.assertEqual(response.headers['X-Accel-Redirect'], quote(f"/protected/blobs/{digest[:2]}/{digest}"))
+        self.assertEqual(response.content, b"")
+
+    @override_settings(ROOT_URLCONF='core.asgi_urls')
+    async def test_asgi_download_is_streamed(self):
+        await sync_to_async(self.agreement.agreement_doc.save)("скан.pdf", ContentFile(self.content))
+        url = reverse('credits:agreement-document', args=[self.agreement.pk])
+        response = await self.async_client.get(url, headers={'Range': "bytes=2-5"})
+        self.assertEqual((response.status_code, response.headers['Content-Length']), (206, "4"))
+        self.assertTrue(response.is_async)
+        self.assertEqual(b"".join([part async for part in response.streaming_content]), b"2345")
+
+
+class DocumentStoreTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = media.name
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.creditor = Creditor.objects.create(type=CreditorType.BANK, name="Альфа")
+
+    def agreement(self, code, content):
+        agreement = Agreement(
+            creditor=self.creditor, agreement_code=code,
+            agreement_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        agreement.agreement_doc.save(f"{code}.pdf", ContentFile(content), save=False)
+        agreement.save()
+        return agreement
+
+    def blob_path(self, content):
+        digest = hashlib.sha256(content).hexdigest()
+        return os.path.join(self.media, "blobs", digest[:2], digest)
+
+    def expire_grace(self):
+        DocumentBlob.objects.update(date_saved=timezone.now() - timedelta(hours=1))
+
+    def test_same_content_is_stored_once(self):
+        first = self.agreement("Д-1", b"PDF")
+        second = self.agreement("Д-2", b"PDF")
+        self.assertNotEqual(first.agreement_doc.name, second.agreement_doc.name)
+        self.assertEqual(first.agreement_doc.path, second.agreement_doc.path)
+        self.assertEqual(second.agreement_doc.read(), b"PDF")
+        self.assertEqual(DocumentBlob.objects.get().references, 2)
+        self.assertEqual(os.listdir(os.path.join(self.media, "blobs", "tmp")), [])
+
+    def test_api_links_to_download_view(self):
+        agreement = self.agreement("Д-1", b"PDF")
+        url = self.client.get(reverse('credits:api-detail', args=['agreements', agreement.pk])).json()['agreement_doc']
+        path = reverse('credits:agreement-document', args=[agreement.pk])
+        self.assertEqual(url, f"http://testserver{path}")
+        self.assertIs(resolve(path).func, document_download_view)
+        response = self.client.get(path)
+        self.assertEqual(b"".join(response.streaming_content), b"PDF")
+        self.assertIn("Д-1.pdf", unquote(response["Content-Disposition"]))
+
+    def test_file_on_disk_is_stored_under_its_own_hash(self):
+        source = os.path.join(self.media, "upload.part")
+        with open(source, "wb") as f:
+            f.write(b"PDF")
+        with open(source, "rb") as f:
+            document = AssembledFile(f, name="скан.pdf")
+            # Заявленный хэш не используется
+            document.sha256 = hashlib.sha256(b"other").hexdigest()
+            name = document_storage.save("скан.pdf", document)
+        self.assertEqual(name, f"sha256/{hashlib.sha256(b'PDF').hexdigest()}/скан.pdf")
+        self.assertFalse(os.path.exists(source))
+        with open(self.blob_path(b"PDF"), "rb") as f:
+            self.assertEqual(f.read(), b"PDF")
+        self.assertEqual(os.listdir(os.path.join(self.media, "blobs", "tmp")), [])
+
+    def test_blob_collected_after_last_reference(self):
+        first = self.agreement("Д-1", b"PDF")
+        self.agreement("Д-2", b"PDF")
+        self.expire_grace()
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.exists(self.blob_path(b"PDF")))
+
+        # Каскад от кредитора убирает последнюю ссылку
+        with self.captureOnCommitCallbacks(execute=True):
+            self.creditor.delete()
+        self.assertFalse(DocumentBlob.objects.exists())
+        self.assertFalse(os.path.exists(self.blob_path(b"PDF")))
+
+    def test_replaced_document_is_released(self):
+        agreement = Agreement.objects.get(pk=self.agreement("Д-1", b"old").pk)
+        self.expire_grace()
+        with self.captureOnCommitCallbacks(execute=True):
+            agreement.agreement_doc.save("new.pdf", ContentFile(b"new"))
+        self.assertFalse(os.path.exists(self.blob_path(b"old")))
+        self.assertEqual(DocumentBlob.objects.get().references, 1)
+
+    def test_collect_command_repairs_counts(self):
+        self.agreement("Д-1", b"PDF")
+        DocumentBlob.objects.update(references=5)
+        os.makedirs(os.path.join(self.media, "blobs", "ff"))
+        orphan = os.path.join(self.media, "blobs", "ff", "f" * 64)
+        open(orphan, "wb").close()
+        os.utime(orphan, (0, 0))
+
+        call_command("collect_document_blobs", stdout=StringIO())
+        self.assertEqual(DocumentBlob.objects.get().references, 1)
+        self.assertFalse(os.path.exists(orphan))
+        self.assertTrue(os.path.exists(self.blob_path(b"PDF")))
+
+
+@override_settings(CREDITS_DELETION_THREAD=False, CREDITS_DELETE_BATCH_SIZE=2)
+class DeletionTests(TestCase):
+    def setUp(self):
+        self.creditor = Creditor.objects.create(type=CreditorType.BANK, name="Альфа")
+        self.agreement = self.make_agreement("Д-1")
+        self.portfolios = [Portfolio.objects.create(agreement=self.agreement) for _ in range(5)]
+        self.agreement.refresh_from_db()
+
+    def make_agreement(self, code, creditor=None, **fields):
+        return Agreement.objects.create(
+            creditor=creditor or self.creditor, agreement_code=code,
+            agreement_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc), **fields,
+        )
+
+    def test_delete_view_hides_agreement_and_job_deletes_in_batches(self):
+        response = self.client.post(reverse('credits:agreement-delete', args=[self.agreement.pk]))
+        self.assertRedirects(response, reverse('credits:dashboard'), fetch_redirect_response=False)
+
+        # Скрыт сразу, хотя строки ещё на месте
+        self.assertFalse(Agreement.objects.filter(pk=self.agreement.pk).exists())
+        self.assertEqual(Portfolio.objects.filter(agreement=self.agreement).count(), 5)
+        api = self.client.get(reverse('credits:api-list', args=['portfolios'])).json()
+        self.assertEqual(api['results'], [])
+        self.assertEqual(
+            self.client.get(reverse('credits:agreement-edit', args=[self.agreement.pk])).status_code, 404
+        )
+
+        job = DeletionJob.objects.get()
+        self.assertEqual((job.status, job.total, job.deleted), (DeletionStatus.PENDING, 5, 0))
+        # Пачки по 2 портфеля
+        with CaptureQueriesContext(connection) as queries:
+            run_deletion(job.pk)
+        deletes = [q for q in queries.captured_queries
+                   if q["sql"].startswith('DELETE FROM "credit_portfolio"') and '"credit_portfolio"."id" IN' in q["sql"]]
+        self.assertEqual(len(deletes), 3)
+        # Записи об удалении - одним INSERT ... SELECT на пачку, а не на портфель;
+        # ещё два - каскад договора (портфелей уже нет) и сам договор
+        inserts = [q for q in queries.captured_queries if q["sql"].startswith('INSERT INTO "credit_tombstone"')]
+        self.assertEqual(len(inserts), 3 + 2)
+        self.assertEqual(sum(' SELECT ' in q["sql"] for q in inserts), 3 + 1)
+
+        status = self.client.get(reverse('credits:deletion-status', args=[job.pk])).json()
+        self.assertEqual((status['status'], status['deleted'], status['progress']), ('done', 5, 1.0))
+        self.assertFalse(Agreement.all_objects.filter(pk=self.agreement.pk).exists())
+        self.assertFalse(Portfolio.objects.exists())
+        self.assertEqual(Tombstone.objects.filter(model='portfolio').count(), 5)
+        self.assertIsNone(run_deletion(job.pk))
+
+    def test_creditor_deletion_through_command(self):
+        other = self.make_agreement("Д-2")
+        Portfolio.objects.create(agreement=other)
+        schedule_deletion(self.creditor)
+        self.assertFalse(Agreement.objects.exists())
+        self.assertEqual(DeletionJob.objects.get().total, 6)
+
+        out = StringIO()
+        call_command("process_deletions", stdout=out)
+        self.assertIn("Выполнено заданий: 1", out.getvalue())
+        self.assertFalse(Creditor.all_objects.exists())
+        self.assertFalse(Agreement.all_objects.exists())
+        self.assertEqual(DeletionJob.objects.get().deleted, 6)
+
+    def test_creditor_protected_as_first_creditor(self):
+        owner = Creditor.objects.create(type=CreditorType.MFKO, name="Бета")
+        self.make_agreement("Д-3", creditor=owner, creditor_first=self.creditor)
+        with self.assertRaises(DeletionError):
+            schedule_deletion(self.creditor)
+        self.assertTrue(Creditor.objects.filter(pk=self.creditor.pk).exists())
+        self.assertFalse(DeletionJob.objects.exists())
+
+    def test_interrupted_job_is_resumed(self):
+        job = schedule_deletion(self.agreement)
+        DeletionJob.objects.filter(pk=job.pk).update(
+            status=DeletionStatus.RUNNING, date_update=timezone.now() - timedelta(hours=1)
+        )
+        call_command("process_deletions", stdout=StringIO())
+        self.assertEqual(DeletionJob.objects.get().status, DeletionStatus.DONE)
+        self.assertFalse(Portfolio.objects.exists())
+
+
+class AdminScalabilityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser("admin", password="x")
+        cls.creditor = Creditor.objects.create(type=CreditorType.BANK, name="Альфа")
+        cls.agreement = Agreement.objects.create(
+            creditor=cls.creditor, agreement_code="ДЦ-0001",
+            agreement_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        Portfolio.objects.bulk_create(
+            Portfolio(agreement=cls.agreement, label=f"П{i}", date_placement=date(2024, 1, 1)) for i in range(25)
+        )
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_portfolio_inline_is_paginated(self):
+        url = reverse('admin:credits_agreement_change', args=[self.agreement.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.context['inline_admin_formsets'][0].formset.initial_form_count(), 20)
+        self.assertContains(response, "?portfolio_page=2")
+        # Кредиторы подгружаются автодополнением, а не списком <option>
+        self.assertContains(response, 'class="admin-autocomplete', count=2)
+
+        response = self.client.get(url, {'portfolio_page': 2})
+        self.assertEqual(response.context['inline_admin_formsets'][0].formset.initial_form_count(), 5)
+
+    def test_inline_page_links_keep_query(self):
+        url = reverse('admin:credits_agreement_change', args=[self.agreement.pk])
+        response = self.client.get(url, {'_changelist_filters': "q=0001", 'portfolio_page': 2})
+        self.assertContains(response, 'href="?_changelist_filters=q%3D0001&amp;portfolio_page=1"')
+
+    def test_creditor_search_uses_name_key(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:credits_creditor_changelist'), {'q': "альф"})
+        self.assertEqual(list(response.context['cl'].result_list), [self.creditor])
+        self.assertTrue([q for q in queries.captured_queries if '"name_key" >=' in q['sql']])
+
+    def test_changelist_uses_estimated_count_without_filters(self):
+        url = reverse('admin:credits_portfolio_changelist')
+        with mock.patch('credits.admin.ESTIMATE_THRESHOLD', 1):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.context['cl'].result_count, Portfolio.objects.order_by('-id').first().pk)
+            self.assertFalse([q for q in queries.captured_queries if 'COUNT(*)' in q['sql']])
+
+            # С фильтром - точный COUNT
+            response = self.client.get(url, {'process_type__exact': PortfolioProcessTypes.HARD})
+            self.assertEqual(response.context['cl'].result_count, 0)
+
+    @override_settings(CREDITS_DELETION_THREAD=False)
+    def test_portfolios_of_marked_agreement_are_hidden(self):
+        schedule_deletion(self.agreement)
+        response = self.client.get(reverse('admin:credits_portfolio_changelist'))
+        self.assertEqual(response.context['cl'].result_count, 0)
+
+    def test_search_goes_through_agreement_index(self):
+        response = self.client.get(reverse('admin:credits_portfolio_changelist'), {'q': "0001"})
+        self.assertEqual(response.context['cl'].result_count, 25)
+        response = self.client.get(reverse('admin:credits_agreement_changelist'), {'q': "альф"})
+        self.assertEqual(list(response.context['cl'].result_list), [self.agreement])
+
+
+class CreditorAutocompleteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Creditor.objects.bulk_create([
+            Creditor(type=CreditorType.BANK, name="Альфа-Банк"),
+            Creditor(type=CreditorType.MFKO, name="АЛЬФА  Финанс"),
+            Creditor(type=CreditorType.BANK, name="Бета"),
+        ] + [Creditor(type=CreditorType.BANK, name=f"Гамма {i:02}") for i in range(25)])
+        cls.url = reverse('credits:creditor-autocomplete')
+
+    def test_prefix_is_case_insensitive_and_filtered_by_type(self):
+        response = self.client.get(self.url, {'q': "альфа "})
+        self.assertEqual([r['text'] for r in response.json()['results']], ["АЛЬФА  Финанс", "Альфа-Банк"])
+        response = self.client.get(self.url, {'q': "альфа", 'type': CreditorType.BANK})
+        self.assertEqual([r['text'] for r in response.json()['results']], ["Альфа-Банк"])
+        self.assertEqual(self.client.get(self.url, {'type': 'x'}).status_code, 400)
+
+        # name_key поддерживается и при update()
+        Creditor.objects.filter(name="Бета").update(name="альфа-лизинг")
+        self.assertEqual(len(self.client.get(self.url, {'q': "АЛЬФА"}).json()['results']), 3)
+
+    def test_results_are_limited(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(self.url, {'q': "гам"}).json()
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(len(data['results']), 20)
+        self.assertTrue(data['more'])
+
+    def test_form_renders_only_selected_creditor(self):
+        creditor = Creditor.objects.get(name="Бета")
+        agreement = Agreement.objects.create(
+            creditor=creditor, agreement_code="ДЦ-1",
+            agreement_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        response = self.client.get(reverse('credits:agreement-edit', args=[agreement.pk]))
+        self.assertContains(response, f'<option value="{creditor.pk}" selected>Бета</option>', html=True)
+        self.assertNotContains(response, "Гамма")
+        self.assertContains(response, 'data-autocomplete-url="%s"' % self.url, count=2)
+
+
+@override_settings(CREDITS_CREDITOR_REGISTRY=True)
+class CreditorRegistryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.creditor = Creditor.objects.create(type=CreditorType.BANK, name="Альфа")
+        cls.agreement = Agreement.objects.create(
+            creditor=cls.creditor, creditor_first=cls.creditor, agreement_code="ДЦ-1",
+            agreement_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+        )
+
+    @override_settings(CREDITS_CREDITOR_REGISTRY=None)
+    def test_process_local_cache_is_bypassed(self):
+        # LocMemCache не общий для процессов: кредиторы всегда читаются из базы
+        get_creditors([self.creditor.pk])
+        with self.assertNumQueries(1):
+            self.assertEqual(get_creditors([self.creditor.pk])[self.creditor.pk].name, "Альфа")
+
+    def test_creditor_cursor_comes_from_query(self):
+        Agreement.objects.create(
+            creditor=self.creditor, agreement_code="ДЦ-2", agreement_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        get_creditors([self.creditor.pk])
+        Creditor._base_manager.filter(pk=self.creditor.pk).update(name="Бета")
+        page = paginate_agreements(Agreement.objects.all(), 'creditor', 'asc', per_page=1)
+        self.assertEqual(page.items[0].creditor.name, "Альфа")
+        self.assertEqual(decode_cursor(page.next_cursor, 'creditor')[0][0], "Бета")
+
+    def test_entry_keys_follow_model_fields(self):
+        get_creditors([self.creditor.pk])
+        with mock.patch('credits.registry._local', (None, {})), \
+                mock.patch('credits.registry._fields', return_value=["id", "type", "name"]), \
+                self.assertNumQueries(1):
+            get_creditors([self.creditor.pk])
+
+    def test_lookup_is_cached_and_invalidated_by_signals(self):
+        get_creditors([self.creditor.pk])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_creditors([self.creditor.pk])[self.creditor.pk].name, "Альфа")
+        # Копия другого процесса пуста: запись берётся из кэша Django
+        with mock.patch('credits.registry._local', (None, {})), self.assertNumQueries(0):
+            self.assertEqual(get_creditors([self.creditor.pk])[self.creditor.pk].name, "Альфа")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Creditor.objects.get(pk=self.creditor.pk).save()
+            Creditor.objects.filter(pk=self.creditor.pk).update(name="Бета")
+        self.assertEqual(get_creditors([self.creditor.pk])[self.creditor.pk].name, "Бета")
+
+        other = Creditor.objects.create(type=CreditorType.MKO, name="Гамма")
+        get_creditors([other.pk])
+        other.delete()
+        self.assertEqual(get_creditors([other.pk]), {})
+
+    def test_pages_read_creditors_from_registry(self):
+        portfolio = Portfolio.objects.create(agreement=self.agreement, date_placement=date(2024, 3, 1))
+        pages = [
+            (reverse('credits:dashboard'), {'agreement': self.agreement.pk}, 2),
+            (reverse('credits:dashboard'), {'agreement': self.agreement.pk, 'sort': 'creditor'}, 2),
+            (reverse('credits:agreement-edit', args=[self.agreement.pk]), {}, 1),
+            (reverse('credits:portfolio-new', args=[self.agreement.pk]), {}, 1),
+            (reverse('credits:portfolio-edit', args=[portfolio.pk]), {}, 1),
+        ]
+        get_creditors([self.creditor.pk])
+        for url, params, queries in pages:
+            with self.subTest(url=url, params=params), self.assertNumQueries(queries):
+                response = self.client.get(url, params)
+                self.assertContains(response, "Альфа")
+
+
+class PortfolioBulkEditTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        creditor = Creditor.objects.create(type=CreditorType.BANK, name="Альфа")
+        cls.agreement, other = Agreement.objects.bulk_create(
+            Agreement(
+                creditor=creditor, agreement_code=code,
+                agreement_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+            )
+            for code in ("ДЦ-1", "ДЦ-2")
+        )
+        for i in range(4):
+            Portfolio.objects.create(
+                agreement=cls.agreement, process_type=PortfolioProcessTypes.SOFT,
+                total_sum=Decimal(100), date_placement=date(2024, 1, i + 1),
+            )
+        cls.foreign = Portfolio.objects.create(agreement=other, date_placement=date(2024, 1, 1))
+        cls.url = reverse('credits:portfolio-bulk-edit', args=[cls.agreement.pk])
+
+    def post_json(self, data):
+        return self.client.post(self.url, json.dumps(data), content_type='application/json')
+
+    def test_selected_portfolios_updated_in_one_statement(self):
+        selected = list(self.agreement.portfolio_set.order_by('id').values_list('id', flat=True)[:3])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_json({
+                'portfolios': selected,
+                'process_type': PortfolioProcessTypes.HARD,
+                'date_finish': '2024-06-30',
+            })
+        self.assertEqual(response.json()['updated'], 3)
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE "credit_portfolio"')]
+        self.assertEqual(len(updates), 1)
+
+        for portfolio in Portfolio.objects.filter(agreement=self.agreement):
+            edited = portfolio.pk in selected
+            self.assertEqual(portfolio.process_type, PortfolioProcessTypes.HARD if edited else PortfolioProcessTypes.SOFT)
+            self.assertEqual(portfolio.date_finish, date(2024, 6, 30) if edited else None)
+            self.assertEqual(portfolio.label, portfolio.build_label())
+            self.assertEqual(portfolio.total_sum, Decimal(100))
+        self.agreement.refresh_from_db()
+        self.assertEqual(self.agreement.portfolio_date_last, date(2024, 6, 30))
+
+    def test_validation(self):
+        own = self.agreement.portfolio_set.values_list('id', flat=True)[0]
+        cases = [
+            ({'portfolios': [own, self.foreign.pk], 'process_type': PortfolioProcessTypes.HARD}, 'portfolios'),
+            ({'portfolios': [own], 'process_type': 99}, 'process_type'),
+            ({'portfolios': [own], 'total_sum': '1e20'}, 'total_sum'),
+            ({'portfolios': [own]}, '__all__'),
+        ]
+        for data, field in cases:
+            with self.subTest(data=data):
+                response = self.post_json(data)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(field, response.json()['errors'])
+        self.assertFalse(Portfolio.objects.exclude(process_type=PortfolioProcessTypes.SOFT).exclude(pk=self.foreign.pk))
+
+    def test_html_form(self):
+        self.assertContains(self.client.get(self.url), '<input type="checkbox" name="portfolios"', count=4)
+        response = self.client.post(self.url, {
+            'portfolios': list(self.agreement.portfolio_set.values_list('id', flat=True)), 'total_sum': '50',
+        })
+        self.assertRedirects(response, f"{reverse('credits:dashboard')}?agreement={self.agreement.pk}",
+                             fetch_redirect_response=False)
+        self.agreement.refresh_from_db()
+        self.assertEqual(self.agreement.portfolio_total_sum, Decimal(200))
+
+    def test_selection_is_filtered_and_paged(self):
+        Portfolio.objects.filter(pk=self.agreement.portfolio_set.order_by('id')[0].pk).update(
+            process_type=PortfolioProcessTypes.HARD
+        )
+        response = self.client.get(self.url, {'process_type': PortfolioProcessTypes.SOFT, 'placement_to': '2024-01-03'})
+        self.assertContains(response, '<input type="checkbox" name="portfolios"', count=2)
+
+        with mock.patch('credits.forms.PortfolioBulkForm.page_size', 3):
+            response = self.client.get(self.url, {'page': 2})
+        self.assertContains(response, '<input type="checkbox" name="portfolios"', count=1)
+        self.assertContains(response, 'Страница 2 из 2')
+
+    def test_select_all_matching(self):
+        response = self.client.post(
+            f"{self.url}?process_type={PortfolioProcessTypes.SOFT}&placement_from=2024-01-02",
+            json.dumps({'select_all': True, 'process_type': PortfolioProcessTypes.HARD}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.json()['updated'], 3)
+        self.assertEqual(
+            list(Portfolio.objects.filter(process_type=PortfolioProcessTypes.HARD).values_list('date_placement', flat=True)
+                 .order_by('date_placement')),
+            [date(2024, 1, 2), date(2024, 1, 3), date(2024, 1, 4)],
+        )
+
+        response = self.post_json({'process_type': PortfolioProcessTypes.HARD})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('portfolios', response.json()['errors'])
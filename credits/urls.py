@@ -1,16 +1,32 @@
 from django.urls import path
-from . import views
+from . import api, documents, views
 
 app_name = 'credits'
 
 urlpatterns = [
     path('', views.dashboard_view, name='dashboard'),
+    path('export/', views.export_view, name='export'),
+    path('report/', views.report_view, name='report'),
+
+    path('api/v1/', api.index_view, name='api-index'),
+    path('api/v1/<str:resource_name>/', api.list_view, name='api-list'),
+    path('api/v1/<str:resource_name>/changes/', api.changes_view, name='api-changes'),
+    path('api/v1/<str:resource_name>/<int:pk>/', api.detail_view, name='api-detail'),
 
     path('agreements/new/', views.agreement_create_view, name='agreement-new'),
     path('agreements/<int:pk>/edit/', views.agreement_update_view, name='agreement-edit'),
     path('agreements/<int:pk>/delete/', views.agreement_delete_view, name='agreement-delete'),
+    path('agreements/<int:pk>/portfolios/', views.agreement_portfolios_view, name='agreement-portfolios'),
+    path('agreements/<int:pk>/document/', documents.document_download_view, name='agreement-document'),
+
+    path('creditors/autocomplete/', views.creditor_autocomplete_view, name='creditor-autocomplete'),
+    path('deletions/<int:pk>/', views.deletion_status_view, name='deletion-status'),
+
+    path('documents/uploads/', documents.upload_create_view, name='document-uploads'),
+    path('documents/uploads/<uuid:upload_id>/', documents.upload_view, name='document-upload'),
 
     path('agreements/<int:agreement_pk>/portfolio/new/', views.portfolio_create_view, name='portfolio-new'),
+    path('agreements/<int:agreement_pk>/portfolios/bulk/', views.portfolio_bulk_edit_view, name='portfolio-bulk-edit'),
     path('portfolio/<int:pk>/edit/', views.portfolio_update_view, name='portfolio-edit'),
     path('portfolio/<int:pk>/delete/', views.portfolio_delete_view, name='portfolio-delete'),
 ]
\ No newline at end of file
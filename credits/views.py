@@ -1,52 +1,290 @@
+import csv
+import json
+from itertools import chain, islice
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 from django.contrib import messages
-from django.http import HttpResponseRedirect
-from .models import Agreement, Portfolio
-from .forms import AgreementForm, PortfolioForm
+from django.db.models import Prefetch
+from django.http import Http404, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.views.decorators.http import require_safe
+from .models import Agreement, Creditor, CreditorType, DeletionJob, Portfolio
+from .concurrency import stream_async
+from .deletion import schedule_deletion
+from .forms import AgreementFilterForm, AgreementForm, PortfolioBulkForm, PortfolioForm, PortfolioSelectionForm
+from .fragments import render_agreement_rows
+from .pagination import PAGE_SIZE, SORT_LABELS, KeysetPage, keyset_ordering, paginate_agreements, resolve_sort
+from .registry import attach_creditors
+from .reports import portfolio_report
+from .search import normalize_query, ranked_agreements, search_agreements
+from .templatetags.custom_filters import currency_format
+
+EXPORT_CHUNK_SIZE = 2000
+
+CREDITOR_AUTOCOMPLETE_LIMIT = 20
+
+EXPORT_HEADER = [
+    'ID договора', 'Реквизиты договора', 'Дата договора', 'Тип договора',
+    'Кредитор', 'Первоначальный кредитор', 'Стоимость портфеля', 'Размер портфеля',
+    'ID портфеля', 'Наименование портфеля', 'Тип работы', 'Стоимость',
+    'Дата начала работы', 'Дата окончания работы', 'Дата переуступки',
+]
+
+
+def agreement_page(request, queryset, query):
+    """
+    The agreements list for the dashboard: a search without explicit sort
+    gives the best matches as a single page, otherwise a keyset page.
+    Returns (page, sort key).
+    """
+    # An empty sort (the form's default option) means "best matches" for a search
+    sort = request.GET.get('sort') or 'id'
+    if query and not request.GET.get('sort'):
+        return KeysetPage(items=attach_creditors(ranked_agreements(queryset, query, PAGE_SIZE))), 'rank'
+    if query:
+        queryset = search_agreements(queryset, query)
+    # Keyset pagination (sort key + id tiebreaker)
+    page = paginate_agreements(
+        queryset,
+        sort,
+        request.GET.get('dir', 'asc'),
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
+    return page, sort
+
+
+def selected_agreement_id(request):
+    aid = request.GET.get('agreement')
+    return int(aid) if aid and aid.isdigit() else None
+
+
+def dashboard_context(request, agreements, sort, query, agreement_rows, current_agreement, portfolios,
+                      filter_form):
+    direction = request.GET.get('dir', 'asc')
+    return {
+        'filter_form': filter_form,
+        'sort_labels': SORT_LABELS,
+        'agreements': agreements,
+        'agreement_rows': agreement_rows,
+        'current_agreement': current_agreement,
+        'portfolios': portfolios,
+        'next_cursor': agreements.next_cursor,
+        'prev_cursor': agreements.prev_cursor,
+        'query': query,
+        'current_sort': sort,
+        'current_dir': direction,
+        'rev_dir': 'desc' if direction == 'asc' else 'asc',
+    }
+
+
+def dashboard_redirect(request, first):
+    """Redirect to the first agreement, keeping search and sort"""
+    params = request.GET.copy()
+    params['agreement'] = first.pk
+    return redirect(f"{reverse('credits:dashboard')}?{params.urlencode()}")
 
 
 def dashboard_view(request):
-    """Dashboard view showing agreements and portfolios"""
+    """
+    Dashboard view showing agreements and portfolios.
+
+    Query plan (constant, independent of the number of agreements):
+      1. one page of agreements; creditor and creditor_first come from the
+         cached registry (a search without explicit sort first reads ranked
+         ids from the index);
+      2. the selected agreement, only if it is not on the current page;
+      3. portfolios of the selected agreement.
+    """
     # Redirect to first agreement if none selected
     if not request.GET.get('agreement'):
         first = Agreement.objects.order_by('id').first()
         if first:
-            return redirect(f"{reverse('credits:dashboard')}?agreement={first.pk}")
+            return dashboard_redirect(request, first)
     
-    # Get sorting parameters
-    sort = request.GET.get('sort', 'id')
-    direction = request.GET.get('dir', 'asc')
-    
-    # Build ordering
-    allowed = {'id', 'agreement_code', 'agreement_date', 'total_sum'}
-    if sort == 'creditor':
-        order = f"{'-' if direction == 'desc' else ''}creditor__name"
-    elif sort == 'agreement_type':
-        order = f"{'-' if direction == 'desc' else ''}agreement_type"
-    elif sort in allowed:
-        order = f"{'-' if direction == 'desc' else ''}{sort}"
-    else:
-        order = 'id'
+    query = normalize_query(request.GET.get('q'))
     
-    # Get agreements with sorting
-    agreements = Agreement.objects.select_related('creditor').order_by(order)
+    # Filters on the stored portfolio aggregates
+    filter_form = AgreementFilterForm(request.GET)
+    queryset = filter_form.filter(Agreement.objects.all())
+    agreements, sort = agreement_page(request, queryset, query)
     
-    # Get current agreement
-    aid = request.GET.get('agreement')
+    # Get current agreement, reusing the row from the page when possible
+    aid = selected_agreement_id(request)
     current_agreement = None
-    if aid and aid.isdigit():
-        current_agreement = Agreement.objects.filter(pk=aid).first()
+    portfolios = []
+    if aid is not None:
+        current_agreement = next((a for a in agreements if a.pk == aid), None)
+        if current_agreement is None:
+            current_agreement = Agreement.objects.filter(pk=aid).first()
+    if current_agreement:
+        portfolios = list(current_agreement.portfolio_set.order_by('date_placement', 'id'))
+    
+    context = dashboard_context(
+        request, agreements, sort, query, render_agreement_rows(agreements), current_agreement, portfolios,
+        filter_form,
+    )
+    return render(request, 'credits/dashboard.html', context)
+
+
+def agreement_portfolios_view(request, pk):
+    """Portfolios panel fragment for one agreement (swapped into the dashboard)"""
+    agreement = get_object_or_404(Agreement.objects.only('id', 'agreement_code'), pk=pk)
     
     context = {
-        'agreements': agreements,
-        'current_agreement': current_agreement,
-        'current_sort': sort,
-        'current_dir': direction,
-        'rev_dir': 'desc' if direction == 'asc' else 'asc',
+        'current_agreement': agreement,
+        'portfolios': list(agreement.portfolio_set.order_by('date_placement', 'id')),
     }
+    return render(request, 'credits/portfolios_panel.html', context)
+
+
+def _load_messages(request):
+    # The template reads messages from the session: load them off the event loop
+    list(messages.get_messages(request))
+
+
+async def _aagreement_portfolios(agreement_id):
+    return [p async for p in Portfolio.objects.filter(agreement_id=agreement_id).order_by('date_placement', 'id')]
+
+
+async def async_dashboard_view(request):
+    """
+    Dashboard for ASGI: same page as dashboard_view. Single-row reads and the
+    portfolios use the async ORM; the keyset page with its cached rows, the
+    session messages and rendering run through sync_to_async.
+    """
+    if not request.GET.get('agreement'):
+        first = await Agreement.objects.order_by('id').afirst()
+        if first:
+            return dashboard_redirect(request, first)
+
+    query = normalize_query(request.GET.get('q'))
+    filter_form = AgreementFilterForm(request.GET)
+    queryset = filter_form.filter(Agreement.objects.all())
+    aid = selected_agreement_id(request)
+
+    def page():
+        agreements, sort = agreement_page(request, queryset, query)
+        return agreements, sort, render_agreement_rows(agreements)
+
+    agreements, sort, agreement_rows = await sync_to_async(page)()
+
+    current_agreement = next((a for a in agreements if a.pk == aid), None)
+    if current_agreement is None and aid is not None:
+        current_agreement = await Agreement.objects.filter(pk=aid).afirst()
+    portfolios = []
+    if current_agreement is not None:
+        portfolios = await _aagreement_portfolios(current_agreement.pk)
+    await sync_to_async(_load_messages)(request)
+
+    context = dashboard_context(
+        request, agreements, sort, query, agreement_rows, current_agreement, portfolios, filter_form
+    )
+    return await sync_to_async(render)(request, 'credits/dashboard.html', context)
+
+
+async def async_agreement_portfolios_view(request, pk):
+    """Portfolios panel fragment for ASGI, read with the async ORM"""
+    agreement = await Agreement.objects.only('id', 'agreement_code').filter(pk=pk).afirst()
+    if agreement is None:
+        raise Http404
+
+    context = {
+        'current_agreement': agreement,
+        'portfolios': await _aagreement_portfolios(agreement.pk),
+    }
+    return await sync_to_async(render)(request, 'credits/portfolios_panel.html', context)
+
+
+class Echo:
+    """File-like object that returns written values instead of buffering them"""
+
+    def write(self, value):
+        return value
+
+
+def _date(value):
+    return value.strftime('%d.%m.%Y') if value else ''
+
+
+def _with_creditors(agreements):
+    # Creditors from the registry, one lookup per chunk
+    while chunk := list(islice(agreements, EXPORT_CHUNK_SIZE)):
+        yield from attach_creditors(chunk)
+
+
+def _export_rows(agreements):
+    yield EXPORT_HEADER
+    for a in _with_creditors(agreements):
+        agreement_columns = [
+            a.id,
+            a.agreement_code,
+            _date(timezone.localtime(a.agreement_date)),
+            a.get_agreement_type_display(),
+            a.creditor,
+            a.creditor_first or '',
+            currency_format(a.total_sum),
+            currency_format(a.total_amount),
+        ]
+        portfolios = a.portfolio_set.all()
+        if not portfolios:
+            yield agreement_columns
+        for p in portfolios:
+            yield agreement_columns + [
+                p.id,
+                p.label or '',
+                p.get_process_type_display(),
+                currency_format(p.total_sum),
+                _date(p.date_placement),
+                _date(p.date_finish),
+                _date(p.cession_date),
+            ]
+
+
+def export_view(request):
+    """Stream agreements with their portfolios as CSV in the dashboard's sort order"""
+    _, fields, descending = resolve_sort(request.GET.get('sort', 'id'), request.GET.get('dir', 'asc'))
     
-    return render(request, 'credits/dashboard.html', context)
+    queryset = AgreementFilterForm(request.GET).filter(Agreement.objects.all())
+    query = normalize_query(request.GET.get('q'))
+    if query:
+        queryset = search_agreements(queryset, query)
+    
+    # Rows are fetched chunk by chunk; portfolios are prefetched per chunk
+    agreements = (
+        queryset
+        .prefetch_related(
+            Prefetch('portfolio_set', queryset=Portfolio.objects.order_by('date_placement', 'id'))
+        )
+        .order_by(*keyset_ordering(fields, descending))
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    
+    writer = csv.writer(Echo(), delimiter=';')
+    rows = (writer.writerow(row) for row in _export_rows(agreements))
+    # BOM lets Excel detect UTF-8
+    content = chain(['\ufeff'], rows)
+    filename = f"agreements_{timezone.localdate():%Y%m%d}.csv"
+    return StreamingHttpResponse(
+        content,
+        content_type='text/csv; charset=utf-8',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
+
+
+async def async_export_view(request):
+    """CSV export for ASGI: rows are sent in batches as they are read, not collected in full"""
+    return stream_async(await sync_to_async(export_view)(request))
+
+
+def report_view(request):
+    """Portfolio analytics by month, creditor type and process type"""
+    context = {
+        'rows': portfolio_report(),
+    }
+    return render(request, 'credits/report.html', context)
 
 
 def agreement_create_view(request):
@@ -86,6 +324,7 @@ def agreement_update_view(request, pk):
             # Update document if uploaded
             if 'agreement_doc' in form.cleaned_data and form.cleaned_data['agreement_doc']:
                 agreement.agreement_doc = form.cleaned_data['agreement_doc']
+            form.attach_document(agreement)
             
             agreement.save()
             messages.success(request, f"Договор №{agreement.id} обновлен")
@@ -105,13 +344,14 @@ def agreement_update_view(request, pk):
 
 
 def agreement_delete_view(request, pk):
-    """Delete agreement"""
+    """Hide the agreement at once and delete it with its portfolios in the background"""
     agreement = get_object_or_404(Agreement, pk=pk)
     
     if request.method == 'POST':
-        agreement_id = agreement.id
-        agreement.delete()
-        messages.success(request, f"Договор №{agreement_id} удалён.")
+        job = schedule_deletion(agreement)
+        messages.success(
+            request, f"Договор №{agreement.id} скрыт и удаляется в фоне (портфелей: {job.total})."
+        )
         return redirect('credits:dashboard')
     
     context = {
@@ -120,9 +360,50 @@ def agreement_delete_view(request, pk):
     return render(request, 'credits/generic_confirm_delete.html', context)
 
 
+@require_safe
+def creditor_autocomplete_view(request):
+    """Creditors whose name starts with ?q=, optionally of one ?type=, for the autocomplete widget"""
+    queryset = Creditor.objects.name_prefix(normalize_query(request.GET.get('q')))
+    creditor_type = request.GET.get('type')
+    if creditor_type:
+        if not creditor_type.isdigit() or int(creditor_type) not in CreditorType.values:
+            return JsonResponse({'error': 'Неизвестный тип кредитора'}, status=400,
+                                json_dumps_params={'ensure_ascii': False})
+        queryset = queryset.filter(type=int(creditor_type))
+
+    # Порядок индекса (name_key, id); на одну строку больше - есть ли ещё
+    rows = list(
+        queryset.order_by('name_key', 'id').values_list('id', 'name', 'type')[:CREDITOR_AUTOCOMPLETE_LIMIT + 1]
+    )
+    results = [
+        {'id': pk, 'text': name, 'type': type_, 'type_display': CreditorType(type_).label}
+        for pk, name, type_ in rows[:CREDITOR_AUTOCOMPLETE_LIMIT]
+    ]
+    return JsonResponse(
+        {'results': results, 'more': len(rows) > CREDITOR_AUTOCOMPLETE_LIMIT},
+        json_dumps_params={'ensure_ascii': False},
+    )
+
+
+@require_safe
+def deletion_status_view(request, pk):
+    """Progress of a background deletion job"""
+    job = get_object_or_404(DeletionJob, pk=pk)
+    return JsonResponse({
+        'id': job.pk,
+        'object': job.label,
+        'status': job.status,
+        'total': job.total,
+        'deleted': job.deleted,
+        'progress': round(job.progress, 4),
+        'error': job.error or None,
+    }, json_dumps_params={'ensure_ascii': False})
+
+
 def portfolio_create_view(request, agreement_pk):
     """Create new portfolio for specific agreement"""
     agreement = get_object_or_404(Agreement, pk=agreement_pk)
+    attach_creditors([agreement], fields=['creditor'])
     
     if request.method == 'POST':
         form = PortfolioForm(request.POST, agreement=agreement)
@@ -145,7 +426,8 @@ def portfolio_create_view(request, agreement_pk):
 
 def portfolio_update_view(request, pk):
     """Update existing portfolio"""
-    portfolio = get_object_or_404(Portfolio, pk=pk)
+    portfolio = get_object_or_404(Portfolio.objects.select_related('agreement'), pk=pk)
+    attach_creditors([portfolio.agreement], fields=['creditor'])
     
     if request.method == 'POST':
         form = PortfolioForm(request.POST, instance=portfolio, agreement=portfolio.agreement)
@@ -159,12 +441,7 @@ def portfolio_update_view(request, pk):
             portfolio.cession_date = form.cleaned_data['cession_date'] or portfolio.cession_date
             
             # Update label based on new data
-            portfolio.label = (
-                f"{portfolio.agreement.creditor}_"
-                f"{portfolio.agreement.get_agreement_type_display()}_"
-                f"{portfolio.date_placement.strftime('%d.%m.%Y')}_"
-                f"{portfolio.get_process_type_display()}"
-            )
+            portfolio.label = portfolio.build_label()
             
             portfolio.save()
             messages.success(request, f"Портфель «{portfolio.label}» обновлен")
@@ -188,6 +465,60 @@ def portfolio_update_view(request, pk):
     return render(request, 'credits/portfolio_form.html', context)
 
 
+def portfolio_bulk_edit_view(request, agreement_pk):
+    """
+    Set process type, dates or sum of selected portfolios of an agreement at once.
+    Accepts the HTML form or JSON ({"portfolios": [ids], "process_type": 3, ...}).
+    The query string filters the portfolios on offer (process_type, placement_from,
+    placement_to) and pages them; "select_all" applies the change to every match.
+    """
+    agreement = get_object_or_404(Agreement, pk=agreement_pk)
+    as_json = request.content_type == 'application/json'
+    selection = PortfolioSelectionForm(request.GET, auto_id='id_selection_%s')
+    choices = {
+        'agreement': agreement,
+        'queryset': selection.filter(agreement.portfolio_set.all()),
+        'page': request.GET.get('page'),
+    }
+
+    if request.method == 'POST':
+        if as_json:
+            try:
+                data = json.loads(request.body)
+            except ValueError:
+                data = None
+            if not isinstance(data, dict):
+                return JsonResponse({'error': 'Ожидается JSON-объект'}, status=400,
+                                    json_dumps_params={'ensure_ascii': False})
+        else:
+            data = request.POST
+        form = PortfolioBulkForm(data, **choices)
+        if form.is_valid():
+            portfolios = form.save()
+            if as_json:
+                return JsonResponse({
+                    'updated': len(portfolios),
+                    'portfolios': [{'id': p.pk, 'label': p.label} for p in portfolios],
+                }, json_dumps_params={'ensure_ascii': False})
+            messages.success(request, f"Обновлено портфелей: {len(portfolios)}")
+            return redirect(f"{reverse('credits:dashboard')}?agreement={agreement.pk}")
+        if as_json:
+            return JsonResponse({'errors': form.errors.get_json_data()}, status=400,
+                                json_dumps_params={'ensure_ascii': False})
+    else:
+        form = PortfolioBulkForm(**choices)
+
+    query = request.GET.copy()
+    query.pop('page', None)
+    context = {
+        'form': form,
+        'selection': selection,
+        'query': query.urlencode(),
+        'agreement': agreement,
+    }
+    return render(request, 'credits/portfolio_bulk_form.html', context)
+
+
 def portfolio_delete_view(request, pk):
     """Delete portfolio"""
     portfolio = get_object_or_404(Portfolio, pk=pk)